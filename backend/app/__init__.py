@@ -1,12 +1,36 @@
+import asyncio
+import os
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CollectorRegistry, make_asgi_app, multiprocess
 from redis import asyncio as aioredis
+from starlette.types import ASGIApp
 
 from . import auth, contextual_mab, mab, messages
-from .config import REDIS_HOST
+from .config import (
+    CMAB_REFIT_SCHEDULER_MAX_INTERVAL_SECONDS,
+    CMAB_UPDATE_BATCH_SIZE,
+    CMAB_UPDATE_INTERVAL_SECONDS,
+    CMAB_UPDATE_MODE,
+    CMAB_UPDATE_SWEEP_INTERVAL_SECONDS,
+    CONTEXTUAL_OBS_CHUNK_INTERVAL_SECONDS,
+    FIT_EXECUTOR_MAX_PENDING,
+    FIT_EXECUTOR_MAX_WORKERS,
+    FIT_TIMEOUT_SECONDS,
+    MAB_ARM_STATE_BACKEND,
+    MAB_FLUSH_BATCH_SIZE,
+    MAB_FLUSH_INTERVAL_SECONDS,
+    POSTERIOR_CACHE_SIZE,
+    REDIS_HOST,
+)
+from .contextual_mab.refits import run_refit_scheduler
+from .contextual_mab.update_queue import run_update_worker
+from .fit_executor import FitExecutor
+from .mab.arm_state import run_arm_state_flusher
+from .posterior_cache import PosteriorCache, listen_for_invalidations
 from .users.routers import (
     router as users_router,
 )  # to avoid circular imports
@@ -23,13 +47,76 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
 
     logger.info("Application started")
     app.state.redis = await aioredis.from_url(REDIS_HOST)
+    app.state.posterior_cache = PosteriorCache(maxsize=POSTERIOR_CACHE_SIZE)
+    app.state.fit_executor = FitExecutor(
+        max_workers=FIT_EXECUTOR_MAX_WORKERS,
+        max_pending=FIT_EXECUTOR_MAX_PENDING,
+        timeout_seconds=FIT_TIMEOUT_SECONDS,
+    )
+    background_tasks = [
+        asyncio.create_task(
+            listen_for_invalidations(app.state.redis, app.state.posterior_cache)
+        ),
+        asyncio.create_task(
+            run_refit_scheduler(
+                app.state.redis,
+                app.state.posterior_cache,
+                app.state.fit_executor,
+                CMAB_REFIT_SCHEDULER_MAX_INTERVAL_SECONDS,
+            )
+        ),
+    ]
+    if MAB_ARM_STATE_BACKEND == "redis":
+        background_tasks.append(
+            asyncio.create_task(
+                run_arm_state_flusher(
+                    app.state.redis, MAB_FLUSH_INTERVAL_SECONDS, MAB_FLUSH_BATCH_SIZE
+                )
+            )
+        )
+    # The update worker also appends contextual observations to the packed arm
+    # histories, so it runs in both update modes, only polling the update
+    # queues as often as it writes chunks in "sync" mode
+    background_tasks.append(
+        asyncio.create_task(
+            run_update_worker(
+                app.state.redis,
+                app.state.posterior_cache,
+                app.state.fit_executor,
+                (
+                    CMAB_UPDATE_INTERVAL_SECONDS
+                    if CMAB_UPDATE_MODE == "async"
+                    else CONTEXTUAL_OBS_CHUNK_INTERVAL_SECONDS
+                ),
+                CMAB_UPDATE_BATCH_SIZE,
+                CMAB_UPDATE_SWEEP_INTERVAL_SECONDS,
+                CONTEXTUAL_OBS_CHUNK_INTERVAL_SECONDS,
+            )
+        )
+    )
 
     yield
 
+    for task in background_tasks:
+        task.cancel()
+    app.state.fit_executor.shutdown()
     await app.state.redis.close()
     logger.info("Application finished")
 
 
+def create_metrics_app() -> ASGIApp:
+    """
+    Create the app serving Prometheus metrics, aggregated across workers when
+    running in multiprocess mode.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return make_asgi_app()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return make_asgi_app(registry=registry)
+
+
 def create_app() -> FastAPI:
     """
     Create a FastAPI application with the experiments router.
@@ -40,6 +127,7 @@ def create_app() -> FastAPI:
     app.include_router(auth.router)
     app.include_router(users_router)
     app.include_router(messages.router)
+    app.mount("/metrics", create_metrics_app())
 
     origins = [
         "http://localhost",
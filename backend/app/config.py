@@ -7,8 +7,98 @@ POSTGRES_PORT = os.environ.get("POSTGRES_PORT", "5432")
 POSTGRES_DB = os.environ.get("POSTGRES_DB", "postgres")
 DB_POOL_SIZE = os.environ.get("DB_POOL_SIZE", 20)  # Number of connections in the pool
 
+# Optional read replica for read-only endpoints, with the primary's settings
+# by default. Without a replica host, read-only sessions use the primary.
+POSTGRES_REPLICA_HOST = os.environ.get("POSTGRES_REPLICA_HOST", "")
+POSTGRES_REPLICA_PORT = os.environ.get("POSTGRES_REPLICA_PORT", POSTGRES_PORT)
+POSTGRES_REPLICA_USER = os.environ.get("POSTGRES_REPLICA_USER", POSTGRES_USER)
+POSTGRES_REPLICA_PASSWORD = os.environ.get(
+    "POSTGRES_REPLICA_PASSWORD", POSTGRES_PASSWORD
+)
+POSTGRES_REPLICA_DB = os.environ.get("POSTGRES_REPLICA_DB", POSTGRES_DB)
+
+# Replica lag above which read-only sessions fall back to the primary, and how
+# often each worker checks the lag
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 5.0))
+REPLICA_LAG_CHECK_INTERVAL_SECONDS = float(
+    os.environ.get("REPLICA_LAG_CHECK_INTERVAL_SECONDS", 1.0)
+)
+
 REDIS_HOST = os.environ.get("REDIS_HOST", "redis://localhost:6379")
 
+# Number of experiment posteriors each worker keeps in memory for draws
+POSTERIOR_CACHE_SIZE = int(os.environ.get("POSTERIOR_CACHE_SIZE", 1000))
+
+# Largest number of draws that can be requested in one batch draw call
+MAX_DRAW_BATCH_SIZE = int(os.environ.get("MAX_DRAW_BATCH_SIZE", 100000))
+
+# Largest number of outcomes that can be posted in one bulk upload
+MAX_OUTCOMES_BATCH_SIZE = int(os.environ.get("MAX_OUTCOMES_BATCH_SIZE", 100000))
+
+# Opt-in queues of precomputed MAB assignments: number of assignments sampled
+# per experiment (0 disables), queue length that triggers regeneration, and
+# number of posterior updates after which a queue is too stale to serve
+MAB_ASSIGNMENT_QUEUE_SIZE = int(os.environ.get("MAB_ASSIGNMENT_QUEUE_SIZE", 0))
+MAB_ASSIGNMENT_QUEUE_LOW_WATERMARK = int(
+    os.environ.get("MAB_ASSIGNMENT_QUEUE_LOW_WATERMARK", 100)
+)
+MAB_ASSIGNMENT_QUEUE_MAX_STALENESS = int(
+    os.environ.get("MAB_ASSIGNMENT_QUEUE_MAX_STALENESS", 10)
+)
+
+# Number of standard normal variates each worker pre-generates for sampling,
+# and an optional seed for reproducible draws
+VARIATE_POOL_SIZE = int(os.environ.get("VARIATE_POOL_SIZE", 2**16))
+VARIATE_POOL_SEED = (
+    int(os.environ["VARIATE_POOL_SEED"]) if "VARIATE_POOL_SEED" in os.environ else None
+)
+
+# Where MAB arm parameters are updated: "postgres", or "redis" with the
+# observations and arm snapshots written to Postgres by a background flusher
+MAB_ARM_STATE_BACKEND = os.environ.get("MAB_ARM_STATE_BACKEND", "postgres")
+MAB_FLUSH_INTERVAL_SECONDS = float(os.environ.get("MAB_FLUSH_INTERVAL_SECONDS", 1.0))
+MAB_FLUSH_BATCH_SIZE = int(os.environ.get("MAB_FLUSH_BATCH_SIZE", 1000))
+
+# Worker threads for contextual posterior fits, number of fits that can wait
+# for a thread before new ones are rejected with a 503, and fit timeout
+FIT_EXECUTOR_MAX_WORKERS = int(os.environ.get("FIT_EXECUTOR_MAX_WORKERS", 4))
+FIT_EXECUTOR_MAX_PENDING = int(os.environ.get("FIT_EXECUTOR_MAX_PENDING", 32))
+FIT_TIMEOUT_SECONDS = float(os.environ.get("FIT_TIMEOUT_SECONDS", 30.0))
+
+# How contextual arm posteriors are updated on a reward: "sync" in the request,
+# or "async" with rewards queued and applied in batches by a background worker
+CMAB_UPDATE_MODE = os.environ.get("CMAB_UPDATE_MODE", "sync")
+CMAB_UPDATE_INTERVAL_SECONDS = float(
+    os.environ.get("CMAB_UPDATE_INTERVAL_SECONDS", 0.25)
+)
+CMAB_UPDATE_BATCH_SIZE = int(os.environ.get("CMAB_UPDATE_BATCH_SIZE", 1000))
+# How often observations whose asynchronous update is still pending, because
+# queueing them failed, are queued again
+CMAB_UPDATE_SWEEP_INTERVAL_SECONDS = float(
+    os.environ.get("CMAB_UPDATE_SWEEP_INTERVAL_SECONDS", 60.0)
+)
+
+# Number of observations packed into each chunk of a contextual arm history,
+# and number of partly filled chunks after which an arm's chunks are compacted
+CONTEXTUAL_OBS_CHUNK_SIZE = int(os.environ.get("CONTEXTUAL_OBS_CHUNK_SIZE", 4096))
+CONTEXTUAL_OBS_COMPACT_EVERY = int(os.environ.get("CONTEXTUAL_OBS_COMPACT_EVERY", 64))
+
+# How often contextual observations saved by requests are appended to the
+# packed histories of their arms
+CONTEXTUAL_OBS_CHUNK_INTERVAL_SECONDS = float(
+    os.environ.get("CONTEXTUAL_OBS_CHUNK_INTERVAL_SECONDS", 5.0)
+)
+
+# Number of observations streamed to the database per COPY by the bulk writer
+OBSERVATION_COPY_BATCH_SIZE = int(os.environ.get("OBSERVATION_COPY_BATCH_SIZE", 10000))
+
+# Longest time workers wait between checks for contextual experiments due for an
+# interval refit. The worker that ran the last check wakes up when the next
+# refit is due, if that is sooner.
+CMAB_REFIT_SCHEDULER_MAX_INTERVAL_SECONDS = float(
+    os.environ.get("CMAB_REFIT_SCHEDULER_MAX_INTERVAL_SECONDS", 30.0)
+)
+
 BACKEND_ROOT_PATH = os.environ.get("BACKEND_ROOT_PATH", "")
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 
@@ -1,20 +1,30 @@
-from datetime import datetime, timezone
-from typing import Sequence
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, cast
 
 import numpy as np
 from sqlalchemy import (
+    ColumnElement,
+    DateTime,
     Float,
     ForeignKey,
     Integer,
+    LargeBinary,
+    Row,
+    Select,
     String,
+    Table,
     and_,
     delete,
+    func,
+    insert,
     select,
+    update,
 )
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
+from ..config import CONTEXTUAL_OBS_CHUNK_SIZE, CONTEXTUAL_OBS_COMPACT_EVERY
 from ..models import (
     ArmBaseDB,
     Base,
@@ -22,7 +32,14 @@ from ..models import (
     NotificationsDB,
     ObservationsBaseDB,
 )
-from .schemas import CMABObservation, ContextualBandit
+from ..schemas import ArmPriors, RewardLikelihood
+from .schemas import (
+    CMABObservation,
+    ContextualArmResponse,
+    ContextualBandit,
+    ContextualBanditSample,
+    RefitPolicy,
+)
 
 
 class ContextualBanditDB(ExperimentBaseDB):
@@ -46,9 +63,17 @@ class ContextualBanditDB(ExperimentBaseDB):
         "ContextDB", back_populates="experiment", lazy="joined"
     )
 
+    # Observations are only loaded on request, with `selectinload`, so that
+    # loading an experiment does not read its whole history
     observations: Mapped[list["ContextualObservationDB"]] = relationship(
-        "ContextualObservationDB", back_populates="experiment", lazy="joined"
+        "ContextualObservationDB", back_populates="experiment", lazy="raise"
+    )
+
+    refit_policy: Mapped[str] = mapped_column(
+        String(length=50), nullable=False, server_default="none"
     )
+    refit_every_observations: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    refit_interval_seconds: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
     __mapper_args__ = {"polymorphic_identity": "contextual_mabs"}
 
@@ -64,6 +89,9 @@ class ContextualBanditDB(ExperimentBaseDB):
             "created_datetime_utc": self.created_datetime_utc,
             "is_active": self.is_active,
             "n_trials": self.n_trials,
+            "refit_policy": self.refit_policy,
+            "refit_every_observations": self.refit_every_observations,
+            "refit_interval_seconds": self.refit_interval_seconds,
             "arms": [arm.to_dict() for arm in self.arms],
             "contexts": [context.to_dict() for context in self.contexts],
             "prior_type": self.prior_type,
@@ -94,7 +122,7 @@ class ContextualArmDB(ArmBaseDB):
         "ContextualBanditDB", back_populates="arms", lazy="joined"
     )
     observations: Mapped[list["ContextualObservationDB"]] = relationship(
-        "ContextualObservationDB", back_populates="arm", lazy="joined"
+        "ContextualObservationDB", back_populates="arm", lazy="raise"
     )
 
     __mapper_args__ = {"polymorphic_identity": "contextual_arms"}
@@ -111,10 +139,68 @@ class ContextualArmDB(ArmBaseDB):
             "sigma_init": self.sigma_init,
             "mu": self.mu,
             "covariance": self.covariance,
-            "observations": [obs.to_dict() for obs in self.observations],
         }
 
 
+class ContextualArmStatisticsDB(Base):
+    """
+    ORM for the sufficient statistics of the observations of a contextual arm
+    since its posterior was last reset, used to refit the arm without reading
+    its observations.
+
+    The arm posterior is refit as the `base` posterior updated with the
+    accumulated statistics. For normal rewards the statistics are X^T X and
+    X^T y scaled by the likelihood variance; for binary rewards they are the
+    weighted X^T W X and X^T W z of an IRLS step, with each observation
+    linearized at the arm mean when it was observed.
+    """
+
+    __tablename__ = "contextual_arm_statistics"
+
+    arm_id: Mapped[int] = mapped_column(
+        ForeignKey("contextual_arms.arm_id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    base_mu: Mapped[list[float]] = mapped_column(ARRAY(Float), nullable=False)
+    base_covariance: Mapped[list[float]] = mapped_column(ARRAY(Float), nullable=False)
+    xtwx: Mapped[list[float]] = mapped_column(ARRAY(Float), nullable=False)
+    xtwz: Mapped[list[float]] = mapped_column(ARRAY(Float), nullable=False)
+    n_observations: Mapped[int] = mapped_column(Integer, nullable=False)
+    n_since_refit: Mapped[int] = mapped_column(Integer, nullable=False)
+    last_refit_datetime_utc: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False
+    )
+
+
+# Observation chunks hold little-endian float64, the native byte order of the
+# hosts the app runs on, so that decoded chunks are used by numpy as they are
+OBSERVATION_CHUNK_DTYPE = np.dtype("<f8")
+
+
+class ContextualObservationChunkDB(Base):
+    """
+    ORM for append-only chunks of the observation history of a contextual
+    arm. Each chunk packs the rewards and the row-major (n, d) context matrix
+    of up to `CONTEXTUAL_OBS_CHUNK_SIZE` observations as float64 bytes, so
+    that the history of an arm is read with a few sequential reads and
+    decoded with `np.frombuffer`.
+    """
+
+    __tablename__ = "contextual_observation_chunks"
+
+    chunk_id: Mapped[int] = mapped_column(Integer, primary_key=True, nullable=False)
+    arm_id: Mapped[int] = mapped_column(
+        ForeignKey("contextual_arms.arm_id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    n_observations: Mapped[int] = mapped_column(Integer, nullable=False)
+    n_contexts: Mapped[int] = mapped_column(Integer, nullable=False)
+    rewards: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    contexts: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
 class ContextDB(Base):
     """
     ORM for managing context for an experiment
@@ -154,24 +240,16 @@ class ContextualObservationDB(ObservationsBaseDB):
     ORM for managing observations of an experiment
     """
 
-    __tablename__ = "contextual_observations"
-
-    observation_id: Mapped[int] = mapped_column(
-        ForeignKey("observations_base.observation_id", ondelete="CASCADE"),
-        primary_key=True,
-        nullable=False,
-    )
-
-    reward: Mapped[float] = mapped_column(Float, nullable=False)
-
-    context_val: Mapped[list[float]] = mapped_column(ARRAY(Float), nullable=False)
+    # Only set for contextual observations, see the check constraint on
+    # observations_base
+    context_val: Mapped[list[float]] = mapped_column(ARRAY(Float), nullable=True)
 
     experiment: Mapped[ContextualBanditDB] = relationship(
-        "ContextualBanditDB", back_populates="observations", lazy="joined"
+        "ContextualBanditDB", back_populates="observations", lazy="raise"
     )
 
     arm: Mapped[ContextualArmDB] = relationship(
-        "ContextualArmDB", back_populates="observations", lazy="joined"
+        "ContextualArmDB", back_populates="observations", lazy="raise"
     )
 
     __mapper_args__ = {"polymorphic_identity": "contextual_observations"}
@@ -232,6 +310,9 @@ async def save_contextual_mab_to_db(
         contexts=contexts,
         prior_type=experiment.prior_type.value,
         reward_type=experiment.reward_type.value,
+        refit_policy=experiment.refit_policy.value,
+        refit_every_observations=experiment.refit_every_observations,
+        refit_interval_seconds=experiment.refit_interval_seconds,
     )
 
     asession.add(experiment_db)
@@ -274,6 +355,274 @@ async def get_contextual_mab_by_id(
     return result.unique().scalar_one_or_none()
 
 
+async def get_contextual_mab_sample_by_id(
+    experiment_id: int, user_id: int, asession: AsyncSession
+) -> ContextualBanditSample | None:
+    """
+    Get the contextual experiment as needed to draw an arm or validate an
+    observation: the experiment with its contexts, and the arm posteriors.
+
+    The experiment is read with two narrow Core queries instead of the ORM
+    object, whose eager relationships load every observation of the
+    experiment, so that the cost does not grow with the number of
+    observations.
+    """
+    experiments = cast(Table, ExperimentBaseDB.__table__)
+    contextual_mabs = cast(Table, ContextualBanditDB.__table__)
+    contexts = cast(Table, ContextDB.__table__)
+    arms = cast(Table, ContextualArmDB.__table__)
+    arms_base = cast(Table, ArmBaseDB.__table__)
+
+    experiment_rows = (
+        await asession.execute(
+            select(
+                experiments.c.experiment_id,
+                experiments.c.name,
+                experiments.c.description,
+                experiments.c.is_active,
+                experiments.c.prior_type,
+                experiments.c.reward_type,
+                contextual_mabs.c.refit_policy,
+                contextual_mabs.c.refit_every_observations,
+                contextual_mabs.c.refit_interval_seconds,
+                contexts.c.context_id,
+                contexts.c.name.label("context_name"),
+                contexts.c.description.label("context_description"),
+                contexts.c.value_type,
+            )
+            .select_from(
+                experiments.join(
+                    contextual_mabs,
+                    experiments.c.experiment_id == contextual_mabs.c.experiment_id,
+                ).outerjoin(
+                    contexts,
+                    contextual_mabs.c.experiment_id == contexts.c.experiment_id,
+                )
+            )
+            .where(experiments.c.experiment_id == experiment_id)
+            .where(experiments.c.user_id == user_id)
+            .order_by(contexts.c.context_id)
+        )
+    ).all()
+    if not experiment_rows:
+        return None
+
+    arm_rows = (
+        await asession.execute(
+            select(
+                arms.c.arm_id,
+                arms_base.c.name,
+                arms_base.c.description,
+                arms.c.mu_init,
+                arms.c.sigma_init,
+                arms.c.mu,
+                arms.c.covariance,
+            )
+            .select_from(arms.join(arms_base, arms.c.arm_id == arms_base.c.arm_id))
+            .where(arms_base.c.experiment_id == experiment_id)
+            .order_by(arms.c.arm_id)
+        )
+    ).all()
+
+    experiment = experiment_rows[0]
+    return ContextualBanditSample.model_validate(
+        {
+            "experiment_id": experiment.experiment_id,
+            "name": experiment.name,
+            "description": experiment.description,
+            "is_active": experiment.is_active,
+            "prior_type": experiment.prior_type,
+            "reward_type": experiment.reward_type,
+            "refit_policy": experiment.refit_policy,
+            "refit_every_observations": experiment.refit_every_observations,
+            "refit_interval_seconds": experiment.refit_interval_seconds,
+            "arms": [row._asdict() for row in arm_rows],
+            "contexts": [
+                {
+                    "context_id": row.context_id,
+                    "name": row.context_name,
+                    "description": row.context_description,
+                    "value_type": row.value_type,
+                }
+                for row in experiment_rows
+                if row.context_id is not None
+            ],
+        }
+    )
+
+
+async def get_contextual_arm_for_update(
+    arm_id: int, asession: AsyncSession
+) -> tuple[ContextualArmResponse, ArmPriors, RewardLikelihood] | None:
+    """
+    Get the arm with the prior and reward types of its experiment, locking the
+    arm row until the session commits. Returns None if the arm is not found.
+    """
+    arms = cast(Table, ContextualArmDB.__table__)
+    arms_base = cast(Table, ArmBaseDB.__table__)
+    experiments = cast(Table, ExperimentBaseDB.__table__)
+
+    result = await asession.execute(
+        select(
+            arms.c.arm_id,
+            arms_base.c.name,
+            arms_base.c.description,
+            arms.c.mu_init,
+            arms.c.sigma_init,
+            arms.c.mu,
+            arms.c.covariance,
+            experiments.c.prior_type,
+            experiments.c.reward_type,
+        )
+        .select_from(
+            arms.join(arms_base, arms.c.arm_id == arms_base.c.arm_id).join(
+                experiments, arms_base.c.experiment_id == experiments.c.experiment_id
+            )
+        )
+        .where(arms.c.arm_id == arm_id)
+        .with_for_update(of=arms)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
+
+    arm = row._asdict()
+    prior_type, reward_type = arm.pop("prior_type"), arm.pop("reward_type")
+    return (
+        ContextualArmResponse.model_validate(arm),
+        ArmPriors(prior_type),
+        RewardLikelihood(reward_type),
+    )
+
+
+async def lock_contextual_arm(arm_id: int, asession: AsyncSession) -> None:
+    """
+    Lock the arm row until the session commits, to serialize writes to the
+    rows that hang off the arm.
+    """
+    arms = cast(Table, ContextualArmDB.__table__)
+    await asession.execute(
+        select(arms.c.arm_id).where(arms.c.arm_id == arm_id).with_for_update()
+    )
+
+
+async def update_contextual_arm_params(
+    arm_id: int, mu: np.ndarray, covariance: np.ndarray, asession: AsyncSession
+) -> None:
+    """
+    Set the posterior parameters of the arm. The change is committed with the
+    rest of the session.
+    """
+    arms = cast(Table, ContextualArmDB.__table__)
+    await asession.execute(
+        update(arms)
+        .where(arms.c.arm_id == arm_id)
+        .values(mu=mu.tolist(), covariance=covariance.tolist())
+    )
+
+
+async def get_contextual_arm_statistics_for_update(
+    arm_ids: Sequence[int], asession: AsyncSession
+) -> Sequence[ContextualArmStatisticsDB]:
+    """
+    Get the accumulated statistics of the given arms, locking the rows until
+    the session commits. Arms without statistics are left out.
+    """
+    statement = (
+        select(ContextualArmStatisticsDB)
+        .where(ContextualArmStatisticsDB.arm_id.in_(arm_ids))
+        .order_by(ContextualArmStatisticsDB.arm_id)
+        .with_for_update()
+    )
+
+    return (await asession.execute(statement)).scalars().all()
+
+
+async def delete_contextual_arm_statistics(arm_id: int, asession: AsyncSession) -> None:
+    """
+    Drop the accumulated statistics of the arm, so that accumulation restarts
+    from its current posterior. The change is committed with the rest of the
+    session.
+    """
+    await asession.execute(
+        delete(ContextualArmStatisticsDB).where(
+            ContextualArmStatisticsDB.arm_id == arm_id
+        )
+    )
+
+
+async def get_contextual_arm_ids_by_experiment_id(
+    experiment_id: int, asession: AsyncSession
+) -> Sequence[int]:
+    """
+    Get the ids of the arms of the experiment.
+    """
+    arms_base = cast(Table, ArmBaseDB.__table__)
+    statement = select(arms_base.c.arm_id).where(
+        arms_base.c.experiment_id == experiment_id
+    )
+
+    return (await asession.execute(statement)).scalars().all()
+
+
+def _seconds_until_interval_refit() -> tuple[Select, ColumnElement]:
+    """
+    Get a statement over the arms of the experiments with the interval refit
+    policy that have observations accumulated since their last refit, and the
+    expression of the seconds until the refit of the arm is due.
+    """
+    experiments = cast(Table, ContextualBanditDB.__table__)
+    arms_base = cast(Table, ArmBaseDB.__table__)
+    statistics = cast(Table, ContextualArmStatisticsDB.__table__)
+    seconds_until_refit = experiments.c.refit_interval_seconds - func.extract(
+        "epoch", func.now() - statistics.c.last_refit_datetime_utc
+    )
+
+    statement = (
+        select()
+        .select_from(
+            statistics.join(arms_base, statistics.c.arm_id == arms_base.c.arm_id).join(
+                experiments, arms_base.c.experiment_id == experiments.c.experiment_id
+            )
+        )
+        .where(experiments.c.refit_policy == RefitPolicy.INTERVAL.value)
+        .where(statistics.c.n_since_refit > 0)
+    )
+
+    return statement, seconds_until_refit
+
+
+async def get_experiments_due_for_refit(
+    asession: AsyncSession,
+) -> Sequence[int]:
+    """
+    Get the ids of the experiments with the interval refit policy that have an
+    arm with observations accumulated since a refit more than
+    `refit_interval_seconds` seconds ago.
+    """
+    experiments = cast(Table, ContextualBanditDB.__table__)
+    statement, seconds_until_refit = _seconds_until_interval_refit()
+    statement = (
+        statement.add_columns(experiments.c.experiment_id)
+        .distinct()
+        .where(seconds_until_refit <= 0)
+    )
+
+    return (await asession.execute(statement)).scalars().all()
+
+
+async def get_seconds_until_next_refit(asession: AsyncSession) -> float | None:
+    """
+    Get the number of seconds until the next interval refit is due, which is
+    negative if a refit is overdue, or None if no refit is pending.
+    """
+    statement, seconds_until_refit = _seconds_until_interval_refit()
+    statement = statement.add_columns(func.min(seconds_until_refit))
+
+    seconds = (await asession.execute(statement)).scalar_one()
+    return float(seconds) if seconds is not None else None
+
+
 async def delete_contextual_mab_by_id(
     experiment_id: int, user_id: int, asession: AsyncSession
 ) -> None:
@@ -287,13 +636,9 @@ async def delete_contextual_mab_by_id(
     )
 
     await asession.execute(
-        delete(ContextualObservationDB).where(
-            and_(
-                ContextualObservationDB.user_id == ObservationsBaseDB.user_id,
-                ContextualObservationDB.user_id == user_id,
-                ContextualObservationDB.experiment_id == experiment_id,
-            )
-        )
+        delete(ContextualObservationDB)
+        .where(ContextualObservationDB.user_id == user_id)
+        .where(ContextualObservationDB.experiment_id == experiment_id)
     )
 
     await asession.execute(
@@ -330,9 +675,16 @@ async def save_contextual_obs_to_db(
     experiment_id: int,
     user_id: int,
     asession: AsyncSession,
+    update_pending: bool = False,
 ) -> ContextualObservationDB:
     """
-    Save the observation to the database.
+    Save the observation to the database. With `update_pending`, the
+    observation is flagged as waiting to be applied to the arm posterior by
+    the update worker.
+
+    The observation is flagged as waiting to be appended to the packed history
+    of the arm, which the update worker does in batches, so that a request
+    does not pay for the chunk writes and compactions.
     """
     observation_db = ContextualObservationDB(
         arm_id=observation.arm_id,
@@ -341,6 +693,8 @@ async def save_contextual_obs_to_db(
         reward=observation.reward,
         context_val=observation.context_val,
         observed_datetime_utc=datetime.now(timezone.utc),
+        update_pending=update_pending,
+        chunk_pending=True,
     )
 
     asession.add(observation_db)
@@ -350,6 +704,315 @@ async def save_contextual_obs_to_db(
     return observation_db
 
 
+async def clear_contextual_obs_update_pending(
+    experiment_id: int, observation_ids: Sequence[int], asession: AsyncSession
+) -> set[int]:
+    """
+    Mark the observations as applied to the arm posterior. Returns the ids of
+    the observations that were still pending, which are the only ones to
+    apply. The change is committed with the rest of the session.
+    """
+    observations = cast(Table, ObservationsBaseDB.__table__)
+    result = await asession.execute(
+        update(observations)
+        .where(observations.c.experiment_id == experiment_id)
+        .where(observations.c.observation_id.in_(observation_ids))
+        .where(observations.c.update_pending)
+        .values(update_pending=False)
+        .returning(observations.c.observation_id)
+    )
+    return set(result.scalars().all())
+
+
+async def get_contextual_obs_pending_update(
+    older_than_seconds: float, limit: int, asession: AsyncSession
+) -> Sequence[Row]:
+    """
+    Get up to `limit` observations saved more than `older_than_seconds` ago
+    that are still waiting to be applied to their arm posterior, oldest first.
+    """
+    observations = cast(Table, ObservationsBaseDB.__table__)
+    statement = (
+        select(
+            observations.c.observation_id,
+            observations.c.experiment_id,
+            observations.c.arm_id,
+            observations.c.reward,
+            observations.c.context_val,
+        )
+        .where(observations.c.update_pending)
+        .where(
+            observations.c.observed_datetime_utc
+            < datetime.now(timezone.utc) - timedelta(seconds=older_than_seconds)
+        )
+        .order_by(observations.c.observed_datetime_utc)
+        .limit(limit)
+    )
+    return (await asession.execute(statement)).all()
+
+
+def pack_observation_chunks(rewards: np.ndarray, contexts: np.ndarray) -> list[dict]:
+    """
+    Split observations into chunks of at most `CONTEXTUAL_OBS_CHUNK_SIZE`
+    observations, with their rewards and contexts packed as bytes.
+    """
+    packed = []
+    for start in range(0, len(rewards), CONTEXTUAL_OBS_CHUNK_SIZE):
+        chunk = slice(start, start + CONTEXTUAL_OBS_CHUNK_SIZE)
+        packed.append(
+            {
+                "n_observations": len(rewards[chunk]),
+                "rewards": rewards[chunk].astype(OBSERVATION_CHUNK_DTYPE).tobytes(),
+                "contexts": contexts[chunk].astype(OBSERVATION_CHUNK_DTYPE).tobytes(),
+            }
+        )
+    return packed
+
+
+def get_open_chunks_condition(arm_id: int) -> ColumnElement[bool]:
+    """
+    Condition selecting the chunks of the arm history after its last full
+    chunk, which are the ones compaction packs together.
+    """
+    chunks = cast(Table, ContextualObservationChunkDB.__table__)
+    last_full_chunk_id = (
+        select(func.coalesce(func.max(chunks.c.chunk_id), 0))
+        .where(chunks.c.arm_id == arm_id)
+        .where(chunks.c.n_observations >= CONTEXTUAL_OBS_CHUNK_SIZE)
+        .scalar_subquery()
+    )
+    return and_(chunks.c.arm_id == arm_id, chunks.c.chunk_id > last_full_chunk_id)
+
+
+async def append_contextual_obs_to_chunks(
+    arm_id: int, rewards: np.ndarray, contexts: np.ndarray, asession: AsyncSession
+) -> None:
+    """
+    Append observations to the arm history as new chunks of at most
+    `CONTEXTUAL_OBS_CHUNK_SIZE` observations. Appends never rewrite existing
+    chunks, so that a write costs the size of the new observations; the partly
+    filled chunks after the last full one are packed together once
+    `CONTEXTUAL_OBS_COMPACT_EVERY` of them have accumulated. The change is
+    committed with the rest of the session.
+
+    Parameters
+    ----------
+    arm_id : The arm the observations are for.
+    rewards : The rewards, of shape (m,).
+    contexts : The context vectors, of shape (m, d).
+    """
+    chunks = cast(Table, ContextualObservationChunkDB.__table__)
+    n_contexts = contexts.shape[1]
+    await asession.execute(
+        insert(chunks),
+        [
+            {"arm_id": arm_id, "n_contexts": n_contexts, **chunk}
+            for chunk in pack_observation_chunks(rewards, contexts)
+        ],
+    )
+
+    n_open_chunks = (
+        await asession.execute(
+            select(func.count())
+            .select_from(chunks)
+            .where(get_open_chunks_condition(arm_id))
+        )
+    ).scalar_one()
+    if n_open_chunks >= CONTEXTUAL_OBS_COMPACT_EVERY:
+        await compact_contextual_obs_chunks(arm_id, asession)
+
+
+async def compact_contextual_obs_chunks(arm_id: int, asession: AsyncSession) -> None:
+    """
+    Pack the chunks of the arm history that follow its last full chunk into
+    as few chunks of at most `CONTEXTUAL_OBS_CHUNK_SIZE` observations as
+    possible. The packed chunks keep the ids of the chunks they replace, so
+    that the history keeps its order. The change is committed with the rest
+    of the session.
+
+    Compactions of an arm are serialized on its row, which is locked until
+    the session commits, so that a chunk never exceeds the cap.
+    """
+    chunks = cast(Table, ContextualObservationChunkDB.__table__)
+    await lock_contextual_arm(arm_id, asession)
+
+    rows = (
+        await asession.execute(
+            select(
+                chunks.c.chunk_id,
+                chunks.c.n_contexts,
+                chunks.c.rewards,
+                chunks.c.contexts,
+            )
+            .where(get_open_chunks_condition(arm_id))
+            .order_by(chunks.c.chunk_id)
+        )
+    ).all()
+
+    # Pack each run of chunks with the same number of contexts separately
+    packed: list[dict] = []
+    for n_contexts in dict.fromkeys(row.n_contexts for row in rows):
+        run = [row for row in rows if row.n_contexts == n_contexts]
+        if len(run) < 2:
+            continue
+        rewards = np.concatenate(
+            [np.frombuffer(row.rewards, dtype=OBSERVATION_CHUNK_DTYPE) for row in run]
+        )
+        contexts = np.concatenate(
+            [
+                np.frombuffer(row.contexts, dtype=OBSERVATION_CHUNK_DTYPE).reshape(
+                    -1, n_contexts
+                )
+                for row in run
+            ]
+        )
+        chunk_ids = [row.chunk_id for row in run]
+        run_packed = pack_observation_chunks(rewards, contexts)
+        packed.extend(
+            {"chunk_id": chunk_id, **chunk}
+            for chunk_id, chunk in zip(chunk_ids, run_packed)
+        )
+        await asession.execute(
+            delete(chunks).where(chunks.c.chunk_id.in_(chunk_ids[len(run_packed) :]))
+        )
+
+    for chunk in packed:
+        await asession.execute(
+            update(chunks)
+            .where(chunks.c.chunk_id == chunk["chunk_id"])
+            .values(
+                n_observations=chunk["n_observations"],
+                rewards=chunk["rewards"],
+                contexts=chunk["contexts"],
+            )
+        )
+
+
+async def get_arms_with_obs_pending_chunks(
+    limit: int, asession: AsyncSession
+) -> Sequence[Row]:
+    """
+    Get the experiment and arm ids of up to `limit` arms with observations
+    waiting to be appended to their packed history.
+    """
+    observations = cast(Table, ObservationsBaseDB.__table__)
+    statement = (
+        select(observations.c.experiment_id, observations.c.arm_id)
+        .distinct()
+        .where(observations.c.chunk_pending)
+        .limit(limit)
+    )
+    return (await asession.execute(statement)).all()
+
+
+def _pending_chunk_obs_statement(arm_id: int) -> Select:
+    """
+    Select the observations of the arm waiting to be appended to its packed
+    history, in the order they were observed.
+    """
+    observations = cast(Table, ObservationsBaseDB.__table__)
+    return (
+        select(observations.c.reward, observations.c.context_val)
+        .where(observations.c.arm_id == arm_id)
+        .where(observations.c.chunk_pending)
+        .order_by(observations.c.observed_datetime_utc, observations.c.observation_id)
+    )
+
+
+async def append_pending_obs_to_chunks(
+    experiment_id: int, arm_id: int, limit: int, asession: AsyncSession
+) -> int:
+    """
+    Append up to `limit` of the observations of the arm waiting to be appended
+    to its packed history, oldest first, and clear their flag. Returns the
+    number of observations appended. The change is committed with the rest of
+    the session.
+
+    The arm row is locked until the session commits, so that appends to an
+    arm keep the order of its observations and readers of the history never
+    see an observation both pending and in a chunk.
+    """
+    observations = cast(Table, ObservationsBaseDB.__table__)
+    await lock_contextual_arm(arm_id, asession)
+
+    pending = (
+        _pending_chunk_obs_statement(arm_id)
+        .add_columns(observations.c.observation_id)
+        .where(observations.c.experiment_id == experiment_id)
+        .limit(limit)
+        .subquery()
+    )
+    rows = (
+        await asession.execute(
+            update(observations)
+            .where(observations.c.experiment_id == experiment_id)
+            .where(observations.c.observation_id.in_(select(pending.c.observation_id)))
+            .where(observations.c.chunk_pending)
+            .values(chunk_pending=False)
+            .returning(
+                observations.c.observed_datetime_utc,
+                observations.c.observation_id,
+                observations.c.reward,
+                observations.c.context_val,
+            )
+        )
+    ).all()
+    if not rows:
+        return 0
+
+    rows = sorted(rows, key=lambda row: (row.observed_datetime_utc, row.observation_id))
+    await append_contextual_obs_to_chunks(
+        arm_id,
+        np.array([row.reward for row in rows]),
+        np.array([row.context_val for row in rows]),
+        asession,
+    )
+    return len(rows)
+
+
+async def get_contextual_arm_history(
+    arm_id: int, asession: AsyncSession
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the rewards and the (n, d) context matrix of all observations of the
+    arm, in the order they were observed, from the packed chunks followed by
+    the observations not yet appended to them. The arrays can be read-only
+    views of the chunks.
+
+    The arm row is locked until the session commits, so that the history is
+    not read while observations are moved into the chunks.
+    """
+    chunks = cast(Table, ContextualObservationChunkDB.__table__)
+    await lock_contextual_arm(arm_id, asession)
+
+    result = await asession.execute(
+        select(chunks.c.n_contexts, chunks.c.rewards, chunks.c.contexts)
+        .where(chunks.c.arm_id == arm_id)
+        .order_by(chunks.c.chunk_id)
+    )
+    rows = result.all()
+    rewards = [
+        np.frombuffer(row.rewards, dtype=OBSERVATION_CHUNK_DTYPE) for row in rows
+    ]
+    contexts = [
+        np.frombuffer(row.contexts, dtype=OBSERVATION_CHUNK_DTYPE).reshape(
+            -1, row.n_contexts
+        )
+        for row in rows
+    ]
+
+    pending = (await asession.execute(_pending_chunk_obs_statement(arm_id))).all()
+    if pending:
+        rewards.append(np.array([row.reward for row in pending]))
+        contexts.append(np.array([row.context_val for row in pending]))
+
+    if not rewards:
+        return np.empty(0), np.empty((0, 0))
+    if len(rewards) == 1:
+        return rewards[0], contexts[0]
+    return np.concatenate(rewards), np.concatenate(contexts)
+
+
 async def get_contextual_obs_by_experiment_arm_id(
     experiment_id: int, arm_id: int, user_id: int, asession: AsyncSession
 ) -> Sequence[ContextualObservationDB]:
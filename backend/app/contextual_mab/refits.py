@@ -0,0 +1,177 @@
+"""
+Mini-batch refits of contextual arm posteriors from sufficient statistics.
+
+For experiments with a refit policy other than "none", rewards are not folded
+into the arm posterior one at a time. Instead each reward adds its sufficient
+statistics to the `contextual_arm_statistics` row of the arm, and the arm
+posteriors are refit from those statistics every `refit_every_observations`
+observations, every `refit_interval_seconds` seconds, or on demand, without
+reading the observations.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Sequence
+
+import numpy as np
+from redis import asyncio as aioredis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_sqlalchemy_async_engine
+from ..fit_executor import FitExecutor
+from ..posterior_cache import PosteriorCache, invalidate_posterior
+from ..redis_queues import acquire_lock, release_lock
+from ..schemas import RewardLikelihood
+from ..utils import setup_logger
+from .models import (
+    ContextualArmStatisticsDB,
+    get_contextual_arm_ids_by_experiment_id,
+    get_contextual_arm_statistics_for_update,
+    get_experiments_due_for_refit,
+    get_seconds_until_next_refit,
+    lock_contextual_arm,
+    update_contextual_arm_params,
+)
+from .sampling_utils import get_observation_statistics, refit_arm_from_statistics
+from .schemas import ContextualArmResponse
+
+logger = setup_logger()
+
+REFIT_SCHEDULER_LOCK_KEY = "cmab-refits:scheduler-lock"
+
+
+async def accumulate_arm_statistics(
+    arm: ContextualArmResponse,
+    reward_type: RewardLikelihood,
+    reward: float,
+    context: list[float],
+    asession: AsyncSession,
+) -> ContextualArmStatisticsDB:
+    """
+    Add an observation to the sufficient statistics of the arm, starting the
+    statistics from the current arm posterior if the arm has none. The change
+    is committed with the rest of the session.
+    """
+    xtwx, xtwz = get_observation_statistics(
+        np.array(arm.mu),
+        reward_type,
+        np.array([reward], dtype=np.float64),
+        np.array([context], dtype=np.float64),
+    )
+
+    # Lock the arm first, so that concurrent first observations of the arm do
+    # not both create its statistics
+    await lock_contextual_arm(arm.arm_id, asession)
+    statistics = await get_contextual_arm_statistics_for_update([arm.arm_id], asession)
+    if not statistics:
+        statistics_db = ContextualArmStatisticsDB(
+            arm_id=arm.arm_id,
+            base_mu=arm.mu,
+            base_covariance=arm.covariance,
+            xtwx=xtwx.tolist(),
+            xtwz=xtwz.tolist(),
+            n_observations=1,
+            n_since_refit=1,
+            last_refit_datetime_utc=datetime.now(timezone.utc),
+        )
+        asession.add(statistics_db)
+        return statistics_db
+
+    statistics_db = statistics[0]
+    statistics_db.xtwx = (np.array(statistics_db.xtwx) + xtwx).tolist()
+    statistics_db.xtwz = (np.array(statistics_db.xtwz) + xtwz).tolist()
+    statistics_db.n_observations += 1
+    statistics_db.n_since_refit += 1
+    return statistics_db
+
+
+async def refit_arms(
+    arm_ids: Sequence[int], asession: AsyncSession, fit_executor: FitExecutor
+) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """
+    Refit the posteriors of the given arms that have observations accumulated
+    since their last refit. Returns the new mean and covariance of each refit
+    arm. The changes are committed with the rest of the session.
+    """
+    refits = {}
+    for statistics_db in await get_contextual_arm_statistics_for_update(
+        arm_ids, asession
+    ):
+        if statistics_db.n_since_refit == 0:
+            continue
+
+        mu, covariance = await fit_executor.run(
+            refit_arm_from_statistics,
+            base_mu=np.array(statistics_db.base_mu),
+            base_covariance=np.array(statistics_db.base_covariance),
+            xtwx=np.array(statistics_db.xtwx),
+            xtwz=np.array(statistics_db.xtwz),
+        )
+        await update_contextual_arm_params(
+            statistics_db.arm_id, mu, covariance, asession
+        )
+        statistics_db.n_since_refit = 0
+        statistics_db.last_refit_datetime_utc = datetime.now(timezone.utc)
+        refits[statistics_db.arm_id] = (mu, covariance)
+
+    return refits
+
+
+async def refit_due_experiments(
+    redis: aioredis.Redis,
+    asession: AsyncSession,
+    cache: PosteriorCache,
+    fit_executor: FitExecutor,
+) -> list[int]:
+    """
+    Refit the experiments with the interval refit policy whose refit is due,
+    committing and invalidating each experiment in turn. Returns the ids of
+    the refit experiments.
+    """
+    experiment_ids = list(await get_experiments_due_for_refit(asession))
+    for experiment_id in experiment_ids:
+        arm_ids = await get_contextual_arm_ids_by_experiment_id(experiment_id, asession)
+        await refit_arms(arm_ids, asession, fit_executor)
+        await asession.commit()
+        await invalidate_posterior(cache, redis, experiment_id)
+
+    return experiment_ids
+
+
+async def run_refit_scheduler(
+    redis: aioredis.Redis,
+    cache: PosteriorCache,
+    fit_executor: FitExecutor,
+    max_interval: float,
+) -> None:
+    """
+    Refit the experiments due for an interval refit. Only one worker refits at
+    a time, and then sleeps until the next refit is due, at most
+    `max_interval` seconds. The other workers check every `max_interval`
+    seconds, in case that worker stopped. A refit that becomes due while the
+    workers sleep, when an arm gets its first observation since a refit long
+    ago, runs up to `max_interval` seconds late. Runs until cancelled.
+    """
+    lock_timeout_ms = int(max(max_interval * 10, 30) * 1000)
+    while True:
+        delay = max_interval
+        try:
+            token = await acquire_lock(redis, REFIT_SCHEDULER_LOCK_KEY, lock_timeout_ms)
+            if token is not None:
+                try:
+                    async with AsyncSession(
+                        get_sqlalchemy_async_engine(), expire_on_commit=False
+                    ) as asession:
+                        await refit_due_experiments(
+                            redis, asession, cache, fit_executor
+                        )
+                        seconds = await get_seconds_until_next_refit(asession)
+                    if seconds is not None:
+                        delay = min(max(seconds, 0.0), max_interval)
+                finally:
+                    await release_lock(redis, REFIT_SCHEDULER_LOCK_KEY, token)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error refitting contextual experiments: {e}")
+        await asyncio.sleep(delay)
@@ -1,33 +1,57 @@
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends
+import numpy as np
+from fastapi import APIRouter, Body, Depends, Query, Request, Response
 from fastapi.exceptions import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..auth.dependencies import authenticate_key, get_current_user
-from ..database import get_async_session
+from ..config import CMAB_UPDATE_MODE, MAX_DRAW_BATCH_SIZE
+from ..database import get_async_session, get_readonly_session
 from ..models import get_notifications_from_db, save_notifications_to_db
+from ..posterior_cache import get_or_load_posterior, invalidate_posterior
 from ..schemas import ContextType, NotificationsResponse, Outcome
 from ..users.models import UserDB
+from ..utils import setup_logger
 from .models import (
+    delete_contextual_arm_statistics,
     delete_contextual_mab_by_id,
     get_all_contextual_mabs,
     get_all_contextual_obs_by_experiment_id,
+    get_contextual_arm_for_update,
+    get_contextual_arm_history,
     get_contextual_mab_by_id,
-    get_contextual_obs_by_experiment_arm_id,
+    get_contextual_mab_sample_by_id,
     save_contextual_mab_to_db,
     save_contextual_obs_to_db,
+    update_contextual_arm_params,
+)
+from .refits import accumulate_arm_statistics, refit_arms
+from .sampling_utils import (
+    ContextualPosterior,
+    choose_arm,
+    choose_arms,
+    choose_arms_for_contexts,
+    get_contextual_posterior,
+    refit_arm_params,
+    update_arm_params,
 )
-from .sampling_utils import choose_arm, update_arm_params
 from .schemas import (
     CMABObservation,
     CMABObservationResponse,
     ContextInput,
+    ContextualArmDraw,
     ContextualArmResponse,
     ContextualBandit,
+    ContextualBanditDrawBatch,
+    ContextualBanditDrawContexts,
     ContextualBanditResponse,
     ContextualBanditSample,
+    RefitPolicy,
 )
+from .update_queue import delete_pending_updates, enqueue_update
+
+logger = setup_logger()
 
 router = APIRouter(prefix="/contextual_mab", tags=["Contextual Bandits"])
 
@@ -56,7 +80,7 @@ async def create_contextual_mabs(
 @router.get("/", response_model=list[ContextualBanditResponse])
 async def get_contextual_mabs(
     user_db: Annotated[UserDB, Depends(get_current_user)],
-    asession: AsyncSession = Depends(get_async_session),
+    asession: AsyncSession = Depends(get_readonly_session),
 ) -> list[ContextualBanditResponse]:
     """
     Get details of all experiments.
@@ -116,6 +140,7 @@ async def get_contextual_mab(
 @router.delete("/{experiment_id}", response_model=dict)
 async def delete_contextual_mab(
     experiment_id: int,
+    request: Request,
     user_db: Annotated[UserDB, Depends(get_current_user)],
     asession: AsyncSession = Depends(get_async_session),
 ) -> dict:
@@ -123,39 +148,65 @@ async def delete_contextual_mab(
     Delete the experiment with the provided `experiment_id`.
     """
     try:
-        experiment = await get_contextual_mab_by_id(
+        experiment = await get_contextual_mab_sample_by_id(
             experiment_id, user_db.user_id, asession
         )
         if experiment is None:
             raise HTTPException(
                 status_code=404, detail=f"Experiment with id {experiment_id} not found"
             )
+        arm_ids = [arm.arm_id for arm in experiment.arms]
         await delete_contextual_mab_by_id(experiment_id, user_db.user_id, asession)
+        await delete_pending_updates(request.app.state.redis, arm_ids)
+        await invalidate_posterior(
+            request.app.state.posterior_cache, request.app.state.redis, experiment_id
+        )
         return {"detail": f"Experiment {experiment_id} deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {e}") from e
 
 
-@router.post("/{experiment_id}/draw", response_model=ContextualArmResponse)
-async def draw_arm(
-    experiment_id: int,
-    context: List[ContextInput],
-    user_db: UserDB = Depends(authenticate_key),
-    asession: AsyncSession = Depends(get_async_session),
-) -> ContextualArmResponse:
+async def get_draw_posterior(
+    request: Request, experiment_id: int, user_id: int, asession: AsyncSession
+) -> tuple[ContextualPosterior, int]:
     """
-    Get which arm to pull next for provided experiment.
+    Get the posterior to draw from for the experiment and its version, using
+    the worker's posterior cache so that the arm covariances are only factored
+    once per posterior change.
     """
-    experiment = await get_contextual_mab_by_id(
-        experiment_id, user_db.user_id, asession
+
+    async def load_posterior() -> ContextualPosterior | None:
+        """
+        Load the experiment and prepare its posterior for sampling.
+        """
+        experiment = await get_contextual_mab_sample_by_id(
+            experiment_id, user_id, asession
+        )
+        return None if experiment is None else get_contextual_posterior(experiment)
+
+    posterior = await get_or_load_posterior(
+        request.app.state.posterior_cache,
+        request.app.state.redis,
+        experiment_id,
+        user_id,
+        load_posterior,
     )
 
-    if experiment is None:
+    if posterior is None:
         raise HTTPException(
             status_code=404, detail=f"Experiment with id {experiment_id} not found"
         )
+    return ContextualPosterior.model_validate(posterior.sample), posterior.version
+
 
-    if len(experiment.contexts) != len(context):
+def get_context_values(
+    experiment_data: ContextualBanditSample, context: List[ContextInput]
+) -> list[float]:
+    """
+    Validate the provided contexts against the experiment and return the context
+    vector ordered by `context_id`.
+    """
+    if len(experiment_data.contexts) != len(context):
         raise HTTPException(
             status_code=400,
             detail="Number of contexts provided does not match the num contexts.",
@@ -163,113 +214,395 @@ async def draw_arm(
 
     for c_input, c_exp in zip(
         sorted(context, key=lambda x: x.context_id),
-        sorted(experiment.contexts, key=lambda x: x.context_id),
+        sorted(experiment_data.contexts, key=lambda x: x.context_id),
     ):
         if c_exp.value_type == ContextType.BINARY.value:
             Outcome(c_input.context_value)
 
-    experiment_data = ContextualBanditSample.model_validate(experiment)
+    return [c.context_value for c in sorted(context, key=lambda x: x.context_id)]
+
+
+def get_context_matrix(
+    experiment_data: ContextualBanditSample, contexts: List[List[ContextInput]]
+) -> np.ndarray:
+    """
+    Validate a batch of contexts against the experiment and return them as an
+    (m, d) array with columns ordered by `context_id`.
+    """
+    n_contexts = len(experiment_data.contexts)
+    if any(len(context) != n_contexts for context in contexts):
+        raise HTTPException(
+            status_code=400,
+            detail="Number of contexts provided does not match the num contexts.",
+        )
+
+    values = np.array(
+        [
+            [c.context_value for c in sorted(context, key=lambda x: x.context_id)]
+            for context in contexts
+        ]
+    ).reshape(len(contexts), n_contexts)
+    is_binary = np.array(
+        [
+            c.value_type == ContextType.BINARY.value
+            for c in sorted(experiment_data.contexts, key=lambda x: x.context_id)
+        ],
+        dtype=bool,
+    )
+    if not np.isin(values[:, is_binary], [0, 1]).all():
+        raise HTTPException(
+            status_code=400, detail="Binary context values must be 0 or 1."
+        )
+
+    return values
+
+
+@router.post("/{experiment_id}/draw", response_model=ContextualArmDraw)
+async def draw_arm(
+    experiment_id: int,
+    context: List[ContextInput],
+    request: Request,
+    user_db: UserDB = Depends(authenticate_key),
+    asession: AsyncSession = Depends(get_async_session),
+) -> ContextualArmDraw:
+    """
+    Get which arm to pull next for provided experiment.
+    """
+    posterior, version = await get_draw_posterior(
+        request, experiment_id, user_db.user_id, asession
+    )
     chosen_arm = choose_arm(
-        experiment_data,
-        [c.context_value for c in sorted(context, key=lambda x: x.context_id)],
+        posterior, get_context_values(posterior.experiment, context)
+    )
+
+    return ContextualArmDraw(
+        **posterior.experiment.arms[chosen_arm].model_dump(),
+        posterior_version=version,
+    )
+
+
+@router.post("/{experiment_id}/draw/batch", response_model=ContextualBanditDrawBatch)
+async def draw_arms(
+    experiment_id: int,
+    context: List[ContextInput],
+    request: Request,
+    n: int = Query(ge=1, le=MAX_DRAW_BATCH_SIZE, description="Number of draws"),
+    user_db: UserDB = Depends(authenticate_key),
+    asession: AsyncSession = Depends(get_async_session),
+) -> ContextualBanditDrawBatch:
+    """
+    Get which arms to pull for `n` independent draws with the same context for
+    provided experiment.
+    """
+    posterior, version = await get_draw_posterior(
+        request, experiment_id, user_db.user_id, asession
+    )
+    experiment_data = posterior.experiment
+    chosen_arms = choose_arms(
+        posterior, get_context_values(experiment_data, context), n
+    )
+    arm_ids = np.array([arm.arm_id for arm in experiment_data.arms])[chosen_arms]
+    counts = np.bincount(chosen_arms, minlength=len(experiment_data.arms))
+
+    return ContextualBanditDrawBatch(
+        experiment_id=experiment_id,
+        arm_ids=arm_ids.tolist(),
+        arm_counts={
+            arm.arm_id: int(count) for arm, count in zip(experiment_data.arms, counts)
+        },
+        posterior_version=version,
+    )
+
+
+@router.post(
+    "/{experiment_id}/draw/contexts", response_model=ContextualBanditDrawContexts
+)
+async def draw_arms_for_contexts(
+    experiment_id: int,
+    request: Request,
+    contexts: List[List[ContextInput]] = Body(
+        min_length=1, max_length=MAX_DRAW_BATCH_SIZE
+    ),
+    user_db: UserDB = Depends(authenticate_key),
+    asession: AsyncSession = Depends(get_async_session),
+) -> ContextualBanditDrawContexts:
+    """
+    Get which arm to pull next for each of the provided contexts, for example
+    for a page of users, sampling the arm parameters independently for each.
+    """
+    posterior, version = await get_draw_posterior(
+        request, experiment_id, user_db.user_id, asession
+    )
+    chosen_arms = choose_arms_for_contexts(
+        posterior, get_context_matrix(posterior.experiment, contexts)
     )
+    arm_ids = np.array([arm.arm_id for arm in posterior.experiment.arms])
 
-    return ContextualArmResponse.model_validate(experiment.arms[chosen_arm])
+    return ContextualBanditDrawContexts(
+        experiment_id=experiment_id,
+        arm_ids=arm_ids[chosen_arms].tolist(),
+        posterior_version=version,
+    )
 
 
-@router.put("/{experiment_id}/{arm_id}/{outcome}", response_model=ContextualArmResponse)
+async def update_arm_statistics(
+    request: Request,
+    experiment_data: ContextualBanditSample,
+    arm: ContextualArmResponse,
+    reward: float,
+    context_values: list[float],
+    user_id: int,
+    asession: AsyncSession,
+) -> ContextualArmResponse:
+    """
+    Save the observation and add it to the sufficient statistics of the arm,
+    refitting the arm if the experiment refits every
+    `refit_every_observations` observations and a refit is due.
+    """
+    statistics_db = await accumulate_arm_statistics(
+        arm, experiment_data.reward_type, reward, context_values, asession
+    )
+    await save_contextual_obs_to_db(
+        observation=CMABObservation(
+            arm_id=arm.arm_id, reward=reward, context_val=context_values
+        ),
+        experiment_id=experiment_data.experiment_id,
+        user_id=user_id,
+        asession=asession,
+    )
+
+    if (
+        experiment_data.refit_policy == RefitPolicy.OBSERVATIONS
+        and experiment_data.refit_every_observations is not None
+        and statistics_db.n_since_refit >= experiment_data.refit_every_observations
+    ):
+        refits = await refit_arms(
+            [arm.arm_id], asession, request.app.state.fit_executor
+        )
+        await asession.commit()
+        await invalidate_posterior(
+            request.app.state.posterior_cache,
+            request.app.state.redis,
+            experiment_data.experiment_id,
+        )
+        if arm.arm_id in refits:
+            mu, covariance = refits[arm.arm_id]
+            return arm.model_copy(
+                update={"mu": mu.tolist(), "covariance": covariance.tolist()}
+            )
+
+    return arm
+
+
+@router.put(
+    "/{experiment_id}/{arm_id}/{outcome}",
+    response_model=ContextualArmResponse | CMABObservationResponse,
+)
 async def update_arm(
     experiment_id: int,
     arm_id: int,
     reward: float,
     context: List[ContextInput],
+    request: Request,
+    response: Response,
     user_db: UserDB = Depends(authenticate_key),
     asession: AsyncSession = Depends(get_async_session),
-) -> ContextualArmResponse:
+) -> ContextualArmResponse | CMABObservationResponse:
     """
     Update the arm with the provided `arm_id` for the given
     `experiment_id` based on the `outcome`.
+
+    When `CMAB_UPDATE_MODE` is "async", the observation is saved as pending and
+    queued, and the saved observation is returned with a 202 status. The arm posterior
+    is updated shortly after by the background worker, which applies queued
+    observations in batches.
     """
     # Get the experiment and do checks
-    experiment = await get_contextual_mab_by_id(
+    experiment_data = await get_contextual_mab_sample_by_id(
         experiment_id, user_db.user_id, asession
     )
-    if experiment is None:
+    if experiment_data is None:
         raise HTTPException(
             status_code=404, detail=f"Experiment with id {experiment_id} not found"
         )
-
-    if len(experiment.contexts) != len(context):
-        raise HTTPException(
-            status_code=400,
-            detail="Number of contexts provided does not match the num contexts.",
-        )
-
-    for c_input, c_exp in zip(
-        sorted(context, key=lambda x: x.context_id),
-        sorted(experiment.contexts, key=lambda x: x.context_id),
-    ):
-        if c_exp.value_type == ContextType.BINARY.value:
-            Outcome(c_input.context_value)
-
-    experiment_data = ContextualBanditSample.model_validate(experiment)
+    context_values = get_context_values(experiment_data, context)
 
     # Get the arm
-    arms = [a for a in experiment.arms if a.arm_id == arm_id]
-
+    arms = [a for a in experiment_data.arms if a.arm_id == arm_id]
     if not arms:
         raise HTTPException(status_code=404, detail=f"Arm with id {arm_id} not found")
-    else:
-        arm = arms[0]
+    arm = arms[0]
+
+    if experiment_data.refit_policy != RefitPolicy.NONE:
+        return await update_arm_statistics(
+            request,
+            experiment_data,
+            arm,
+            reward,
+            context_values,
+            user_db.user_id,
+            asession,
+        )
 
-        # Get all observations for the arm
-        all_obs = await get_contextual_obs_by_experiment_arm_id(
+    if CMAB_UPDATE_MODE == "async":
+        observation_db = await save_contextual_obs_to_db(
+            observation=CMABObservation(
+                arm_id=arm_id, reward=reward, context_val=context_values
+            ),
             experiment_id=experiment_id,
-            arm_id=arm_id,
             user_id=user_db.user_id,
             asession=asession,
+            update_pending=True,
         )
-        rewards = [obs.reward for obs in all_obs] + [reward]
-        contexts = [obs.context_val for obs in all_obs] + [
-            sorted(
-                float(context.context_value)
-                for context in sorted(context, key=lambda x: x.context_id)
+        # The observation is saved as pending, so if queueing it fails it is
+        # queued again by the worker's sweep instead of being lost
+        try:
+            await enqueue_update(
+                request.app.state.redis,
+                experiment_id,
+                arm_id,
+                observation_db.observation_id,
+                reward,
+                context_values,
             )
-        ]
+        except Exception as e:
+            logger.warning(
+                f"Could not queue observation {observation_db.observation_id}: {e}"
+            )
+        response.status_code = 202
+        return CMABObservationResponse.model_validate(observation_db)
+
+    # Lock the arm, so that concurrent updates apply on top of each other
+    # instead of overwriting each other's posterior
+    arm_for_update = await get_contextual_arm_for_update(arm_id, asession)
+    if arm_for_update is None:
+        raise HTTPException(status_code=404, detail=f"Arm with id {arm_id} not found")
+    arm = arm_for_update[0]
+
+    # Update the arm from its current posterior and the new observation
+    mu, covariance = await request.app.state.fit_executor.run(
+        update_arm_params,
+        arm=arm,
+        prior_type=experiment_data.prior_type,
+        reward_type=experiment_data.reward_type,
+        reward=reward,
+        context=context_values,
+    )
+
+    # Update the arm in the database and save the observation, committing
+    # both together
+    await update_contextual_arm_params(arm_id, mu, covariance, asession)
+    observation = CMABObservation.model_validate(
+        dict(arm_id=arm_id, reward=reward, context_val=context_values)
+    )
+    await save_contextual_obs_to_db(
+        observation=observation,
+        experiment_id=experiment_id,
+        user_id=user_db.user_id,
+        asession=asession,
+    )
+
+    await invalidate_posterior(
+        request.app.state.posterior_cache, request.app.state.redis, experiment_id
+    )
 
-        # Update the arm
-        mu, covariance = update_arm_params(
-            arm=ContextualArmResponse.model_validate(arm),
-            prior_type=experiment_data.prior_type,
-            reward_type=experiment_data.reward_type,
-            context=contexts,
-            reward=rewards,
+    return arm.model_copy(update={"mu": mu.tolist(), "covariance": covariance.tolist()})
+
+
+@router.post(
+    "/{experiment_id}/{arm_id}/recalibrate", response_model=ContextualArmResponse
+)
+async def recalibrate_arm(
+    experiment_id: int,
+    arm_id: int,
+    request: Request,
+    user_db: Annotated[UserDB, Depends(get_current_user)],
+    asession: AsyncSession = Depends(get_async_session),
+) -> ContextualArmResponse:
+    """
+    Refit the arm with the provided `arm_id` to all of its observations,
+    starting from its initial prior. Online updates approximate the posterior
+    one observation at a time; this recomputes it from the full history.
+    """
+    experiment_data = await get_contextual_mab_sample_by_id(
+        experiment_id, user_db.user_id, asession
+    )
+    if experiment_data is None:
+        raise HTTPException(
+            status_code=404, detail=f"Experiment with id {experiment_id} not found"
         )
 
-        # Update the arm in the database
-        arm.mu = mu.tolist()
-        arm.covariance = covariance.tolist()
-        asession.add(arm)
-        await asession.commit()
+    arms = [a for a in experiment_data.arms if a.arm_id == arm_id]
+    if not arms:
+        raise HTTPException(status_code=404, detail=f"Arm with id {arm_id} not found")
+    arm = arms[0]
+
+    rewards, contexts = await get_contextual_arm_history(arm_id, asession)
+    mu, covariance = await request.app.state.fit_executor.run(
+        refit_arm_params,
+        arm=arm,
+        prior_type=experiment_data.prior_type,
+        reward_type=experiment_data.reward_type,
+        reward=rewards,
+        context=contexts,
+    )
 
-        # Save the observation
-        observation = CMABObservation.model_validate(
-            dict(
-                arm_id=arm_id,
-                reward=reward,
-                context_val=[
-                    c.context_value for c in sorted(context, key=lambda x: x.context_id)
-                ],
-            )
+    await update_contextual_arm_params(arm_id, mu, covariance, asession)
+    # Statistics accumulated for mini-batch refits restart from the new fit
+    await delete_contextual_arm_statistics(arm_id, asession)
+    await asession.commit()
+
+    await invalidate_posterior(
+        request.app.state.posterior_cache, request.app.state.redis, experiment_id
+    )
+
+    return arm.model_copy(update={"mu": mu.tolist(), "covariance": covariance.tolist()})
+
+
+@router.post("/{experiment_id}/refit", response_model=list[ContextualArmResponse])
+async def refit_experiment(
+    experiment_id: int,
+    request: Request,
+    user_db: Annotated[UserDB, Depends(get_current_user)],
+    asession: AsyncSession = Depends(get_async_session),
+) -> list[ContextualArmResponse]:
+    """
+    Refit the arms of the experiment from the sufficient statistics of the
+    observations received since their last refit. Only experiments with a
+    refit policy other than "none" accumulate statistics.
+    """
+    experiment_data = await get_contextual_mab_sample_by_id(
+        experiment_id, user_db.user_id, asession
+    )
+    if experiment_data is None:
+        raise HTTPException(
+            status_code=404, detail=f"Experiment with id {experiment_id} not found"
         )
-        await save_contextual_obs_to_db(
-            observation=observation,
-            experiment_id=experiment_id,
-            user_id=user_db.user_id,
-            asession=asession,
+
+    refits = await refit_arms(
+        [arm.arm_id for arm in experiment_data.arms],
+        asession,
+        request.app.state.fit_executor,
+    )
+    await asession.commit()
+    if refits:
+        await invalidate_posterior(
+            request.app.state.posterior_cache, request.app.state.redis, experiment_id
         )
 
-        return ContextualArmResponse.model_validate(arm)
+    return [
+        (
+            arm.model_copy(
+                update={
+                    "mu": refits[arm.arm_id][0].tolist(),
+                    "covariance": refits[arm.arm_id][1].tolist(),
+                }
+            )
+            if arm.arm_id in refits
+            else arm
+        )
+        for arm in experiment_data.arms
+    ]
 
 
 @router.get(
@@ -279,12 +612,12 @@ async def update_arm(
 async def get_outcomes(
     experiment_id: int,
     user_db: UserDB = Depends(authenticate_key),
-    asession: AsyncSession = Depends(get_async_session),
+    asession: AsyncSession = Depends(get_readonly_session),
 ) -> list[CMABObservation]:
     """
     Get the outcomes for the experiment.
     """
-    experiment = await get_contextual_mab_by_id(
+    experiment = await get_contextual_mab_sample_by_id(
         experiment_id, user_db.user_id, asession
     )
     if not experiment:
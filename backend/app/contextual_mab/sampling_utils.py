@@ -1,36 +1,122 @@
 import numpy as np
-from scipy.optimize import minimize
+from pydantic import BaseModel, ConfigDict
+from scipy.linalg import cho_factor, cho_solve
+from scipy.special import expit, log_expit
 
-from ..schemas import ArmPriors, ContextLinkFunctions, RewardLikelihood
+from ..schemas import (
+    SIGMA_LLHOOD,
+    ArmPriors,
+    ContextLinkFunctions,
+    RewardLikelihood,
+)
+from ..utils import setup_logger
+from ..variate_pool import covariance_factor, get_variate_pool
 from .schemas import ContextualArmResponse, ContextualBanditSample
 
+logger = setup_logger()
+
+
+class ContextualPosterior(BaseModel):
+    """
+    Posterior of a contextual experiment prepared for sampling, with the arm
+    means and the Cholesky factors of the arm covariances stacked across arms.
+    Built once per posterior change and kept in the posterior cache.
+    """
+
+    experiment: ContextualBanditSample
+    mus: np.ndarray
+    factors: np.ndarray
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+def get_contextual_posterior(experiment: ContextualBanditSample) -> ContextualPosterior:
+    """
+    Stack the arm means into a (k, d) array and factor the arm covariances into
+    a (k, d, d) array.
+
+    Parameters
+    ----------
+    experiment : The experiment object.
+    """
+    return ContextualPosterior(
+        experiment=experiment,
+        mus=np.array([arm.mu for arm in experiment.arms]),
+        factors=covariance_factor(
+            np.array([arm.covariance for arm in experiment.arms])
+        ),
+    )
+
 
 def sample_normal(
-    mus: list[np.ndarray],
-    covariances: list[np.ndarray],
+    mus: np.ndarray,
+    factors: np.ndarray,
     context: np.ndarray,
     link_function: ContextLinkFunctions,
 ) -> int:
     """
-    Thompson Sampling with normal prior.
+    Thompson Sampling with normal prior, sampling every arm in one batched
+    affine transform of standard normals.
 
     Parameters
     ----------
-    mus: mean of Normal distribution for each arm
-    covariances: covariance matrix of Normal distribution for each arm
+    mus: mean of Normal distribution for each arm, of shape (k, d)
+    factors: Cholesky factor of the covariance of each arm, of shape (k, d, d)
     context: context vector
     link_function: link function for the context
     """
-    samples = np.array(
-        [
-            np.random.multivariate_normal(mean=mu, cov=cov)
-            for mu, cov in zip(mus, covariances)
-        ]
-    ).reshape(-1, len(context))
+    samples = get_variate_pool().multivariate_normal(mean=mus, factor=factors)
     probs = link_function(samples @ context)
     return int(probs.argmax())
 
 
+def sample_normal_batch(
+    mus: np.ndarray,
+    factors: np.ndarray,
+    context: np.ndarray,
+    link_function: ContextLinkFunctions,
+    n: int,
+) -> np.ndarray:
+    """
+    Thompson Sampling with normal prior for `n` independent draws at once.
+
+    Parameters
+    ----------
+    mus: mean of Normal distribution for each arm, of shape (k, d)
+    factors: Cholesky factor of the covariance of each arm, of shape (k, d, d)
+    context: context vector
+    link_function: link function for the context
+    n: number of draws
+    """
+    samples = get_variate_pool().multivariate_normal(mean=mus, factor=factors, size=n)
+    probs = link_function(samples @ context)
+    return probs.argmax(axis=1)
+
+
+def sample_normal_contexts(
+    mus: np.ndarray,
+    factors: np.ndarray,
+    contexts: np.ndarray,
+    link_function: ContextLinkFunctions,
+) -> np.ndarray:
+    """
+    Thompson Sampling with normal prior for one draw per context vector, with
+    an independent parameter sample for each context.
+
+    Parameters
+    ----------
+    mus: mean of Normal distribution for each arm, of shape (k, d)
+    factors: Cholesky factor of the covariance of each arm, of shape (k, d, d)
+    contexts: context vectors, of shape (m, d)
+    link_function: link function for the context
+    """
+    samples = get_variate_pool().multivariate_normal(
+        mean=mus, factor=factors, size=len(contexts)
+    )
+    probs = link_function(np.einsum("mkd,md->mk", samples, contexts))
+    return probs.argmax(axis=1)
+
+
 def update_arm_normal(
     current_mu: np.ndarray,
     current_covariance: np.ndarray,
@@ -39,7 +125,9 @@ def update_arm_normal(
     sigma_llhood: float,
 ) -> tuple[np.ndarray, np.ndarray]:
     """
-    Update the mean and covariance of the normal distribution.
+    Update the mean and covariance of the normal distribution with a
+    Sherman-Morrison rank-one update, which costs O(d^2) instead of inverting
+    the covariance.
 
     Parameters
     ----------
@@ -49,84 +137,255 @@ def update_arm_normal(
     context : The context vector.
     sigma_llhood : The stddev of the likelihood.
     """
-    new_covariance_inv = (
-        np.linalg.inv(current_covariance) + (context.T @ context) / sigma_llhood**2
+    cov_context = current_covariance @ context
+    denom = sigma_llhood**2 + context @ cov_context
+
+    new_mu = current_mu + cov_context * (reward - context @ current_mu) / denom
+    new_covariance = current_covariance - np.outer(cov_context, cov_context) / denom
+    return new_mu, 0.5 * (new_covariance + new_covariance.T)
+
+
+def update_arm_normal_batch(
+    current_mu: np.ndarray,
+    current_covariance: np.ndarray,
+    reward: np.ndarray,
+    context: np.ndarray,
+    sigma_llhood: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Update the mean and covariance of the normal distribution with a batch of
+    m observations at once, by the Woodbury identity. Equivalent to m
+    Sherman-Morrison updates, at the cost of one (m, m) solve.
+
+    Parameters
+    ----------
+    current_mu : The mean of the normal distribution.
+    current_covariance : The covariance matrix of the normal distribution.
+    reward : The rewards of the arm, of shape (m,).
+    context : The context vectors, of shape (m, d).
+    sigma_llhood : The stddev of the likelihood.
+    """
+    cov_context = context @ current_covariance
+    noise = sigma_llhood**2 * np.identity(len(reward))
+    innovation_covariance = context @ cov_context.T + noise
+    gain = np.linalg.solve(innovation_covariance, cov_context).T
+
+    new_mu = current_mu + gain @ (reward - context @ current_mu)
+    new_covariance = current_covariance - gain @ cov_context
+    return new_mu, 0.5 * (new_covariance + new_covariance.T)
+
+
+class LaplaceFit(BaseModel):
+    """
+    Laplace approximation of a logistic arm posterior, with the diagnostics of
+    the Newton solver that found its mode.
+    """
+
+    mu: np.ndarray
+    covariance: np.ndarray
+    n_iterations: int
+    converged: bool
+    gradient_norm: float
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+def fit_laplace_logistic(
+    prior_mu: np.ndarray,
+    prior_covariance: np.ndarray,
+    reward: np.ndarray,
+    context: np.ndarray,
+    max_iterations: int = 50,
+    tolerance: float = 1e-8,
+) -> LaplaceFit:
+    """
+    Fit the Laplace approximation of a Bernoulli arm with logistic link and
+    normal prior by Newton's method (IRLS) on the log posterior, using its
+    closed-form gradient and Hessian. The covariance is the inverse of the
+    exact Hessian at the mode.
+
+    Parameters
+    ----------
+    prior_mu : The mean of the normal prior.
+    prior_covariance : The covariance matrix of the normal prior.
+    reward : The rewards for the arm, 0 or 1, of shape (n,).
+    context : The context vectors for the arm, of shape (n, d).
+    max_iterations : The maximum number of Newton steps.
+    tolerance : Convergence threshold on the largest change in the mean.
+    """
+    prior_precision = cho_solve(
+        cho_factor(prior_covariance), np.eye(len(prior_mu), dtype=np.float64)
     )
-    new_covariance = np.linalg.inv(new_covariance_inv)
 
-    new_mu = new_covariance @ (
-        np.linalg.inv(current_covariance) @ current_mu
-        + context * reward / sigma_llhood**2
+    def log_posterior(theta: np.ndarray) -> float:
+        """
+        Unnormalised log posterior, used to damp steps that overshoot.
+        """
+        logits = context @ theta
+        deviation = theta - prior_mu
+        return float(
+            np.sum(reward * log_expit(logits) + (1 - reward) * log_expit(-logits))
+            - 0.5 * deviation @ prior_precision @ deviation
+        )
+
+    def gradient_and_hessian(theta: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Gradient and negative Hessian of the log posterior.
+        """
+        probs = expit(context @ theta)
+        gradient = context.T @ (reward - probs) - prior_precision @ (theta - prior_mu)
+        weighted_context = context * (probs * (1 - probs))[:, None]
+        return gradient, prior_precision + weighted_context.T @ context
+
+    theta = prior_mu.astype(np.float64)
+    objective = log_posterior(theta)
+    converged = False
+    n_iterations = 0
+    while n_iterations < max_iterations:
+        n_iterations += 1
+        gradient, hessian = gradient_and_hessian(theta)
+        step = cho_solve(cho_factor(hessian), gradient)
+
+        # The log posterior is strictly concave, so halving the step until it
+        # improves always terminates; full steps are taken near the mode
+        step_size = 1.0
+        while True:
+            new_theta = theta + step_size * step
+            new_objective = log_posterior(new_theta)
+            if new_objective >= objective or step_size < 1e-10:
+                break
+            step_size /= 2
+
+        theta, objective = new_theta, new_objective
+        if np.max(np.abs(step_size * step)) < tolerance:
+            converged = True
+            break
+
+    gradient, hessian = gradient_and_hessian(theta)
+    covariance = cho_solve(cho_factor(hessian), np.eye(len(theta), dtype=np.float64))
+    return LaplaceFit(
+        mu=theta,
+        covariance=0.5 * (covariance + covariance.T),
+        n_iterations=n_iterations,
+        converged=converged,
+        gradient_norm=float(np.linalg.norm(gradient)),
     )
-    return new_mu, new_covariance
 
 
-def update_arm_laplace(
+def update_arm_laplace_online(
     current_mu: np.ndarray,
     current_covariance: np.ndarray,
-    reward: np.ndarray,
+    reward: float,
     context: np.ndarray,
-    link_function: ContextLinkFunctions,
-    reward_likelihood: RewardLikelihood,
-    prior_type: ArmPriors,
 ) -> tuple[np.ndarray, np.ndarray]:
     """
-    Update the mean and covariance using the Laplace approximation.
+    Update the mean and covariance of a logistic arm with one observation,
+    using a single Newton step of the Laplace approximation from the current
+    posterior. Costs O(d^2) regardless of how many observations came before.
 
     Parameters
     ----------
     current_mu : The mean of the normal distribution.
     current_covariance : The covariance matrix of the normal distribution.
-    reward : The list of rewards for the arm.
-    context : The list of contexts for the arm.
-    link_function : The link function for parameters to rewards.
-    reward_likelihood : The likelihood function of the reward.
-    prior_type : The prior type of the arm.
+    reward : The reward of the arm, 0 or 1.
+    context : The context vector.
     """
 
-    def objective(theta: np.ndarray) -> float:
+    def updated_covariance(theta: np.ndarray) -> np.ndarray:
         """
-        Objective function for the Laplace approximation.
+        Covariance after adding the curvature of the likelihood at `theta`,
+        by the Sherman-Morrison formula.
 
         Parameters
         ----------
-        theta : The parameters of the arm.
+        theta : The parameters to take the curvature at.
         """
-        # Log prior
-        log_prior = prior_type(theta, mu=current_mu, covariance=current_covariance)
-
-        # Log likelihood
-        log_likelihood = reward_likelihood(reward, link_function(context @ theta))
-
-        return -log_prior - log_likelihood
+        p = ContextLinkFunctions.LOGISTIC(context @ theta)
+        weight = p * (1 - p)
+        cov_context = current_covariance @ context
+        return current_covariance - np.outer(cov_context, cov_context) * (
+            weight / (1 + weight * context @ cov_context)
+        )
 
-    result = minimize(objective, current_mu, method="L-BFGS-B", hess="2-point")
-    new_mu = result.x
-    covariance = result.hess_inv.todense()
+    # Newton step from the current mean, where the prior gradient is zero
+    p = ContextLinkFunctions.LOGISTIC(context @ current_mu)
+    new_mu = current_mu + updated_covariance(current_mu) @ context * (reward - p)
 
-    new_covariance = 0.5 * (covariance + covariance.T)
-    return new_mu, new_covariance.astype(np.float64)
+    # Laplace covariance at the new mode
+    new_covariance = updated_covariance(new_mu)
+    new_covariance = 0.5 * (new_covariance + new_covariance.T)
+    return new_mu, new_covariance
 
 
-def choose_arm(experiment: ContextualBanditSample, context: list[float]) -> int:
+def get_link_function(experiment: ContextualBanditSample) -> ContextLinkFunctions:
     """
-    Choose the arm with the highest probability.
+    Get the link function from the arm parameters to the reward.
 
     Parameters
     ----------
     experiment : The experiment object.
-    context : The context vector.
     """
-    link_function = (
+    return (
         ContextLinkFunctions.NONE
         if experiment.reward_type == RewardLikelihood.NORMAL
         else ContextLinkFunctions.LOGISTIC
     )
+
+
+def choose_arm(posterior: ContextualPosterior, context: list[float]) -> int:
+    """
+    Choose the arm with the highest probability.
+
+    Parameters
+    ----------
+    posterior : The posterior of the experiment.
+    context : The context vector.
+    """
     return sample_normal(
-        mus=[np.array(arm.mu) for arm in experiment.arms],
-        covariances=[np.array(arm.covariance) for arm in experiment.arms],
+        mus=posterior.mus,
+        factors=posterior.factors,
         context=np.array(context),
-        link_function=link_function,
+        link_function=get_link_function(posterior.experiment),
+    )
+
+
+def choose_arms(
+    posterior: ContextualPosterior, context: list[float], n: int
+) -> np.ndarray:
+    """
+    Choose the arm with the highest probability for `n` independent draws.
+
+    Parameters
+    ----------
+    posterior : The posterior of the experiment.
+    context : The context vector.
+    n : The number of draws.
+    """
+    return sample_normal_batch(
+        mus=posterior.mus,
+        factors=posterior.factors,
+        context=np.array(context),
+        link_function=get_link_function(posterior.experiment),
+        n=n,
+    )
+
+
+def choose_arms_for_contexts(
+    posterior: ContextualPosterior, contexts: np.ndarray
+) -> np.ndarray:
+    """
+    Choose the arm with the highest probability for each context vector.
+
+    Parameters
+    ----------
+    posterior : The posterior of the experiment.
+    contexts : The context vectors, of shape (m, d).
+    """
+    return sample_normal_contexts(
+        mus=posterior.mus,
+        factors=posterior.factors,
+        contexts=contexts,
+        link_function=get_link_function(posterior.experiment),
     )
 
 
@@ -134,39 +393,197 @@ def update_arm_params(
     arm: ContextualArmResponse,
     prior_type: ArmPriors,
     reward_type: RewardLikelihood,
-    reward: list,
-    context: list,
+    reward: float,
+    context: list[float],
 ) -> tuple[np.ndarray, np.ndarray]:
     """
-    Update the arm parameters.
+    Update the arm parameters with a new observation.
 
     Parameters
     ----------
     arm : The arm object.
     prior_type : The prior type of the arm.
     reward_type : The reward type of the arm.
-    reward : All rewards for the arm.
-    context : All context vectors for the arm.
+    reward : The new reward for the arm.
+    context : The context vector of the new reward.
     """
     if (prior_type == ArmPriors.NORMAL) and (reward_type == RewardLikelihood.NORMAL):
         return update_arm_normal(
             current_mu=np.array(arm.mu),
             current_covariance=np.array(arm.covariance),
-            reward=reward[-1],
-            context=np.array(context[-1]),
-            sigma_llhood=1.0,  # TODO: need to implement likelihood stddev
+            reward=reward,
+            context=np.array(context),
+            sigma_llhood=SIGMA_LLHOOD,
         )
     elif (prior_type == ArmPriors.NORMAL) and (
         reward_type == RewardLikelihood.BERNOULLI
     ):
-        return update_arm_laplace(
+        return update_arm_laplace_online(
             current_mu=np.array(arm.mu),
             current_covariance=np.array(arm.covariance),
-            reward=np.array(reward),
+            reward=reward,
             context=np.array(context),
-            link_function=ContextLinkFunctions.LOGISTIC,
-            reward_likelihood=RewardLikelihood.BERNOULLI,
-            prior_type=ArmPriors.NORMAL,
         )
     else:
         raise ValueError("Prior and reward type combination is not supported.")
+
+
+def update_arm_params_batch(
+    arm: ContextualArmResponse,
+    prior_type: ArmPriors,
+    reward_type: RewardLikelihood,
+    reward: list[float],
+    context: list[list[float]],
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Update the arm parameters with a batch of new observations in one step,
+    using the current posterior of the arm as the prior.
+
+    Parameters
+    ----------
+    arm : The arm object.
+    prior_type : The prior type of the arm.
+    reward_type : The reward type of the arm.
+    reward : The new rewards for the arm.
+    context : The context vectors of the new rewards.
+    """
+    if (prior_type == ArmPriors.NORMAL) and (reward_type == RewardLikelihood.NORMAL):
+        return update_arm_normal_batch(
+            current_mu=np.array(arm.mu),
+            current_covariance=np.array(arm.covariance),
+            reward=np.array(reward, dtype=np.float64),
+            context=np.array(context, dtype=np.float64),
+            sigma_llhood=SIGMA_LLHOOD,
+        )
+    elif (prior_type == ArmPriors.NORMAL) and (
+        reward_type == RewardLikelihood.BERNOULLI
+    ):
+        fit = fit_laplace_logistic(
+            prior_mu=np.array(arm.mu),
+            prior_covariance=np.array(arm.covariance),
+            reward=np.array(reward, dtype=np.float64),
+            context=np.array(context, dtype=np.float64),
+        )
+        return fit.mu, fit.covariance
+    else:
+        raise ValueError("Prior and reward type combination is not supported.")
+
+
+def get_observation_statistics(
+    current_mu: np.ndarray,
+    reward_type: RewardLikelihood,
+    reward: np.ndarray,
+    context: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the contribution of a batch of observations to the sufficient
+    statistics `X^T W X` and `X^T W z` of an arm. Normal rewards contribute
+    `X^T X` and `X^T y`; binary rewards contribute the weights and working
+    responses of an IRLS step at `current_mu`.
+
+    Parameters
+    ----------
+    current_mu : The mean of the arm when the observations were made.
+    reward_type : The reward type of the arm.
+    reward : The rewards of the arm, of shape (m,).
+    context : The context vectors, of shape (m, d).
+    """
+    if reward_type == RewardLikelihood.NORMAL:
+        return (
+            context.T @ context / SIGMA_LLHOOD**2,
+            context.T @ reward / SIGMA_LLHOOD**2,
+        )
+    elif reward_type == RewardLikelihood.BERNOULLI:
+        logits = context @ current_mu
+        probs = expit(logits)
+        weights = probs * (1 - probs)
+        return (
+            (context * weights[:, None]).T @ context,
+            context.T @ (weights * logits + reward - probs),
+        )
+    else:
+        raise ValueError("Reward type is not supported.")
+
+
+def refit_arm_from_statistics(
+    base_mu: np.ndarray,
+    base_covariance: np.ndarray,
+    xtwx: np.ndarray,
+    xtwz: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Update the base posterior of an arm with the accumulated sufficient
+    statistics of its observations, at the cost of one factorization instead
+    of one update per observation.
+
+    Parameters
+    ----------
+    base_mu : The mean of the posterior the statistics were accumulated from.
+    base_covariance : The covariance of that posterior.
+    xtwx : The accumulated `X^T W X`, of shape (d, d).
+    xtwz : The accumulated `X^T W z`, of shape (d,).
+    """
+    identity = np.eye(len(base_mu), dtype=np.float64)
+    base_precision = cho_solve(cho_factor(base_covariance), identity)
+
+    # Solve for the mean directly with the factor of the new precision, which
+    # also gives the covariance
+    precision_factor = cho_factor(base_precision + xtwx)
+    new_mu = cho_solve(precision_factor, base_precision @ base_mu + xtwz)
+    new_covariance = cho_solve(precision_factor, identity)
+    return new_mu, 0.5 * (new_covariance + new_covariance.T)
+
+
+def refit_arm_params(
+    arm: ContextualArmResponse,
+    prior_type: ArmPriors,
+    reward_type: RewardLikelihood,
+    reward: np.ndarray,
+    context: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fit the arm parameters to all of its observations, starting from the
+    initial prior of the arm.
+
+    Parameters
+    ----------
+    arm : The arm object.
+    prior_type : The prior type of the arm.
+    reward_type : The reward type of the arm.
+    reward : All rewards for the arm, of shape (n,).
+    context : All context vectors for the arm, of shape (n, d).
+    """
+    n_contexts = len(arm.mu)
+    prior_mu = np.ones(n_contexts) * arm.mu_init
+    prior_covariance = np.identity(n_contexts) * arm.sigma_init
+    if len(reward) == 0:
+        return prior_mu, prior_covariance
+
+    reward = np.asarray(reward, dtype=np.float64)
+    context = np.asarray(context, dtype=np.float64)
+    if (prior_type == ArmPriors.NORMAL) and (reward_type == RewardLikelihood.NORMAL):
+        prior_precision = np.linalg.inv(prior_covariance)
+        new_covariance = np.linalg.inv(
+            prior_precision + context.T @ context / SIGMA_LLHOOD**2
+        )
+        new_mu = new_covariance @ (
+            prior_precision @ prior_mu + context.T @ reward / SIGMA_LLHOOD**2
+        )
+        return new_mu, new_covariance
+    elif (prior_type == ArmPriors.NORMAL) and (
+        reward_type == RewardLikelihood.BERNOULLI
+    ):
+        fit = fit_laplace_logistic(
+            prior_mu=prior_mu,
+            prior_covariance=prior_covariance,
+            reward=reward,
+            context=context,
+        )
+        if not fit.converged:
+            logger.warning(
+                f"Laplace fit of arm {arm.arm_id} did not converge after "
+                f"{fit.n_iterations} iterations, gradient norm {fit.gradient_norm:.3g}"
+            )
+        return fit.mu, fit.covariance
+    else:
+        raise ValueError("Prior and reward type combination is not supported.")
@@ -1,4 +1,5 @@
 from datetime import datetime
+from enum import StrEnum
 from typing import Self
 
 from pydantic import BaseModel, ConfigDict, Field, model_validator
@@ -12,6 +13,17 @@ from ..schemas import (
 )
 
 
+class RefitPolicy(StrEnum):
+    """
+    Enum for when the arm posteriors of a contextual experiment are refit.
+    """
+
+    NONE = "none"
+    OBSERVATIONS = "observations"
+    INTERVAL = "interval"
+    ON_DEMAND = "on_demand"
+
+
 class Context(BaseModel):
     """
     Pydantic model for a binary-valued context of the experiment.
@@ -129,6 +141,32 @@ class ContextualBanditBase(BaseModel):
 
     is_active: bool = True
 
+    refit_policy: RefitPolicy = Field(
+        description=(
+            "When to refit the arm posteriors. With 'none', every reward updates "
+            "the arm posterior. Otherwise rewards are accumulated as sufficient "
+            "statistics and the posteriors are refit every "
+            "`refit_every_observations` observations, every "
+            "`refit_interval_seconds` seconds, or on demand."
+        ),
+        default=RefitPolicy.NONE,
+    )
+
+    refit_every_observations: int | None = Field(
+        description=(
+            "Number of observations between refits for the 'observations' "
+            "refit policy."
+        ),
+        default=None,
+        ge=1,
+    )
+
+    refit_interval_seconds: int | None = Field(
+        description="Number of seconds between refits for the 'interval' refit policy.",
+        default=None,
+        ge=1,
+    )
+
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -161,6 +199,28 @@ class ContextualBandit(ContextualBanditBase):
             )
         return self
 
+    @model_validator(mode="after")
+    def check_refit_frequency(self) -> Self:
+        """
+        Validate that scheduled refit policies have a refit frequency.
+        """
+        if (
+            self.refit_policy == RefitPolicy.OBSERVATIONS
+            and self.refit_every_observations is None
+        ):
+            raise ValueError(
+                "refit_every_observations is required for the observations "
+                "refit policy."
+            )
+        if (
+            self.refit_policy == RefitPolicy.INTERVAL
+            and self.refit_interval_seconds is None
+        ):
+            raise ValueError(
+                "refit_interval_seconds is required for the interval refit policy."
+            )
+        return self
+
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -190,6 +250,45 @@ class ContextualBanditSample(ContextualBanditBase):
     contexts: list[ContextResponse]
 
 
+class ContextualArmDraw(ContextualArmResponse):
+    """
+    Pydantic model for an arm drawn for a contextual experiment.
+    """
+
+    posterior_version: int = Field(
+        description="The version of the posterior the arm was sampled from."
+    )
+
+
+class ContextualBanditDrawBatch(BaseModel):
+    """
+    Pydantic model for a batch of arm draws for a contextual experiment.
+    """
+
+    experiment_id: int
+    arm_ids: list[int] = Field(description="The arm chosen for each draw, in order.")
+    arm_counts: dict[int, int] = Field(
+        description="The number of draws assigned to each arm."
+    )
+    posterior_version: int = Field(
+        description="The version of the posterior the draws were sampled from."
+    )
+
+
+class ContextualBanditDrawContexts(BaseModel):
+    """
+    Pydantic model for the arms drawn for a batch of contexts.
+    """
+
+    experiment_id: int
+    arm_ids: list[int] = Field(
+        description="The arm chosen for each context vector, in order."
+    )
+    posterior_version: int = Field(
+        description="The version of the posterior the draws were sampled from."
+    )
+
+
 class CMABObservation(BaseModel):
     """
     Pydantic model for a contextual observation of the experiment.
@@ -0,0 +1,365 @@
+"""
+Coalescing posterior updates for contextual bandits.
+
+When `CMAB_UPDATE_MODE` is "async", rewards are saved as observations flagged
+as pending and queued in a Redis list per arm instead of being folded into the
+arm posterior in the request. A background worker drains the queues every
+`CMAB_UPDATE_INTERVAL_SECONDS` and applies all pending observations of an arm
+in one batched posterior update, so that bursts of rewards cost one fit.
+
+The pending flag is cleared in the transaction that applies the observation,
+so an observation is applied once even if it is queued twice, and observations
+whose queueing failed are queued again by a periodic sweep.
+
+In both update modes, the worker also appends the contextual observations
+saved by requests to the packed histories of their arms every
+`CONTEXTUAL_OBS_CHUNK_INTERVAL_SECONDS`, so that requests only insert the
+observation row.
+"""
+
+import asyncio
+import json
+
+from fastapi.exceptions import HTTPException
+from redis import asyncio as aioredis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_sqlalchemy_async_engine
+from ..fit_executor import FitExecutor
+from ..posterior_cache import PosteriorCache, invalidate_posterior
+from ..redis_queues import (
+    acquire_lock,
+    claim_batch,
+    finish_batch,
+    get_batch_id_key,
+    release_lock,
+)
+from ..utils import setup_logger
+from .models import (
+    append_pending_obs_to_chunks,
+    clear_contextual_obs_update_pending,
+    get_arms_with_obs_pending_chunks,
+    get_contextual_arm_for_update,
+    get_contextual_obs_pending_update,
+    update_contextual_arm_params,
+)
+from .sampling_utils import update_arm_params_batch
+
+logger = setup_logger()
+
+PENDING_ARMS_KEY = "cmab-updates:pending-arms"
+SWEEP_LOCK_KEY = "cmab-updates:sweep-lock"
+CHUNK_LOCK_KEY = "cmab-updates:chunk-lock"
+
+# Fit executor errors for a saturated pool (503) or a fit that timed out
+# (504), after which the batch is retried on a later pass
+RETRYABLE_FIT_STATUS_CODES = (503, 504)
+
+
+def get_pending_updates_key(arm_id: int) -> str:
+    """
+    Get the Redis key of the list of observations waiting to be applied to
+    the arm.
+    """
+    return f"cmab-updates:{arm_id}"
+
+
+def get_processing_updates_key(arm_id: int) -> str:
+    """
+    Get the Redis key of the list of observations being applied to the arm.
+    """
+    return f"cmab-updates-processing:{arm_id}"
+
+
+def get_update_lock_key(arm_id: int) -> str:
+    """
+    Get the Redis key of the lock held while updates are applied to the arm.
+    """
+    return f"cmab-updates-lock:{arm_id}"
+
+
+def _queue_update(
+    pipe: aioredis.client.Pipeline,
+    experiment_id: int,
+    arm_id: int,
+    observation_id: int,
+    reward: float,
+    context: list[float],
+) -> None:
+    """
+    Add the commands queueing an observation to the pipeline.
+    """
+    pipe.rpush(
+        get_pending_updates_key(arm_id),
+        json.dumps(
+            {"observation_id": observation_id, "reward": reward, "context": context}
+        ),
+    )
+    pipe.sadd(PENDING_ARMS_KEY, f"{experiment_id}:{arm_id}")
+
+
+async def enqueue_update(
+    redis: aioredis.Redis,
+    experiment_id: int,
+    arm_id: int,
+    observation_id: int,
+    reward: float,
+    context: list[float],
+) -> None:
+    """
+    Queue a saved observation, flagged as pending, to be applied to the arm
+    posterior by the worker.
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        _queue_update(pipe, experiment_id, arm_id, observation_id, reward, context)
+        await pipe.execute()
+
+
+async def delete_pending_updates(redis: aioredis.Redis, arm_ids: list[int]) -> None:
+    """
+    Drop the queued observations for the given arms.
+    """
+    if arm_ids:
+        await redis.delete(
+            *[get_pending_updates_key(arm_id) for arm_id in arm_ids],
+            *[get_processing_updates_key(arm_id) for arm_id in arm_ids],
+            *[
+                get_batch_id_key(get_processing_updates_key(arm_id))
+                for arm_id in arm_ids
+            ],
+        )
+
+
+async def apply_pending_updates(
+    redis: aioredis.Redis,
+    asession: AsyncSession,
+    fit_executor: FitExecutor,
+    experiment_id: int,
+    arm_id: int,
+    batch_size: int,
+) -> int:
+    """
+    Apply up to `batch_size` queued observations to the arm posterior in one
+    update and commit it. Returns the number of observations applied.
+
+    The batch is moved to a processing list of the arm and only removed from
+    it once the update is committed, so that a batch left there by a failed or
+    interrupted update is applied before any new observations of the arm. If
+    the fit executor is saturated or the fit times out, the batch is kept for
+    the next pass. Updates of an arm are serialized by its lock, so one
+    processing list per arm is enough.
+    """
+    processing_key = get_processing_updates_key(arm_id)
+    batch = await claim_batch(
+        redis, get_pending_updates_key(arm_id), processing_key, batch_size
+    )
+    if batch is None:
+        return 0
+    _, raw_updates = batch
+
+    try:
+        arm_for_update = await get_contextual_arm_for_update(arm_id, asession)
+        if arm_for_update is None:
+            # The arm was deleted since the observations were queued
+            await asession.rollback()
+            await finish_batch(redis, processing_key)
+            return 0
+        arm, prior_type, reward_type = arm_for_update
+
+        # Skip the observations already applied, by a replayed batch or when
+        # the sweep queued them again
+        queued = {
+            update["observation_id"]: update
+            for update in (json.loads(raw_update) for raw_update in raw_updates)
+        }
+        pending_ids = await clear_contextual_obs_update_pending(
+            experiment_id, list(queued), asession
+        )
+        updates = [
+            update
+            for observation_id, update in queued.items()
+            if observation_id in pending_ids
+        ]
+
+        if updates:
+            mu, covariance = await fit_executor.run(
+                update_arm_params_batch,
+                arm=arm,
+                prior_type=prior_type,
+                reward_type=reward_type,
+                reward=[update["reward"] for update in updates],
+                context=[update["context"] for update in updates],
+            )
+            await update_contextual_arm_params(arm_id, mu, covariance, asession)
+        await asession.commit()
+    except HTTPException as e:
+        await asession.rollback()
+        if e.status_code not in RETRYABLE_FIT_STATUS_CODES:
+            raise
+        logger.warning(f"Deferring updates to contextual arm {arm_id}: {e.detail}")
+        return 0
+    except Exception:
+        # The batch stays in the processing list and is retried by the next
+        # pass
+        await asession.rollback()
+        raise
+
+    await finish_batch(redis, processing_key)
+    return len(updates)
+
+
+async def requeue_pending_updates(
+    redis: aioredis.Redis,
+    asession: AsyncSession,
+    older_than_seconds: float,
+    batch_size: int,
+) -> int:
+    """
+    Queue again up to `batch_size` observations still pending more than
+    `older_than_seconds` after they were saved, whose queueing failed or whose
+    queue was lost. Returns the number of observations queued.
+    """
+    observations = await get_contextual_obs_pending_update(
+        older_than_seconds, batch_size, asession
+    )
+    await asession.rollback()
+    if not observations:
+        return 0
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for obs in observations:
+            _queue_update(
+                pipe,
+                obs.experiment_id,
+                obs.arm_id,
+                obs.observation_id,
+                obs.reward,
+                obs.context_val,
+            )
+        await pipe.execute()
+
+    return len(observations)
+
+
+async def process_pending_updates(
+    redis: aioredis.Redis,
+    asession: AsyncSession,
+    cache: PosteriorCache,
+    fit_executor: FitExecutor,
+    batch_size: int,
+) -> int:
+    """
+    Apply the queued observations of every arm with pending updates and
+    invalidate the posteriors of the updated experiments. Arms locked by
+    another worker, or with observations left over, are kept pending. Returns
+    the number of observations applied.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.spop(PENDING_ARMS_KEY, batch_size)
+        (pending_arms,) = await pipe.execute()
+
+    updated_experiment_ids = set()
+    retry_arms = []
+    n_applied = 0
+    for pending_arm in pending_arms or []:
+        experiment_id, arm_id = map(int, pending_arm.decode().split(":"))
+        lock_key = get_update_lock_key(arm_id)
+        token = await acquire_lock(redis, lock_key, 60_000)
+        if token is None:
+            retry_arms.append(pending_arm)
+            continue
+
+        try:
+            n = await apply_pending_updates(
+                redis, asession, fit_executor, experiment_id, arm_id, batch_size
+            )
+        except Exception as e:
+            logger.error(f"Error applying updates to contextual arm {arm_id}: {e}")
+            n = 0
+        finally:
+            await release_lock(redis, lock_key, token)
+
+        if n:
+            n_applied += n
+            updated_experiment_ids.add(experiment_id)
+        retry_arms.append(pending_arm)
+
+    # Keep the arms that still have observations queued or being processed
+    # pending
+    if retry_arms:
+        async with redis.pipeline(transaction=False) as pipe:
+            for pending_arm in retry_arms:
+                arm_id = int(pending_arm.decode().split(":")[1])
+                pipe.exists(
+                    get_pending_updates_key(arm_id), get_processing_updates_key(arm_id)
+                )
+            n_pending = await pipe.execute()
+            for pending_arm, n in zip(retry_arms, n_pending):
+                if n:
+                    pipe.sadd(PENDING_ARMS_KEY, pending_arm)
+            await pipe.execute()
+
+    for experiment_id in updated_experiment_ids:
+        await invalidate_posterior(cache, redis, experiment_id)
+
+    return n_applied
+
+
+async def write_pending_chunks(asession: AsyncSession, batch_size: int) -> int:
+    """
+    Append the observations waiting to be appended to the packed histories of
+    up to `batch_size` arms, up to `batch_size` observations per arm,
+    committing each arm in turn so that its lock is held briefly. Returns the
+    number of observations appended.
+    """
+    arms = await get_arms_with_obs_pending_chunks(batch_size, asession)
+    n_appended = 0
+    for arm in arms:
+        n_appended += await append_pending_obs_to_chunks(
+            arm.experiment_id, arm.arm_id, batch_size, asession
+        )
+        await asession.commit()
+
+    return n_appended
+
+
+async def run_update_worker(
+    redis: aioredis.Redis,
+    cache: PosteriorCache,
+    fit_executor: FitExecutor,
+    interval: float,
+    batch_size: int,
+    sweep_interval: float,
+    chunk_interval: float,
+) -> None:
+    """
+    Apply queued contextual arm updates every `interval` seconds, queue again
+    the observations left pending for more than `sweep_interval` seconds once
+    every `sweep_interval` seconds, and append saved observations to the
+    packed arm histories once every `chunk_interval` seconds, across the
+    workers. Runs until cancelled.
+    """
+    sweep_lock_timeout_ms = int(sweep_interval * 1000)
+    chunk_lock_timeout_ms = int(chunk_interval * 1000)
+    while True:
+        try:
+            async with AsyncSession(
+                get_sqlalchemy_async_engine(), expire_on_commit=False
+            ) as asession:
+                # The sweep and chunk locks are left to expire, so that they
+                # also space the runs of all workers. Concurrent chunk writes,
+                # if one outlasts its lock, are serialized on the arm rows.
+                if await acquire_lock(redis, SWEEP_LOCK_KEY, sweep_lock_timeout_ms):
+                    await requeue_pending_updates(
+                        redis, asession, sweep_interval, batch_size
+                    )
+                if await acquire_lock(redis, CHUNK_LOCK_KEY, chunk_lock_timeout_ms):
+                    await write_pending_chunks(asession, batch_size)
+                await process_pending_updates(
+                    redis, asession, cache, fit_executor, batch_size
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error applying contextual arm updates: {e}")
+        await asyncio.sleep(interval)
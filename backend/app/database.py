@@ -1,8 +1,12 @@
+import asyncio
 import contextlib
+import time
 from collections.abc import AsyncGenerator, Generator
 from typing import ContextManager
 
+from sqlalchemy import text
 from sqlalchemy.engine import URL, Engine, create_engine
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import Session
 
@@ -12,8 +16,18 @@ from .config import (
     POSTGRES_HOST,
     POSTGRES_PASSWORD,
     POSTGRES_PORT,
+    POSTGRES_REPLICA_DB,
+    POSTGRES_REPLICA_HOST,
+    POSTGRES_REPLICA_PASSWORD,
+    POSTGRES_REPLICA_PORT,
+    POSTGRES_REPLICA_USER,
     POSTGRES_USER,
+    REPLICA_LAG_CHECK_INTERVAL_SECONDS,
+    REPLICA_MAX_LAG_SECONDS,
 )
+from .utils import setup_logger
+
+logger = setup_logger()
 
 SYNC_DB_API = "psycopg2"
 ASYNC_DB_API = "asyncpg"
@@ -23,6 +37,20 @@ ASYNC_DB_API = "asyncpg"
 # connections and not create a new pool on every request
 _SYNC_ENGINE: Engine | None = None
 _ASYNC_ENGINE: AsyncEngine | None = None
+_READONLY_ROUTER: "ReadOnlyRouter | None" = None
+
+# Seconds the server is behind its primary: 0 on a primary or a standby that
+# has replayed all the WAL it received, NULL on a standby that has not
+# replayed any transaction yet
+REPLICA_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """
+)
 
 
 def get_connection_url(
@@ -64,6 +92,92 @@ def get_sqlalchemy_async_engine() -> AsyncEngine:
     return _ASYNC_ENGINE
 
 
+async def get_replica_lag(engine: AsyncEngine) -> float | None:
+    """Return the replication lag of the database in seconds, or None if unknown."""
+    async with engine.connect() as connection:
+        lag = (await connection.execute(REPLICA_LAG_QUERY)).scalar_one()
+    return None if lag is None else float(lag)
+
+
+class ReadOnlyRouter:
+    """
+    Chooses the engine of read-only sessions.
+
+    Sessions use the replica while its lag is at most `max_lag_seconds`, and
+    the primary when the replica lags further behind, takes longer than that
+    to answer, or cannot be reached. The lag is checked at most once every
+    `check_interval_seconds` per worker, so that requests do not pay for it.
+    """
+
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replica: AsyncEngine,
+        max_lag_seconds: float = REPLICA_MAX_LAG_SECONDS,
+        check_interval_seconds: float = REPLICA_LAG_CHECK_INTERVAL_SECONDS,
+    ) -> None:
+        self.primary = primary
+        self.replica = replica
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval_seconds = check_interval_seconds
+        self._use_replica = False
+        self._next_check = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get_engine(self) -> AsyncEngine:
+        """
+        Return the replica if it is within the allowed lag, else the primary.
+        Only one lag check runs at a time; other requests use the last result.
+        """
+        if self.replica is self.primary:
+            return self.primary
+
+        if time.monotonic() >= self._next_check and not self._lock.locked():
+            async with self._lock:
+                use_replica = await self._check_replica()
+                if use_replica != self._use_replica:
+                    logger.info(
+                        "Routing read-only sessions to the "
+                        f"{'replica' if use_replica else 'primary'}"
+                    )
+                self._use_replica = use_replica
+                self._next_check = time.monotonic() + self.check_interval_seconds
+
+        return self.replica if self._use_replica else self.primary
+
+    async def _check_replica(self) -> bool:
+        """
+        Whether the replica answers and is within the allowed lag.
+        """
+        try:
+            lag = await asyncio.wait_for(
+                get_replica_lag(self.replica), timeout=self.max_lag_seconds
+            )
+        except (asyncio.TimeoutError, OSError, SQLAlchemyError) as e:
+            logger.warning(f"Could not get the replica lag: {e}")
+            return False
+        return lag is not None and lag <= self.max_lag_seconds
+
+
+def get_readonly_router() -> ReadOnlyRouter:
+    """Return the router of read-only sessions."""
+    global _READONLY_ROUTER
+    if _READONLY_ROUTER is None:
+        primary = get_sqlalchemy_async_engine()
+        replica = primary
+        if POSTGRES_REPLICA_HOST:
+            connection_string = get_connection_url(
+                user=POSTGRES_REPLICA_USER,
+                password=POSTGRES_REPLICA_PASSWORD,
+                host=POSTGRES_REPLICA_HOST,
+                port=POSTGRES_REPLICA_PORT,
+                db=POSTGRES_REPLICA_DB,
+            )
+            replica = create_async_engine(connection_string, pool_size=DB_POOL_SIZE)
+        _READONLY_ROUTER = ReadOnlyRouter(primary, replica)
+    return _READONLY_ROUTER
+
+
 def get_session_context_manager() -> ContextManager[Session]:
     """Return a SQLAlchemy session context manager."""
     return contextlib.contextmanager(get_session)()
@@ -81,3 +195,15 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
         get_sqlalchemy_async_engine(), expire_on_commit=False
     ) as async_session:
         yield async_session
+
+
+async def get_readonly_session() -> AsyncGenerator[AsyncSession, None]:
+    """Return a SQLAlchemy async session for reads, on the replica unless it
+    lags too far behind.
+
+    FastAPI resolves a dependency once per request, so every read of a request
+    goes through the same session, and so the same server.
+    """
+    engine = await get_readonly_router().get_engine()
+    async with AsyncSession(engine, expire_on_commit=False) as async_session:
+        yield async_session
@@ -0,0 +1,98 @@
+"""Worker threads for CPU-bound posterior fitting."""
+
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+from fastapi.exceptions import HTTPException
+from prometheus_client import Counter, Histogram
+
+FIT_QUEUE_WAIT = Histogram(
+    "posterior_fit_queue_wait_seconds",
+    "Time posterior fits wait for a worker thread.",
+)
+FIT_DURATION = Histogram(
+    "posterior_fit_duration_seconds", "Time spent running posterior fits."
+)
+FIT_REJECTIONS = Counter(
+    "posterior_fit_rejections_total",
+    "Posterior fits rejected because the fit executor was saturated.",
+)
+FIT_TIMEOUTS = Counter(
+    "posterior_fit_timeouts_total", "Posterior fits that exceeded the timeout."
+)
+
+T = TypeVar("T")
+
+
+class FitExecutor:
+    """
+    Runs posterior fits on a pool of worker threads so that they do not block
+    the event loop. numpy and scipy release the GIL in their linear algebra
+    routines, so fits run in parallel with each other and with request
+    handling.
+
+    At most `max_workers + max_pending` fits are accepted at a time; further
+    fits are rejected with a 503 instead of queueing without bound. A fit that
+    does not finish within `timeout_seconds` fails with a 504, but keeps its
+    slot until its thread is done, since threads cannot be interrupted.
+    """
+
+    def __init__(
+        self, max_workers: int, max_pending: int, timeout_seconds: float
+    ) -> None:
+        self.timeout_seconds = timeout_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="posterior-fit"
+        )
+        self._slots = asyncio.Semaphore(max_workers + max_pending)
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run `fn(*args, **kwargs)` on a worker thread and return its result.
+        """
+        if self._slots.locked():
+            FIT_REJECTIONS.inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Too many posterior updates in progress, try again later.",
+                headers={"Retry-After": "1"},
+            )
+        await self._slots.acquire()
+
+        loop = asyncio.get_running_loop()
+        future: Future[T] = self._executor.submit(
+            self._timed, time.perf_counter(), partial(fn, *args, **kwargs)
+        )
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._slots.release)
+        )
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), self.timeout_seconds
+            )
+        except asyncio.TimeoutError:
+            FIT_TIMEOUTS.inc()
+            raise HTTPException(
+                status_code=504, detail="Posterior update timed out."
+            ) from None
+
+    @staticmethod
+    def _timed(submitted_at: float, fn: Callable[[], T]) -> T:
+        """
+        Run `fn`, recording how long it waited for a thread and how long it ran.
+        """
+        started_at = time.perf_counter()
+        FIT_QUEUE_WAIT.observe(started_at - submitted_at)
+        try:
+            return fn()
+        finally:
+            FIT_DURATION.observe(time.perf_counter() - started_at)
+
+    def shutdown(self) -> None:
+        """
+        Stop accepting fits and wait for the running ones to finish.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,366 @@
+"""
+Redis-resident arm parameters for MABs.
+
+When `MAB_ARM_STATE_BACKEND` is "redis", rewards update the arm parameters
+held in a Redis hash per arm instead of the `mab_arms` row, and the
+observations are queued in Redis. A background flusher periodically writes
+the queued observations and snapshots of the arm parameters to Postgres.
+"""
+
+import asyncio
+import json
+from datetime import datetime, timezone
+
+from redis import asyncio as aioredis
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_sqlalchemy_async_engine
+from ..models import ExperimentBaseDB, record_queue_batch
+from ..observation_writer import ObservationRecord, copy_observations
+from ..redis_queues import acquire_lock, claim_batch, finish_batch, release_lock
+from ..schemas import SIGMA_LLHOOD, ArmPriors, Outcome, RewardLikelihood
+from ..utils import setup_logger
+from .models import MABArmDB
+from .schemas import ArmResponse
+
+logger = setup_logger()
+
+PENDING_OBSERVATIONS_KEY = "mab-observations:pending"
+PROCESSING_OBSERVATIONS_KEY = "mab-observations:processing"
+FLUSH_LOCK_KEY = "mab-observations:flush-lock"
+
+# Conjugate normal update with ARGV[3] rewards summing to ARGV[4], the same as
+# applying `sampling_utils.update_arm_normal` to each reward in turn, seeding
+# the hash from the database values if these are the first rewards for the arm.
+# The observations to queue follow in ARGV[6] onwards.
+NORMAL_UPDATE_SCRIPT = """
+local arm_key, pending_key = KEYS[1], KEYS[2]
+if redis.call('HEXISTS', arm_key, 'mu') == 0 then
+    redis.call('HSET', arm_key, 'mu', ARGV[1], 'sigma', ARGV[2])
+end
+local mu = tonumber(redis.call('HGET', arm_key, 'mu'))
+local sigma = tonumber(redis.call('HGET', arm_key, 'sigma'))
+local n, reward_sum = tonumber(ARGV[3]), tonumber(ARGV[4])
+local sigma_llhood = tonumber(ARGV[5])
+local precision = 1 / sigma ^ 2 + n / sigma_llhood ^ 2
+local new_mu = string.format(
+    '%.17g', (mu / sigma ^ 2 + reward_sum / sigma_llhood ^ 2) / precision
+)
+local new_sigma = string.format('%.17g', math.sqrt(1 / precision))
+redis.call('HSET', arm_key, 'mu', new_mu, 'sigma', new_sigma)
+-- Push in slices to stay within the Lua stack limit of unpack
+for i = 6, #ARGV, 1000 do
+    redis.call('RPUSH', pending_key, unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+return {new_mu, new_sigma}
+"""
+
+
+def get_arm_state_key(arm_id: int) -> str:
+    """
+    Get the Redis key of the hash holding the arm parameters.
+    """
+    return f"mab-arm:{arm_id}"
+
+
+def _encode_observation(
+    experiment_id: int, arm_id: int, reward: float, user_id: int
+) -> str:
+    """
+    Encode an observation for the pending queue.
+    """
+    return json.dumps(
+        {
+            "experiment_id": experiment_id,
+            "arm_id": arm_id,
+            "reward": reward,
+            "user_id": user_id,
+            "observed_datetime_utc": datetime.now(timezone.utc).isoformat(),
+        }
+    )
+
+
+async def get_arm_states(
+    redis: aioredis.Redis, arms: list[ArmResponse]
+) -> list[ArmResponse]:
+    """
+    Overlay the parameters held in Redis on the given arms. Arms that have not
+    received a reward since Redis was last emptied keep their database values.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        for arm in arms:
+            pipe.hgetall(get_arm_state_key(arm.arm_id))
+        states = await pipe.execute()
+
+    return [
+        (
+            arm.model_copy(update={k.decode(): float(v) for k, v in state.items()})
+            if state
+            else arm
+        )
+        for arm, state in zip(arms, states)
+    ]
+
+
+async def update_arm_state(
+    redis: aioredis.Redis,
+    experiment_id: int,
+    arm: ArmResponse,
+    prior_type: ArmPriors,
+    reward_type: RewardLikelihood,
+    reward: float,
+    user_id: int,
+) -> ArmResponse:
+    """
+    Apply the reward to the arm parameters held in Redis and queue the
+    observation for the flusher.
+
+    Parameters
+    ----------
+    redis : The Redis connection.
+    experiment_id : The experiment the arm belongs to.
+    arm : The arm as last loaded from the database.
+    prior_type : The type of prior distribution for the arms.
+    reward_type : The likelihood distribution of the reward.
+    reward : The reward of the arm.
+    user_id : The owner of the experiment.
+    """
+    (updated_arm,) = await update_arm_states(
+        redis,
+        experiment_id,
+        {arm.arm_id: [reward]},
+        [arm],
+        prior_type,
+        reward_type,
+        user_id,
+    )
+    return updated_arm
+
+
+async def update_arm_states(
+    redis: aioredis.Redis,
+    experiment_id: int,
+    rewards: dict[int, list[float]],
+    arms: list[ArmResponse],
+    prior_type: ArmPriors,
+    reward_type: RewardLikelihood,
+    user_id: int,
+) -> list[ArmResponse]:
+    """
+    Apply the rewards of each arm to its parameters held in Redis with one
+    update per arm, and queue the observations for the flusher, in a single
+    round trip. Returns the updated arms, in the order of `arms`.
+
+    Parameters
+    ----------
+    redis : The Redis connection.
+    experiment_id : The experiment the arms belong to.
+    rewards : The rewards of each arm, by arm id.
+    arms : The arms to update, as last loaded from the database.
+    prior_type : The type of prior distribution for the arms.
+    reward_type : The likelihood distribution of the rewards.
+    user_id : The owner of the experiment.
+    """
+    is_beta = (prior_type == ArmPriors.BETA) and (
+        reward_type == RewardLikelihood.BERNOULLI
+    )
+    is_normal = (prior_type == ArmPriors.NORMAL) and (
+        reward_type == RewardLikelihood.NORMAL
+    )
+    if not (is_beta or is_normal):
+        raise ValueError("Prior and reward type combination is not supported.")
+
+    normal_update = redis.register_script(NORMAL_UPDATE_SCRIPT)
+    async with redis.pipeline(transaction=True) as pipe:
+        for arm in arms:
+            arm_key = get_arm_state_key(arm.arm_id)
+            arm_rewards = rewards[arm.arm_id]
+            observations = [
+                _encode_observation(experiment_id, arm.arm_id, reward, user_id)
+                for reward in arm_rewards
+            ]
+            if is_beta:
+                if arm.alpha is None or arm.beta is None:
+                    raise ValueError("Beta prior requires alpha and beta.")
+                outcomes = [Outcome(reward) for reward in arm_rewards]
+                pipe.hsetnx(arm_key, "alpha", repr(arm.alpha))
+                pipe.hsetnx(arm_key, "beta", repr(arm.beta))
+                pipe.hincrbyfloat(
+                    arm_key, "alpha", float(outcomes.count(Outcome.SUCCESS))
+                )
+                pipe.hincrbyfloat(
+                    arm_key, "beta", float(outcomes.count(Outcome.FAILURE))
+                )
+                pipe.rpush(PENDING_OBSERVATIONS_KEY, *observations)
+            else:
+                if arm.mu is None or arm.sigma is None:
+                    raise ValueError("Normal prior requires mu and sigma.")
+                await normal_update(
+                    keys=[arm_key, PENDING_OBSERVATIONS_KEY],
+                    args=[
+                        repr(arm.mu),
+                        repr(arm.sigma),
+                        len(arm_rewards),
+                        repr(float(sum(arm_rewards))),
+                        repr(SIGMA_LLHOOD),
+                        *observations,
+                    ],
+                    client=pipe,
+                )
+        results = iter(await pipe.execute())
+
+    updated_arms = []
+    for arm in arms:
+        if is_beta:
+            _, _, alpha, beta, _ = (next(results) for _ in range(5))
+            updated_arms.append(
+                arm.model_copy(update={"alpha": float(alpha), "beta": float(beta)})
+            )
+        else:
+            mu, sigma = next(results)
+            updated_arms.append(
+                arm.model_copy(update={"mu": float(mu), "sigma": float(sigma)})
+            )
+    return updated_arms
+
+
+async def delete_arm_states(redis: aioredis.Redis, arm_ids: list[int]) -> None:
+    """
+    Delete the parameters held in Redis for the given arms.
+    """
+    if arm_ids:
+        await redis.delete(*[get_arm_state_key(arm_id) for arm_id in arm_ids])
+
+
+async def flush_arm_states(
+    redis: aioredis.Redis, asession: AsyncSession, batch_size: int
+) -> int:
+    """
+    Write up to `batch_size` queued observations, the matching `n_trials`
+    increments and snapshots of the touched arms to the database. Returns the
+    number of observations taken from the queue, including those dropped for
+    deleted arms.
+
+    The batch is moved to a processing list and only removed from it once the
+    database commit succeeds, so that a batch left there by a failed or
+    interrupted flush is retried before any new observations are taken. The
+    batch id is recorded in the same transaction, so that a batch replayed
+    after its commit, when removing it from Redis failed, is not written
+    twice. Flushes are serialized by the flusher lock, so a single processing
+    list is enough.
+    """
+    batch = await claim_batch(
+        redis, PENDING_OBSERVATIONS_KEY, PROCESSING_OBSERVATIONS_KEY, batch_size
+    )
+    if batch is None:
+        return 0
+    batch_id, raw_observations = batch
+
+    try:
+        if not await record_queue_batch(
+            PROCESSING_OBSERVATIONS_KEY, batch_id, asession
+        ):
+            await asession.rollback()
+            await finish_batch(redis, PROCESSING_OBSERVATIONS_KEY)
+            return len(raw_observations)
+
+        observations = [json.loads(obs) for obs in raw_observations]
+        arm_ids = {obs["arm_id"] for obs in observations}
+
+        # Drop observations for arms deleted since they were queued
+        existing_arm_ids = set(
+            (
+                await asession.execute(
+                    select(MABArmDB.arm_id).where(MABArmDB.arm_id.in_(arm_ids))
+                )
+            )
+            .scalars()
+            .all()
+        )
+        observations = [
+            obs for obs in observations if obs["arm_id"] in existing_arm_ids
+        ]
+
+        await copy_observations(
+            [
+                ObservationRecord(
+                    arm_id=obs["arm_id"],
+                    experiment_id=obs["experiment_id"],
+                    user_id=obs["user_id"],
+                    reward=obs["reward"],
+                    observed_datetime_utc=datetime.fromisoformat(
+                        obs["observed_datetime_utc"]
+                    ),
+                )
+                for obs in observations
+            ],
+            asession,
+        )
+
+        n_trials: dict[int, int] = {}
+        for obs in observations:
+            n_trials[obs["experiment_id"]] = n_trials.get(obs["experiment_id"], 0) + 1
+        for experiment_id, n in n_trials.items():
+            await asession.execute(
+                update(ExperimentBaseDB)
+                .where(ExperimentBaseDB.experiment_id == experiment_id)
+                .values(n_trials=ExperimentBaseDB.n_trials + n)
+            )
+
+        snapshot_arm_ids = sorted(existing_arm_ids)
+        async with redis.pipeline(transaction=False) as pipe:
+            for arm_id in snapshot_arm_ids:
+                pipe.hgetall(get_arm_state_key(arm_id))
+            states = await pipe.execute()
+        snapshots = [
+            {"arm_id": arm_id, **{k.decode(): float(v) for k, v in state.items()}}
+            for arm_id, state in zip(snapshot_arm_ids, states)
+            if state
+        ]
+        for fields in {tuple(sorted(s)) for s in snapshots}:
+            await asession.execute(
+                update(MABArmDB),
+                [s for s in snapshots if tuple(sorted(s)) == fields],
+            )
+
+        await asession.commit()
+    except Exception:
+        # The batch stays in the processing list and is retried by the next
+        # flush
+        await asession.rollback()
+        raise
+
+    await finish_batch(redis, PROCESSING_OBSERVATIONS_KEY)
+    return len(raw_observations)
+
+
+async def run_arm_state_flusher(
+    redis: aioredis.Redis, interval: float, batch_size: int
+) -> None:
+    """
+    Flush queued observations and arm snapshots to the database every
+    `interval` seconds. Only one worker flushes at a time so that snapshots of
+    an arm are always written in order. Runs until cancelled.
+    """
+    lock_timeout_ms = int(max(interval * 10, 30) * 1000)
+    while True:
+        try:
+            token = await acquire_lock(redis, FLUSH_LOCK_KEY, lock_timeout_ms)
+            if token is not None:
+                try:
+                    async with AsyncSession(
+                        get_sqlalchemy_async_engine(), expire_on_commit=False
+                    ) as asession:
+                        while (
+                            await flush_arm_states(redis, asession, batch_size)
+                            == batch_size
+                        ):
+                            pass
+                finally:
+                    await release_lock(redis, FLUSH_LOCK_KEY, token)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error flushing MAB arm states: {e}")
+        await asyncio.sleep(interval)
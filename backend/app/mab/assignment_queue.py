@@ -0,0 +1,153 @@
+"""
+Precomputed arm assignments for MABs.
+
+When `MAB_ASSIGNMENT_QUEUE_SIZE` is set, draws pop an arm from a Redis list
+of assignments sampled in bulk from the posterior instead of sampling on
+every request. The list is regenerated in the background when it runs low or
+when the posterior has changed more than `MAB_ASSIGNMENT_QUEUE_MAX_STALENESS`
+times since it was sampled.
+"""
+
+import numpy as np
+from redis import asyncio as aioredis
+
+from ..posterior_cache import get_posterior_version_key
+from ..redis_queues import acquire_lock, release_lock
+from .schemas import ArmResponse, MultiArmedBanditSample
+
+# Pop the next assignment and return it with the number of assignments left,
+# unless the queue was never sampled or its version is more than ARGV[1]
+# versions behind the posterior, in which case the queue is left as it is and
+# an empty list is returned. An empty queue also returns an empty list.
+POP_ASSIGNMENT_SCRIPT = """
+local queue_key, queue_version_key, version_key = KEYS[1], KEYS[2], KEYS[3]
+local queue_version = redis.call('GET', queue_version_key)
+if not queue_version then
+    return {}
+end
+local version = tonumber(redis.call('GET', version_key) or '0')
+if version - tonumber(queue_version) > tonumber(ARGV[1]) then
+    return {}
+end
+local assignment = redis.call('LPOP', queue_key)
+if not assignment then
+    return {}
+end
+return {assignment, redis.call('LLEN', queue_key)}
+"""
+
+
+def get_assignment_queue_key(experiment_id: int, user_id: int) -> str:
+    """
+    Get the Redis key of the list of assignments for the experiment. The key
+    includes the owner so that users can only pop from their own queues.
+    """
+    return f"mab-assignments:{user_id}:{experiment_id}"
+
+
+def get_assignment_version_key(experiment_id: int, user_id: int) -> str:
+    """
+    Get the Redis key holding the posterior version the queue was sampled at.
+    """
+    return f"mab-assignments-version:{user_id}:{experiment_id}"
+
+
+def get_refill_lock_key(experiment_id: int, user_id: int) -> str:
+    """
+    Get the Redis key of the lock held while the queue is regenerated.
+    """
+    return f"mab-assignments-lock:{user_id}:{experiment_id}"
+
+
+async def pop_assignment(
+    redis: aioredis.Redis,
+    experiment_id: int,
+    user_id: int,
+    low_watermark: int,
+    max_staleness: int,
+) -> tuple[ArmResponse | None, bool]:
+    """
+    Pop the next assignment for the experiment. Returns the assigned arm, or
+    None if the queue is empty or too stale to use, and whether the queue
+    should be regenerated. The staleness is checked before popping, so a stale
+    queue is left for the refill to replace rather than drained.
+    """
+    pop = redis.register_script(POP_ASSIGNMENT_SCRIPT)
+    popped = await pop(
+        keys=[
+            get_assignment_queue_key(experiment_id, user_id),
+            get_assignment_version_key(experiment_id, user_id),
+            get_posterior_version_key(experiment_id),
+        ],
+        args=[max_staleness],
+    )
+    if not popped:
+        return None, True
+
+    assignment, remaining = popped
+    return ArmResponse.model_validate_json(assignment), remaining < low_watermark
+
+
+async def push_assignments(
+    redis: aioredis.Redis,
+    experiment_id: int,
+    user_id: int,
+    experiment: MultiArmedBanditSample,
+    chosen_arms: np.ndarray,
+    version: int,
+) -> None:
+    """
+    Replace the queue of the experiment with the assignments sampled at
+    posterior `version`.
+
+    Parameters
+    ----------
+    redis : The Redis connection.
+    experiment_id : The experiment the assignments are for.
+    user_id : The owner of the experiment.
+    experiment : The posterior the assignments were sampled from.
+    chosen_arms : The index of the arm chosen for each assignment.
+    version : The posterior version `experiment` was loaded at.
+    """
+    encoded_arms = [arm.model_dump_json() for arm in experiment.arms]
+    queue_key = get_assignment_queue_key(experiment_id, user_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.delete(queue_key)
+        pipe.rpush(queue_key, *[encoded_arms[i] for i in chosen_arms])
+        pipe.set(get_assignment_version_key(experiment_id, user_id), version)
+        await pipe.execute()
+
+
+async def acquire_refill_lock(
+    redis: aioredis.Redis, experiment_id: int, user_id: int, timeout_ms: int
+) -> str | None:
+    """
+    Take the lock on regenerating the queue of the experiment, so that only
+    one worker regenerates it at a time. Returns the token to release the lock
+    with, or None if the lock was not taken.
+    """
+    return await acquire_lock(
+        redis, get_refill_lock_key(experiment_id, user_id), timeout_ms
+    )
+
+
+async def release_refill_lock(
+    redis: aioredis.Redis, experiment_id: int, user_id: int, token: str
+) -> None:
+    """
+    Release the lock on regenerating the queue of the experiment, if it is
+    still held with the given token.
+    """
+    await release_lock(redis, get_refill_lock_key(experiment_id, user_id), token)
+
+
+async def delete_assignment_queue(
+    redis: aioredis.Redis, experiment_id: int, user_id: int
+) -> None:
+    """
+    Delete the queue of the experiment.
+    """
+    await redis.delete(
+        get_assignment_queue_key(experiment_id, user_id),
+        get_assignment_version_key(experiment_id, user_id),
+    )
@@ -1,12 +1,17 @@
 from datetime import datetime, timezone
-from typing import Sequence
+from typing import Sequence, cast
 
 from sqlalchemy import (
     Float,
     ForeignKey,
+    Row,
+    Table,
     and_,
     delete,
+    func,
+    insert,
     select,
+    update,
 )
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -17,7 +22,13 @@ from ..models import (
     NotificationsDB,
     ObservationsBaseDB,
 )
-from .schemas import MABObservation, MultiArmedBandit
+from ..schemas import SIGMA_LLHOOD, ArmPriors, RewardLikelihood
+from .schemas import (
+    ArmResponse,
+    MABObservation,
+    MultiArmedBandit,
+    MultiArmedBanditSample,
+)
 
 
 class MultiArmedBanditDB(ExperimentBaseDB):
@@ -36,8 +47,10 @@ class MultiArmedBanditDB(ExperimentBaseDB):
         "MABArmDB", back_populates="experiment", lazy="joined"
     )
 
+    # Observations are only loaded on request, with `selectinload`, so that
+    # loading an experiment does not read its whole history
     observations: Mapped[list["MABObservationDB"]] = relationship(
-        "MABObservationDB", back_populates="experiment", lazy="joined"
+        "MABObservationDB", back_populates="experiment", lazy="raise"
     )
 
     __mapper_args__ = {"polymorphic_identity": "mabs"}
@@ -84,7 +97,7 @@ class MABArmDB(ArmBaseDB):
     )
 
     observations: Mapped[list["MABObservationDB"]] = relationship(
-        "MABObservationDB", back_populates="arm", lazy="joined"
+        "MABObservationDB", back_populates="arm", lazy="raise"
     )
 
     __mapper_args__ = {"polymorphic_identity": "mab_arms"}
@@ -101,7 +114,6 @@ class MABArmDB(ArmBaseDB):
             "beta": self.beta,
             "mu": self.mu,
             "sigma": self.sigma,
-            "observations": [obs.to_dict() for obs in self.observations],
         }
 
 
@@ -110,22 +122,13 @@ class MABObservationDB(ObservationsBaseDB):
     ORM for managing observations of an experiment
     """
 
-    __tablename__ = "mab_observations"
-
-    observation_id: Mapped[int] = mapped_column(
-        ForeignKey("observations_base.observation_id", ondelete="CASCADE"),
-        primary_key=True,
-        nullable=False,
-    )
-
-    reward: Mapped[float] = mapped_column(Float, nullable=False)
-
     arm: Mapped[MABArmDB] = relationship(
-        "MABArmDB", back_populates="observations", lazy="joined"
+        "MABArmDB", back_populates="observations", lazy="raise"
     )
     experiment: Mapped[MultiArmedBanditDB] = relationship(
-        "MultiArmedBanditDB", back_populates="observations", lazy="joined"
+        "MultiArmedBanditDB", back_populates="observations", lazy="raise"
     )
+
     __mapper_args__ = {"polymorphic_identity": "mab_observations"}
 
     def to_dict(self) -> dict:
@@ -206,6 +209,77 @@ async def get_mab_by_id(
     return result.unique().scalar_one_or_none()
 
 
+async def get_mab_sample_by_id(
+    experiment_id: int, user_id: int, asession: AsyncSession
+) -> MultiArmedBanditSample | None:
+    """
+    Get the posterior parameters needed to draw an arm for the experiment.
+    """
+    samples = await get_mab_samples_by_ids([experiment_id], user_id, asession)
+    return samples.get(experiment_id)
+
+
+async def get_mab_samples_by_ids(
+    experiment_ids: list[int], user_id: int, asession: AsyncSession
+) -> dict[int, MultiArmedBanditSample]:
+    """
+    Get the posterior parameters needed to draw an arm for each of the
+    experiments, keyed by `experiment_id`. Experiments that do not exist or do
+    not belong to the user are left out.
+
+    Selects only the experiment and arm columns so that the cost of a draw
+    does not grow with the number of observations for the experiment.
+    """
+    statement = (
+        select(
+            MultiArmedBanditDB.experiment_id,
+            MultiArmedBanditDB.name,
+            MultiArmedBanditDB.description,
+            MultiArmedBanditDB.is_active,
+            MultiArmedBanditDB.prior_type,
+            MultiArmedBanditDB.reward_type,
+            MABArmDB.arm_id,
+            MABArmDB.name.label("arm_name"),
+            MABArmDB.description.label("arm_description"),
+            MABArmDB.alpha,
+            MABArmDB.beta,
+            MABArmDB.mu,
+            MABArmDB.sigma,
+        )
+        .join(MABArmDB, MABArmDB.experiment_id == MultiArmedBanditDB.experiment_id)
+        .where(MultiArmedBanditDB.user_id == user_id)
+        .where(MultiArmedBanditDB.experiment_id.in_(experiment_ids))
+        .order_by(MultiArmedBanditDB.experiment_id, MABArmDB.arm_id)
+    )
+    rows = (await asession.execute(statement)).all()
+
+    samples: dict[int, MultiArmedBanditSample] = {}
+    for row in rows:
+        if row.experiment_id not in samples:
+            samples[row.experiment_id] = MultiArmedBanditSample(
+                experiment_id=row.experiment_id,
+                name=row.name,
+                description=row.description,
+                is_active=row.is_active,
+                prior_type=row.prior_type,
+                reward_type=row.reward_type,
+                arms=[],
+            )
+        samples[row.experiment_id].arms.append(
+            ArmResponse(
+                arm_id=row.arm_id,
+                name=row.arm_name,
+                description=row.arm_description,
+                alpha=row.alpha,
+                beta=row.beta,
+                mu=row.mu,
+                sigma=row.sigma,
+            )
+        )
+
+    return samples
+
+
 async def delete_mab_by_id(
     experiment_id: int, user_id: int, asession: AsyncSession
 ) -> None:
@@ -219,13 +293,9 @@ async def delete_mab_by_id(
     )
 
     await asession.execute(
-        delete(MABObservationDB).where(
-            and_(
-                MABObservationDB.observation_id == ObservationsBaseDB.observation_id,
-                ObservationsBaseDB.user_id == user_id,
-                ObservationsBaseDB.experiment_id == experiment_id,
-            )
-        )
+        delete(MABObservationDB)
+        .where(MABObservationDB.user_id == user_id)
+        .where(MABObservationDB.experiment_id == experiment_id)
     )
     await asession.execute(
         delete(MABArmDB).where(
@@ -249,25 +319,107 @@ async def delete_mab_by_id(
     return None
 
 
-async def save_observation_to_db(
-    observation: MABObservation,
-    user_id: int,
+async def increment_mab_n_trials(
+    experiment_id: int, user_id: int, n_trials: int, asession: AsyncSession
+) -> Row | None:
+    """
+    Atomically add `n_trials` to the trial count of the experiment, returning
+    its `prior_type` and `reward_type`, or None if the experiment is not found.
+    The change is committed with the rest of the session.
+    """
+    result = await asession.execute(
+        update(ExperimentBaseDB)
+        .where(ExperimentBaseDB.experiment_id == experiment_id)
+        .where(ExperimentBaseDB.user_id == user_id)
+        .where(ExperimentBaseDB.exp_type == "mabs")
+        .values(n_trials=ExperimentBaseDB.n_trials + n_trials)
+        .returning(ExperimentBaseDB.prior_type, ExperimentBaseDB.reward_type)
+    )
+    return result.one_or_none()
+
+
+async def update_mab_arm_by_rewards(
+    experiment_id: int,
+    arm_id: int,
+    prior_type: ArmPriors,
+    reward_type: RewardLikelihood,
+    n_rewards: int,
+    reward_sum: float,
     asession: AsyncSession,
-) -> MABObservationDB:
+) -> ArmResponse | None:
     """
-    Save the observation to the database.
+    Atomically apply `n_rewards` rewards summing to `reward_sum` to the arm
+    parameters in a single UPDATE, so that concurrent updates to the same arm
+    are never lost. Returns the updated arm, or None if the arm is not found.
+    The change is committed with the rest of the session.
+
+    The conjugate updates only depend on the rewards through their count and
+    sum, so applying them in one step gives the same posterior as applying
+    them one at a time with `sampling_utils.update_arm_params`.
     """
-    observation_db = MABObservationDB(
-        **observation.model_dump(),
-        user_id=user_id,
-        observed_datetime_utc=datetime.now(timezone.utc),
+    arms = cast(Table, MABArmDB.__table__)
+    arms_base = cast(Table, ArmBaseDB.__table__)
+
+    if (prior_type == ArmPriors.BETA) and (reward_type == RewardLikelihood.BERNOULLI):
+        values = {
+            "alpha": arms.c.alpha + reward_sum,
+            "beta": arms.c.beta + (n_rewards - reward_sum),
+        }
+    elif (prior_type == ArmPriors.NORMAL) and (reward_type == RewardLikelihood.NORMAL):
+        variance = arms.c.sigma * arms.c.sigma
+        llhood_variance = SIGMA_LLHOOD**2
+        denom = llhood_variance + n_rewards * variance
+        values = {
+            "mu": (arms.c.mu * llhood_variance + reward_sum * variance) / denom,
+            "sigma": arms.c.sigma * SIGMA_LLHOOD / func.sqrt(denom, type_=Float),
+        }
+    else:
+        raise ValueError("Prior and reward type combination is not supported.")
+
+    result = await asession.execute(
+        update(arms)
+        .where(arms.c.arm_id == arms_base.c.arm_id)
+        .where(arms_base.c.arm_id == arm_id)
+        .where(arms_base.c.experiment_id == experiment_id)
+        .values(values)
+        .returning(
+            arms.c.arm_id,
+            arms_base.c.name,
+            arms_base.c.description,
+            arms.c.alpha,
+            arms.c.beta,
+            arms.c.mu,
+            arms.c.sigma,
+        )
     )
+    row = result.one_or_none()
+    if row is None:
+        return None
+
+    return ArmResponse.model_validate(row._asdict())
 
-    asession.add(observation_db)
-    await asession.commit()
-    await asession.refresh(observation_db)
 
-    return observation_db
+async def save_observations_to_db(
+    observations: list[MABObservation],
+    user_id: int,
+    asession: AsyncSession,
+) -> None:
+    """
+    Add the observations to the session with a single multi-row insert per
+    table. The rows are committed with the rest of the session.
+    """
+    observed_datetime_utc = datetime.now(timezone.utc)
+    await asession.execute(
+        insert(MABObservationDB),
+        [
+            {
+                **observation.model_dump(),
+                "user_id": user_id,
+                "observed_datetime_utc": observed_datetime_utc,
+            }
+            for observation in observations
+        ],
+    )
 
 
 async def get_rewards_by_experiment_arm_id(
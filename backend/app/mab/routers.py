@@ -1,28 +1,69 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+import numpy as np
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, Query, Request
 from fastapi.exceptions import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..auth.dependencies import authenticate_key, get_current_user
-from ..database import get_async_session
+from ..config import (
+    MAB_ARM_STATE_BACKEND,
+    MAB_ASSIGNMENT_QUEUE_LOW_WATERMARK,
+    MAB_ASSIGNMENT_QUEUE_MAX_STALENESS,
+    MAB_ASSIGNMENT_QUEUE_SIZE,
+    MAX_DRAW_BATCH_SIZE,
+    MAX_OUTCOMES_BATCH_SIZE,
+)
+from ..database import (
+    get_async_session,
+    get_readonly_session,
+    get_sqlalchemy_async_engine,
+)
 from ..models import get_notifications_from_db, save_notifications_to_db
-from ..schemas import NotificationsResponse, Outcome, RewardLikelihood
+from ..observation_writer import ObservationRecord, copy_observations
+from ..posterior_cache import (
+    bump_posterior_version,
+    get_or_load_posterior,
+    get_or_load_posteriors,
+    get_posterior_version,
+    invalidate_posterior,
+)
+from ..schemas import NotificationsResponse, RewardLikelihood
 from ..users.models import UserDB
+from .arm_state import (
+    delete_arm_states,
+    get_arm_states,
+    update_arm_state,
+    update_arm_states,
+)
+from .assignment_queue import (
+    acquire_refill_lock,
+    delete_assignment_queue,
+    pop_assignment,
+    push_assignments,
+    release_refill_lock,
+)
 from .models import (
     delete_mab_by_id,
     get_all_mabs,
     get_all_rewards_by_experiment_id,
     get_mab_by_id,
+    get_mab_sample_by_id,
+    get_mab_samples_by_ids,
+    increment_mab_n_trials,
     save_mab_to_db,
-    save_observation_to_db,
+    save_observations_to_db,
+    update_mab_arm_by_rewards,
 )
-from .sampling_utils import choose_arm, update_arm_params
+from .sampling_utils import choose_arm, choose_arm_per_experiment, choose_arms
 from .schemas import (
     ArmResponse,
     MABObservation,
     MABObservationResponse,
+    MABOutcome,
     MultiArmedBandit,
+    MultiArmedBanditDraw,
+    MultiArmedBanditDrawBatch,
     MultiArmedBanditResponse,
     MultiArmedBanditSample,
 )
@@ -30,6 +71,49 @@ from .schemas import (
 router = APIRouter(prefix="/mab", tags=["Multi-Armed Bandits"])
 
 
+async def get_draw_samples(
+    request: Request, experiment_ids: list[int], user_id: int, asession: AsyncSession
+) -> dict[int, MultiArmedBanditSample]:
+    """
+    Get the current posteriors of the experiments, from the worker's cache if
+    possible, with arm parameters from Redis when arm state is kept there.
+    Experiments that are not found are left out.
+    """
+    posteriors = await get_or_load_posteriors(
+        request.app.state.posterior_cache,
+        request.app.state.redis,
+        experiment_ids,
+        user_id,
+        lambda ids: get_mab_samples_by_ids(ids, user_id, asession),
+    )
+    samples = {
+        experiment_id: MultiArmedBanditSample.model_validate(posterior.sample)
+        for experiment_id, posterior in posteriors.items()
+    }
+
+    if MAB_ARM_STATE_BACKEND == "redis" and samples:
+        arms = await get_arm_states(
+            request.app.state.redis,
+            [arm for sample in samples.values() for arm in sample.arms],
+        )
+        start = 0
+        for experiment_id, sample in samples.items():
+            end = start + len(sample.arms)
+            samples[experiment_id] = sample.model_copy(update={"arms": arms[start:end]})
+            start = end
+    return samples
+
+
+async def get_draw_sample(
+    request: Request, experiment_id: int, user_id: int, asession: AsyncSession
+) -> MultiArmedBanditSample | None:
+    """
+    Get the current posterior of the experiment.
+    """
+    samples = await get_draw_samples(request, [experiment_id], user_id, asession)
+    return samples.get(experiment_id)
+
+
 @router.post("/", response_model=MultiArmedBanditResponse)
 async def create_mab(
     experiment: MultiArmedBandit,
@@ -56,7 +140,7 @@ async def create_mab(
 @router.get("/", response_model=list[MultiArmedBanditResponse])
 async def get_mabs(
     user_db: Annotated[UserDB, Depends(get_current_user)],
-    asession: AsyncSession = Depends(get_async_session),
+    asession: AsyncSession = Depends(get_readonly_session),
 ) -> list[MultiArmedBanditResponse]:
     """
     Get details of all experiments.
@@ -85,6 +169,33 @@ async def get_mabs(
     return all_experiments
 
 
+@router.post("/draw", response_model=list[MultiArmedBanditDraw])
+async def draw_arm_per_experiment(
+    request: Request,
+    experiment_ids: list[int] = Body(min_length=1, max_length=MAX_DRAW_BATCH_SIZE),
+    user_db: UserDB = Depends(authenticate_key),
+    asession: AsyncSession = Depends(get_async_session),
+) -> list[MultiArmedBanditDraw]:
+    """
+    Get which arm to pull next for each of the provided experiments.
+    """
+    experiments = await get_draw_samples(
+        request, experiment_ids, user_db.user_id, asession
+    )
+    missing_ids = [i for i in experiment_ids if i not in experiments]
+    if missing_ids:
+        raise HTTPException(
+            status_code=404, detail=f"Experiments with ids {missing_ids} not found"
+        )
+
+    experiment_data = [experiments[i] for i in experiment_ids]
+    chosen_arms = choose_arm_per_experiment(experiment_data)
+    return [
+        MultiArmedBanditDraw(experiment_id=exp.experiment_id, arm=exp.arms[arm])
+        for exp, arm in zip(experiment_data, chosen_arms)
+    ]
+
+
 @router.get("/{experiment_id}", response_model=MultiArmedBanditResponse)
 async def get_mab(
     experiment_id: int,
@@ -115,6 +226,7 @@ async def get_mab(
 @router.delete("/{experiment_id}", response_model=dict)
 async def delete_mab(
     experiment_id: int,
+    request: Request,
     user_db: Annotated[UserDB, Depends(get_current_user)],
     asession: AsyncSession = Depends(get_async_session),
 ) -> dict:
@@ -128,28 +240,127 @@ async def delete_mab(
                 status_code=404, detail=f"Experiment with id {experiment_id} not found"
             )
         await delete_mab_by_id(experiment_id, user_db.user_id, asession)
+        if MAB_ARM_STATE_BACKEND == "redis":
+            await delete_arm_states(
+                request.app.state.redis, [arm.arm_id for arm in experiment.arms]
+            )
+        if MAB_ASSIGNMENT_QUEUE_SIZE > 0:
+            await delete_assignment_queue(
+                request.app.state.redis, experiment_id, user_db.user_id
+            )
+        await invalidate_posterior(
+            request.app.state.posterior_cache, request.app.state.redis, experiment_id
+        )
         return {"message": f"Experiment with id {experiment_id} deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {e}") from e
 
 
+async def refill_assignment_queue(
+    request: Request, experiment_id: int, user_id: int
+) -> None:
+    """
+    Regenerate the queue of precomputed assignments for the experiment from
+    its current posterior, unless another worker is already doing so.
+    """
+    redis = request.app.state.redis
+    token = await acquire_refill_lock(redis, experiment_id, user_id, 30000)
+    if token is None:
+        return
+    try:
+        # Read the version before loading so the queue is never newer than
+        # it claims to be
+        version = await get_posterior_version(redis, experiment_id)
+        async with AsyncSession(
+            get_sqlalchemy_async_engine(), expire_on_commit=False
+        ) as asession:
+            experiment_data = await get_draw_sample(
+                request, experiment_id, user_id, asession
+            )
+        if experiment_data is None:
+            return
+
+        chosen_arms = choose_arms(experiment_data, MAB_ASSIGNMENT_QUEUE_SIZE)
+        await push_assignments(
+            redis, experiment_id, user_id, experiment_data, chosen_arms, version
+        )
+    finally:
+        await release_refill_lock(redis, experiment_id, user_id, token)
+
+
 @router.get("/{experiment_id}/draw", response_model=ArmResponse)
 async def draw_arm(
     experiment_id: int,
+    request: Request,
+    background_tasks: BackgroundTasks,
     user_db: UserDB = Depends(authenticate_key),
     asession: AsyncSession = Depends(get_async_session),
 ) -> ArmResponse:
     """
     Get which arm to pull next for provided experiment.
     """
-    experiment = await get_mab_by_id(experiment_id, user_db.user_id, asession)
-    if experiment is None:
+    needs_refill = False
+    if MAB_ASSIGNMENT_QUEUE_SIZE > 0:
+        arm, needs_refill = await pop_assignment(
+            request.app.state.redis,
+            experiment_id,
+            user_db.user_id,
+            low_watermark=MAB_ASSIGNMENT_QUEUE_LOW_WATERMARK,
+            max_staleness=MAB_ASSIGNMENT_QUEUE_MAX_STALENESS,
+        )
+        # A queue only exists for an existing experiment, which deleting the
+        # experiment removes, so the refill can be scheduled right away
+        if arm is not None:
+            if needs_refill:
+                background_tasks.add_task(
+                    refill_assignment_queue, request, experiment_id, user_db.user_id
+                )
+            return arm
+
+    experiment_data = await get_draw_sample(
+        request, experiment_id, user_db.user_id, asession
+    )
+    if experiment_data is None:
         raise HTTPException(
             status_code=404, detail=f"Experiment with id {experiment_id} not found"
         )
-    experiment_data = MultiArmedBanditSample.model_validate(experiment)
+    if needs_refill:
+        background_tasks.add_task(
+            refill_assignment_queue, request, experiment_id, user_db.user_id
+        )
     chosen_arm = choose_arm(experiment=experiment_data)
-    return ArmResponse.model_validate(experiment.arms[chosen_arm])
+    return experiment_data.arms[chosen_arm]
+
+
+@router.get("/{experiment_id}/draw/batch", response_model=MultiArmedBanditDrawBatch)
+async def draw_arms(
+    experiment_id: int,
+    request: Request,
+    n: int = Query(ge=1, le=MAX_DRAW_BATCH_SIZE, description="Number of draws"),
+    user_db: UserDB = Depends(authenticate_key),
+    asession: AsyncSession = Depends(get_async_session),
+) -> MultiArmedBanditDrawBatch:
+    """
+    Get which arms to pull for `n` independent draws for provided experiment.
+    """
+    experiment_data = await get_draw_sample(
+        request, experiment_id, user_db.user_id, asession
+    )
+    if experiment_data is None:
+        raise HTTPException(
+            status_code=404, detail=f"Experiment with id {experiment_id} not found"
+        )
+    chosen_arms = choose_arms(experiment=experiment_data, n=n)
+    arm_ids = np.array([arm.arm_id for arm in experiment_data.arms])[chosen_arms]
+    counts = np.bincount(chosen_arms, minlength=len(experiment_data.arms))
+
+    return MultiArmedBanditDrawBatch(
+        experiment_id=experiment_id,
+        arm_ids=arm_ids.tolist(),
+        arm_counts={
+            arm.arm_id: int(count) for arm, count in zip(experiment_data.arms, counts)
+        },
+    )
 
 
 @router.put("/{experiment_id}/{arm_id}/{outcome}", response_model=ArmResponse)
@@ -157,6 +368,7 @@ async def update_arm(
     experiment_id: int,
     arm_id: int,
     outcome: float,
+    request: Request,
     user_db: UserDB = Depends(authenticate_key),
     asession: AsyncSession = Depends(get_async_session),
 ) -> ArmResponse:
@@ -164,63 +376,247 @@ async def update_arm(
     Update the arm with the provided `arm_id` for the given
     `experiment_id` based on the `outcome`.
     """
-    # Get and validate experiment
-    experiment = await get_mab_by_id(experiment_id, user_db.user_id, asession)
+    if MAB_ARM_STATE_BACKEND == "redis":
+        return await update_arm_in_redis(
+            request, experiment_id, arm_id, outcome, user_db, asession
+        )
+
+    # Increment trials and get experiment types in the same statement
+    experiment = await increment_mab_n_trials(
+        experiment_id, user_db.user_id, 1, asession
+    )
     if experiment is None:
         raise HTTPException(
             status_code=404, detail=f"Experiment with id {experiment_id} not found"
         )
-    experiment.n_trials += 1
-    experiment_data = MultiArmedBanditSample.model_validate(experiment)
 
-    # Get and validate arm
-    arms = [a for a in experiment.arms if a.arm_id == arm_id]
-    if not arms:
+    if experiment.reward_type == RewardLikelihood.BERNOULLI and outcome not in (0, 1):
+        # Discard the n_trials increment before any other write
+        await asession.rollback()
+        raise HTTPException(status_code=400, detail="Reward must be 0 or 1.")
+
+    # Update arm parameters in the database
+    try:
+        arm = await update_mab_arm_by_rewards(
+            experiment_id,
+            arm_id,
+            experiment.prior_type,
+            experiment.reward_type,
+            n_rewards=1,
+            reward_sum=outcome,
+            asession=asession,
+        )
+    except ValueError as e:
+        await asession.rollback()
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    if arm is None:
+        await asession.rollback()
         raise HTTPException(status_code=404, detail=f"Arm with id {arm_id} not found")
 
-    arm = arms[0]
+    # Save observation and commit it with the updates as one unit of work
+    observation = MABObservation(
+        experiment_id=experiment_id,
+        arm_id=arm.arm_id,
+        reward=outcome,
+    )
+    await save_observations_to_db([observation], user_db.user_id, asession)
+    await asession.commit()
+
+    await invalidate_posterior(
+        request.app.state.posterior_cache, request.app.state.redis, experiment_id
+    )
+
+    return arm
+
+
+async def update_arm_in_redis(
+    request: Request,
+    experiment_id: int,
+    arm_id: int,
+    outcome: float,
+    user_db: UserDB,
+    asession: AsyncSession,
+) -> ArmResponse:
+    """
+    Update the arm parameters held in Redis. The observation, the `n_trials`
+    increment and the new arm parameters reach the database when the arm
+    state flusher next runs.
+    """
+    posterior = await get_or_load_posterior(
+        request.app.state.posterior_cache,
+        request.app.state.redis,
+        experiment_id,
+        user_db.user_id,
+        lambda: get_mab_sample_by_id(experiment_id, user_db.user_id, asession),
+    )
+    if posterior is None:
+        raise HTTPException(
+            status_code=404, detail=f"Experiment with id {experiment_id} not found"
+        )
+    experiment_data = MultiArmedBanditSample.model_validate(posterior.sample)
 
-    # Update arm based on reward type
-    if experiment_data.reward_type == RewardLikelihood.BERNOULLI:
-        Outcome(outcome)  # Check if reward is 0 or 1
-        arm.alpha, arm.beta = update_arm_params(
-            ArmResponse.model_validate(arm),
-            experiment_data.prior_type,
-            experiment_data.reward_type,
-            outcome,
+    arms = [a for a in experiment_data.arms if a.arm_id == arm_id]
+    if not arms:
+        raise HTTPException(status_code=404, detail=f"Arm with id {arm_id} not found")
+
+    try:
+        arm = await update_arm_state(
+            request.app.state.redis,
+            experiment_id=experiment_id,
+            arm=arms[0],
+            prior_type=experiment_data.prior_type,
+            reward_type=experiment_data.reward_type,
+            reward=outcome,
+            user_id=user_db.user_id,
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
 
-    elif experiment_data.reward_type == RewardLikelihood.NORMAL:
-        arm.mu, arm.sigma = update_arm_params(
-            ArmResponse.model_validate(arm),
-            experiment_data.prior_type,
-            experiment_data.reward_type,
-            outcome)
+    if MAB_ASSIGNMENT_QUEUE_SIZE > 0:
+        # Count the change towards the staleness of precomputed assignments
+        await bump_posterior_version(request.app.state.redis, experiment_id)
+    return arm
+
+
+@router.post("/{experiment_id}/outcomes/bulk", response_model=list[ArmResponse])
+async def update_arms_bulk(
+    experiment_id: int,
+    request: Request,
+    outcomes: list[MABOutcome] = Body(min_length=1, max_length=MAX_OUTCOMES_BATCH_SIZE),
+    user_db: UserDB = Depends(authenticate_key),
+    asession: AsyncSession = Depends(get_async_session),
+) -> list[ArmResponse]:
+    """
+    Update the arms of the given `experiment_id` with a batch of outcomes.
+    The outcomes are reduced to a count and sum of rewards per arm, so each
+    arm gets a single posterior update. Returns the updated arms.
+    """
+    if MAB_ARM_STATE_BACKEND == "redis":
+        return await update_arms_bulk_in_redis(
+            request, experiment_id, outcomes, user_db, asession
+        )
 
-    else:
+    experiment = await increment_mab_n_trials(
+        experiment_id, user_db.user_id, len(outcomes), asession
+    )
+    if experiment is None:
         raise HTTPException(
-            status_code=400,
-            detail="Reward type not supported.",
+            status_code=404, detail=f"Experiment with id {experiment_id} not found"
         )
 
-    # Save modified arm to database
-    asession.add(arm)
+    arm_ids = np.array([o.arm_id for o in outcomes])
+    rewards = np.array([o.reward for o in outcomes])
+    if (
+        experiment.reward_type == RewardLikelihood.BERNOULLI
+        and not np.isin(rewards, [0, 1]).all()
+    ):
+        await asession.rollback()
+        raise HTTPException(status_code=400, detail="Rewards must be 0 or 1.")
+
+    # Sufficient statistics per arm, in arm_id order so that concurrent
+    # uploads lock the arm rows in the same order
+    unique_arm_ids, arm_index = np.unique(arm_ids, return_inverse=True)
+    n_rewards = np.bincount(arm_index)
+    reward_sums = np.bincount(arm_index, weights=rewards)
+
+    arms = []
+    for arm_id, n, reward_sum in zip(unique_arm_ids, n_rewards, reward_sums):
+        try:
+            arm = await update_mab_arm_by_rewards(
+                experiment_id,
+                int(arm_id),
+                experiment.prior_type,
+                experiment.reward_type,
+                n_rewards=int(n),
+                reward_sum=float(reward_sum),
+                asession=asession,
+            )
+        except ValueError as e:
+            await asession.rollback()
+            raise HTTPException(status_code=400, detail=str(e)) from e
+        if arm is None:
+            await asession.rollback()
+            raise HTTPException(
+                status_code=404, detail=f"Arm with id {arm_id} not found"
+            )
+        arms.append(arm)
+
+    await copy_observations(
+        [
+            ObservationRecord(
+                arm_id=o.arm_id,
+                experiment_id=experiment_id,
+                user_id=user_db.user_id,
+                reward=o.reward,
+            )
+            for o in outcomes
+        ],
+        asession,
+    )
     await asession.commit()
-    observation = MABObservation(
-        experiment_id=experiment.experiment_id,
-        arm_id=arm.arm_id,
-        reward=outcome,
+
+    await invalidate_posterior(
+        request.app.state.posterior_cache, request.app.state.redis, experiment_id
     )
-    await save_observation_to_db(observation, user_db.user_id, asession)
 
-    observation = MABObservation(
-        experiment_id=experiment.experiment_id,
-        arm_id=arm.arm_id,
-        reward=outcome,
+    return arms
+
+
+async def update_arms_bulk_in_redis(
+    request: Request,
+    experiment_id: int,
+    outcomes: list[MABOutcome],
+    user_db: UserDB,
+    asession: AsyncSession,
+) -> list[ArmResponse]:
+    """
+    Apply a batch of outcomes to the arm parameters held in Redis. The
+    observations reach the database when the arm state flusher next runs.
+    """
+    posterior = await get_or_load_posterior(
+        request.app.state.posterior_cache,
+        request.app.state.redis,
+        experiment_id,
+        user_db.user_id,
+        lambda: get_mab_sample_by_id(experiment_id, user_db.user_id, asession),
     )
-    await save_observation_to_db(observation, user_db.user_id, asession)
+    if posterior is None:
+        raise HTTPException(
+            status_code=404, detail=f"Experiment with id {experiment_id} not found"
+        )
+    experiment_data = MultiArmedBanditSample.model_validate(posterior.sample)
 
-    return ArmResponse.model_validate(arm)
+    arms = {arm.arm_id: arm for arm in experiment_data.arms}
+    missing_ids = sorted({o.arm_id for o in outcomes} - set(arms))
+    if missing_ids:
+        raise HTTPException(
+            status_code=404, detail=f"Arms with ids {missing_ids} not found"
+        )
+    if experiment_data.reward_type == RewardLikelihood.BERNOULLI and any(
+        o.reward not in (0, 1) for o in outcomes
+    ):
+        raise HTTPException(status_code=400, detail="Rewards must be 0 or 1.")
+
+    rewards: dict[int, list[float]] = {}
+    for o in outcomes:
+        rewards.setdefault(o.arm_id, []).append(o.reward)
+    try:
+        updated_arms = await update_arm_states(
+            request.app.state.redis,
+            experiment_id=experiment_id,
+            rewards=rewards,
+            arms=[arms[arm_id] for arm_id in sorted(rewards)],
+            prior_type=experiment_data.prior_type,
+            reward_type=experiment_data.reward_type,
+            user_id=user_db.user_id,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    if MAB_ASSIGNMENT_QUEUE_SIZE > 0:
+        # Count the change towards the staleness of precomputed assignments
+        await bump_posterior_version(request.app.state.redis, experiment_id)
+    return updated_arms
 
 
 @router.get(
@@ -230,7 +626,7 @@ async def update_arm(
 async def get_outcomes(
     experiment_id: int,
     user_db: UserDB = Depends(authenticate_key),
-    asession: AsyncSession = Depends(get_async_session),
+    asession: AsyncSession = Depends(get_readonly_session),
 ) -> list[MABObservationResponse]:
     """
     Get the outcomes for the experiment.
@@ -240,7 +636,6 @@ async def get_outcomes(
         raise HTTPException(
             status_code=404, detail=f"Experiment with id {experiment_id} not found"
         )
-    experiment.n_trials += 1
 
     rewards = await get_all_rewards_by_experiment_id(
         experiment_id=experiment.experiment_id,
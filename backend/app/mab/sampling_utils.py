@@ -1,8 +1,11 @@
+from typing import Callable
+
 import numpy as np
-from numpy.random import beta, normal
+from numpy.random import beta
 
 from ..mab.schemas import ArmResponse, MultiArmedBanditSample
-from ..schemas import ArmPriors, Outcome, RewardLikelihood
+from ..schemas import SIGMA_LLHOOD, ArmPriors, Outcome, RewardLikelihood
+from ..variate_pool import get_variate_pool
 
 
 def sample_beta_binomial(alphas: np.ndarray, betas: np.ndarray) -> int:
@@ -27,10 +30,42 @@ def sample_normal(mus: np.ndarray, sigmas: np.ndarray) -> int:
     mus: mean of Normal distribution for each arm
     sigmas: standard deviation of Normal distribution for each arm
     """
-    samples = normal(loc=mus, scale=sigmas)
+    samples = get_variate_pool().normal(loc=mus, scale=sigmas)
     return int(samples.argmax())
 
 
+def sample_beta_binomial_batch(
+    alphas: np.ndarray, betas: np.ndarray, n: int
+) -> np.ndarray:
+    """
+    Thompson Sampling with Beta-Binomial distribution for `n` independent draws
+    at once.
+
+    Parameters
+    ----------
+    alphas : alpha parameter of Beta distribution for each arm
+    betas : beta parameter of Beta distribution for each arm
+    n : number of draws
+    """
+    samples = beta(alphas, betas, size=(n, len(alphas)))
+    return samples.argmax(axis=1)
+
+
+def sample_normal_batch(mus: np.ndarray, sigmas: np.ndarray, n: int) -> np.ndarray:
+    """
+    Thompson Sampling with conjugate normal distribution for `n` independent
+    draws at once.
+
+    Parameters
+    ----------
+    mus: mean of Normal distribution for each arm
+    sigmas: standard deviation of Normal distribution for each arm
+    n : number of draws
+    """
+    samples = get_variate_pool().normal(loc=mus, scale=sigmas, size=(n, len(mus)))
+    return samples.argmax(axis=1)
+
+
 def update_arm_beta_binomial(
     alpha: float, beta: float, reward: Outcome
 ) -> tuple[float, float]:
@@ -94,12 +129,83 @@ def choose_arm(experiment: MultiArmedBanditSample) -> int:
     ):
         mus = np.array([arm.mu for arm in experiment.arms])
         sigmas = np.array([arm.sigma for arm in experiment.arms])
-        # TODO: add support for non-std sigma_llhood
         return sample_normal(mus=mus, sigmas=sigmas)
     else:
         raise ValueError("Prior and reward type combination is not supported.")
 
 
+def choose_arms(experiment: MultiArmedBanditSample, n: int) -> np.ndarray:
+    """
+    Choose arms for `n` independent draws based on posterior.
+
+    Parameters
+    ----------
+    experiment : The experiment data containing priors and rewards for each arm.
+    n : The number of draws.
+    """
+    if (experiment.prior_type == ArmPriors.BETA) and (
+        experiment.reward_type == RewardLikelihood.BERNOULLI
+    ):
+        alphas = np.array([arm.alpha for arm in experiment.arms])
+        betas = np.array([arm.beta for arm in experiment.arms])
+
+        return sample_beta_binomial_batch(alphas=alphas, betas=betas, n=n)
+
+    elif (experiment.prior_type == ArmPriors.NORMAL) and (
+        experiment.reward_type == RewardLikelihood.NORMAL
+    ):
+        mus = np.array([arm.mu for arm in experiment.arms])
+        sigmas = np.array([arm.sigma for arm in experiment.arms])
+        return sample_normal_batch(mus=mus, sigmas=sigmas, n=n)
+    else:
+        raise ValueError("Prior and reward type combination is not supported.")
+
+
+def choose_arm_per_experiment(experiments: list[MultiArmedBanditSample]) -> list[int]:
+    """
+    Choose one arm for each of the experiments based on their posteriors,
+    sampling all experiments of the same prior and reward type in one call.
+
+    Parameters
+    ----------
+    experiments : The experiments to draw an arm for.
+    """
+    pool = get_variate_pool()
+    families: dict[tuple[str, str], tuple[str, str, Callable[..., np.ndarray]]] = {
+        (ArmPriors.BETA, RewardLikelihood.BERNOULLI): ("alpha", "beta", beta),
+        (ArmPriors.NORMAL, RewardLikelihood.NORMAL): ("mu", "sigma", pool.normal),
+    }
+    if any((exp.prior_type, exp.reward_type) not in families for exp in experiments):
+        raise ValueError("Prior and reward type combination is not supported.")
+
+    chosen_arms = [0] * len(experiments)
+    n_arms = max((len(exp.arms) for exp in experiments), default=0)
+    for (prior_type, reward_type), (p1, p2, sampler) in families.items():
+        idx = [
+            i
+            for i, exp in enumerate(experiments)
+            if exp.prior_type == prior_type and exp.reward_type == reward_type
+        ]
+        if not idx:
+            continue
+
+        # Pad experiments with fewer arms with a valid dummy arm that can
+        # never be chosen
+        params = np.ones((2, len(idx), n_arms))
+        mask = np.zeros((len(idx), n_arms), dtype=bool)
+        for row, i in enumerate(idx):
+            k = len(experiments[i].arms)
+            params[0, row, :k] = [getattr(arm, p1) for arm in experiments[i].arms]
+            params[1, row, :k] = [getattr(arm, p2) for arm in experiments[i].arms]
+            mask[row, :k] = True
+
+        samples = np.where(mask, sampler(params[0], params[1]), -np.inf)
+        for i, arm in zip(idx, samples.argmax(axis=1)):
+            chosen_arms[i] = int(arm)
+
+    return chosen_arms
+
+
 def update_arm_params(
     arm: ArmResponse,
     prior_type: ArmPriors,
@@ -132,7 +238,7 @@ def update_arm_params(
             current_mu=arm.mu,
             current_sigma=arm.sigma,
             reward=reward,
-            sigma_llhood=1.0,  # TODO: add support for non-std sigma_llhood
+            sigma_llhood=SIGMA_LLHOOD,
         )
     else:
         raise ValueError("Prior and reward type combination is not supported.")
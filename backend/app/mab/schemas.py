@@ -186,6 +186,27 @@ class MultiArmedBanditSample(MultiArmedBanditBase):
     arms: list[ArmResponse]
 
 
+class MultiArmedBanditDrawBatch(BaseModel):
+    """
+    Pydantic model for a batch of arm draws for an experiment.
+    """
+
+    experiment_id: int
+    arm_ids: list[int] = Field(description="The arm chosen for each draw, in order.")
+    arm_counts: dict[int, int] = Field(
+        description="The number of draws assigned to each arm."
+    )
+
+
+class MultiArmedBanditDraw(BaseModel):
+    """
+    Pydantic model for the arm drawn for one of several experiments.
+    """
+
+    experiment_id: int
+    arm: ArmResponse
+
+
 class MABObservation(BaseModel):
     """
     Pydantic model for an observation of the experiment.
@@ -198,6 +219,15 @@ class MABObservation(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class MABOutcome(BaseModel):
+    """
+    Pydantic model for one reward in a bulk upload of outcomes.
+    """
+
+    arm_id: int
+    reward: float
+
+
 class MABObservationResponse(MABObservation):
     """
     Pydantic model for binary observations of the experiment.
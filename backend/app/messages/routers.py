@@ -4,7 +4,7 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..auth.dependencies import get_current_user
-from ..database import get_async_session
+from ..database import get_async_session, get_readonly_session
 from ..users.models import UserDB
 from .models import EventMessageDB, MessageDB
 from .schemas import EventMessageCreate, MessageReadToggle, MessageResponse
@@ -15,7 +15,7 @@ router = APIRouter(prefix="/messages", tags=["Messages"])
 @router.get("/", response_model=list[MessageResponse])
 async def get_messages(
     user_db: Annotated[UserDB, Depends(get_current_user)],
-    asession: AsyncSession = Depends(get_async_session),
+    asession: AsyncSession = Depends(get_readonly_session),
 ) -> list[MessageResponse]:
     """
     Get all messages for a user
@@ -1,7 +1,21 @@
 from datetime import datetime
 from typing import Sequence
 
-from sqlalchemy import Boolean, DateTime, Enum, ForeignKey, Integer, String, select
+from sqlalchemy import (
+    Boolean,
+    CheckConstraint,
+    DateTime,
+    Enum,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    false,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
@@ -79,18 +93,27 @@ class ArmBaseDB(Base):
 class ObservationsBaseDB(Base):
     """
     Base model for observations.
+
+    Observations of all experiment types are stored in this table, with
+    single-table inheritance, so that writing or reading an observation
+    touches one table. The table is hash partitioned by `experiment_id`,
+    which is part of its primary key, so that queries filtering on the
+    experiment only scan its partition.
     """
 
     __tablename__ = "observations_base"
 
     observation_id: Mapped[int] = mapped_column(
-        Integer, primary_key=True, nullable=False
+        Integer, primary_key=True, autoincrement=True, nullable=False
     )
     arm_id: Mapped[int] = mapped_column(
         Integer, ForeignKey("arms_base.arm_id"), nullable=False
     )
     experiment_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("experiments_base.experiment_id"), nullable=False
+        Integer,
+        ForeignKey("experiments_base.experiment_id"),
+        primary_key=True,
+        nullable=False,
     )
     user_id: Mapped[int] = mapped_column(
         Integer, ForeignKey("users.user_id"), nullable=False
@@ -99,6 +122,47 @@ class ObservationsBaseDB(Base):
         DateTime(timezone=True), nullable=False
     )
     obs_type: Mapped[str] = mapped_column(String(length=50), nullable=False)
+    reward: Mapped[float] = mapped_column(Float, nullable=False)
+    # Set while a queued contextual observation waits to be applied to the arm
+    # posterior, see `contextual_mab.update_queue`
+    update_pending: Mapped[bool] = mapped_column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
+    # Set while a contextual observation waits to be appended to the packed
+    # history of its arm, see `contextual_mab.models.append_pending_obs_to_chunks`
+    chunk_pending: Mapped[bool] = mapped_column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
+
+    __table_args__: tuple = (
+        CheckConstraint(
+            "obs_type <> 'contextual_observations' OR context_val IS NOT NULL",
+            name="ck_observations_base_context_val",
+        ),
+        Index(
+            "ix_observations_base_experiment_id_arm_id_observed",
+            "experiment_id",
+            "arm_id",
+            "observed_datetime_utc",
+        ),
+        Index(
+            "ix_observations_base_experiment_id_observed",
+            "experiment_id",
+            "observed_datetime_utc",
+        ),
+        Index(
+            "ix_observations_base_update_pending",
+            "observed_datetime_utc",
+            postgresql_where=text("update_pending"),
+        ),
+        Index(
+            "ix_observations_base_chunk_pending",
+            "arm_id",
+            "observed_datetime_utc",
+            postgresql_where=text("chunk_pending"),
+        ),
+        {"postgresql_partition_by": "HASH (experiment_id)"},
+    )
 
     __mapper_args__ = {
         "polymorphic_identity": "observation",
@@ -106,6 +170,42 @@ class ObservationsBaseDB(Base):
     }
 
 
+class QueueBatchDB(Base):
+    """
+    Model for the last batch committed from each Redis queue.
+
+    A worker records the id of the batch it claimed in the same transaction as
+    the writes of the batch, so that a batch replayed after the commit, when
+    the worker failed to remove it from Redis, is not written twice.
+    """
+
+    __tablename__ = "queue_batches"
+
+    queue_key: Mapped[str] = mapped_column(String(length=150), primary_key=True)
+    batch_id: Mapped[str] = mapped_column(String(length=32), nullable=False)
+
+
+async def record_queue_batch(
+    queue_key: str, batch_id: str, asession: AsyncSession
+) -> bool:
+    """
+    Record the batch as the last one committed from the queue. Returns False if
+    it was already recorded, in which case the batch must not be written again.
+    The record is committed with the rest of the session.
+    """
+    statement = (
+        insert(QueueBatchDB)
+        .values(queue_key=queue_key, batch_id=batch_id)
+        .on_conflict_do_update(
+            index_elements=[QueueBatchDB.queue_key],
+            set_={"batch_id": batch_id},
+            where=QueueBatchDB.batch_id != batch_id,
+        )
+        .returning(QueueBatchDB.queue_key)
+    )
+    return (await asession.execute(statement)).first() is not None
+
+
 class NotificationsDB(Base):
     """
     Model for notifications.
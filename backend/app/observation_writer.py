@@ -0,0 +1,138 @@
+"""Bulk writer that streams observations into Postgres with COPY."""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Iterable, NamedTuple, Sequence
+
+import numpy as np
+from sqlalchemy import Sequence as DBSequence
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import OBSERVATION_COPY_BATCH_SIZE
+from .contextual_mab.models import (
+    ContextualObservationDB,
+    append_contextual_obs_to_chunks,
+)
+from .mab.models import MABObservationDB
+from .models import ObservationsBaseDB
+
+OBSERVATION_ID_SEQUENCE = DBSequence("observations_base_observation_id_seq")
+
+COPY_COLUMNS = [
+    "observation_id",
+    "arm_id",
+    "experiment_id",
+    "user_id",
+    "observed_datetime_utc",
+    "obs_type",
+    "reward",
+    "context_val",
+]
+
+
+class ObservationRecord(NamedTuple):
+    """
+    An observation to write. Observations with a `context_val` are stored as
+    contextual observations, the others as MAB observations. Observations
+    without an `observed_datetime_utc` are stamped with the time of the write.
+    """
+
+    arm_id: int
+    experiment_id: int
+    user_id: int
+    reward: float
+    context_val: list[float] | None = None
+    observed_datetime_utc: datetime | None = None
+
+
+async def copy_observations(
+    records: Sequence[ObservationRecord], asession: AsyncSession
+) -> list[int]:
+    """
+    Write the observations with a single COPY on the connection of the session
+    and return their ids, in the order of `records`. The rows are committed
+    with the rest of the session.
+
+    COPY does not return generated keys, so the ids are taken from the
+    observation id sequence before the copy. Contextual observations are also
+    appended to the packed history of their arm.
+    """
+    if not records:
+        return []
+
+    # Taking the ids also starts the transaction of the session, which the
+    # COPY below joins
+    observation_ids = list(
+        (
+            await asession.execute(
+                select(OBSERVATION_ID_SEQUENCE.next_value()).select_from(
+                    func.generate_series(1, len(records))
+                )
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+    observed_datetime_utc = datetime.now(timezone.utc)
+    mab_obs_type = MABObservationDB.__mapper__.polymorphic_identity
+    contextual_obs_type = ContextualObservationDB.__mapper__.polymorphic_identity
+    rows = [
+        (
+            observation_id,
+            record.arm_id,
+            record.experiment_id,
+            record.user_id,
+            record.observed_datetime_utc or observed_datetime_utc,
+            mab_obs_type if record.context_val is None else contextual_obs_type,
+            float(record.reward),
+            record.context_val,
+        )
+        for observation_id, record in zip(observation_ids, records)
+    ]
+
+    connection = await asession.connection()
+    raw_connection = await connection.get_raw_connection()
+    asyncpg_connection: Any = raw_connection.driver_connection
+    await asyncpg_connection.copy_records_to_table(
+        ObservationsBaseDB.__tablename__, records=rows, columns=COPY_COLUMNS
+    )
+
+    contextual_records: dict[int, list[ObservationRecord]] = defaultdict(list)
+    for record in records:
+        if record.context_val is not None:
+            contextual_records[record.arm_id].append(record)
+    for arm_id in sorted(contextual_records):
+        arm_records = contextual_records[arm_id]
+        await append_contextual_obs_to_chunks(
+            arm_id,
+            np.array([r.reward for r in arm_records]),
+            np.array([r.context_val for r in arm_records]),
+            asession,
+        )
+
+    return observation_ids
+
+
+async def copy_observation_batches(
+    records: Iterable[ObservationRecord],
+    asession: AsyncSession,
+    batch_size: int = OBSERVATION_COPY_BATCH_SIZE,
+) -> list[int]:
+    """
+    Stream the observations to the database in batches of `batch_size`,
+    committing after each batch, and return their ids in order.
+
+    `records` can be a generator, so that backfills and offline scripts do
+    not need to hold all the observations in memory. If a batch fails, the
+    batches before it stay committed.
+    """
+    observation_ids: list[int] = []
+    iterator = iter(records)
+    while batch := list(islice(iterator, batch_size)):
+        observation_ids.extend(await copy_observations(batch, asession))
+        await asession.commit()
+
+    return observation_ids
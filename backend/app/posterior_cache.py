@@ -0,0 +1,274 @@
+"""In-process cache of experiment posteriors used to serve draws."""
+
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Mapping, NamedTuple
+
+from prometheus_client import Counter
+from pydantic import BaseModel
+from redis import asyncio as aioredis
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from .utils import setup_logger
+
+logger = setup_logger()
+
+POSTERIOR_INVALIDATION_CHANNEL = "posterior-invalidation"
+
+CACHE_HITS = Counter("posterior_cache_hits_total", "Posterior cache hits.")
+CACHE_MISSES = Counter("posterior_cache_misses_total", "Posterior cache misses.")
+CACHE_EVICTIONS = Counter(
+    "posterior_cache_evictions_total", "Posterior cache LRU evictions."
+)
+
+
+class CachedPosterior(NamedTuple):
+    """
+    A posterior sample held in the cache, tagged with the posterior version it
+    was loaded at and the user that owns the experiment.
+    """
+
+    version: int
+    user_id: int
+    sample: BaseModel
+
+
+class PosteriorCache:
+    """
+    Bounded LRU cache of experiment posteriors keyed by `experiment_id`.
+
+    Every posterior change bumps a per-experiment version counter in Redis. An
+    entry is dropped when a newer version is announced, and an entry loaded at
+    an older version than one already announced is never stored.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[int, CachedPosterior] = OrderedDict()
+        self._latest_versions: OrderedDict[int, int] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, experiment_id: int, user_id: int) -> CachedPosterior | None:
+        """
+        Get the cached posterior for the experiment if it belongs to the user.
+        """
+        entry = self._entries.get(experiment_id)
+        if entry is None or entry.user_id != user_id:
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+
+        self._entries.move_to_end(experiment_id)
+        self.hits += 1
+        CACHE_HITS.inc()
+        return entry
+
+    def put(
+        self, experiment_id: int, user_id: int, version: int, sample: BaseModel
+    ) -> None:
+        """
+        Store the posterior loaded at `version`, evicting the least recently
+        used entry if the cache is full.
+        """
+        if self.maxsize <= 0:
+            return
+        if version < self._latest_versions.get(experiment_id, version):
+            return
+
+        self._entries[experiment_id] = CachedPosterior(version, user_id, sample)
+        self._entries.move_to_end(experiment_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            CACHE_EVICTIONS.inc()
+
+    def has_latest_version(self, experiment_id: int) -> bool:
+        """
+        Whether a version announced for the experiment is remembered. The
+        record of announced versions is bounded, so a load finding none must
+        check the version again before it is stored.
+        """
+        return experiment_id in self._latest_versions
+
+    def invalidate(self, experiment_id: int, version: int | None = None) -> None:
+        """
+        Drop the cached posterior for the experiment. If `version` is given,
+        only entries older than it are dropped and it is remembered so that
+        stale loads still in flight are not cached.
+        """
+        if version is not None:
+            self._latest_versions[experiment_id] = max(
+                version, self._latest_versions.get(experiment_id, version)
+            )
+            self._latest_versions.move_to_end(experiment_id)
+            while len(self._latest_versions) > self.maxsize:
+                self._latest_versions.popitem(last=False)
+
+        entry = self._entries.get(experiment_id)
+        if entry is not None and (version is None or entry.version < version):
+            del self._entries[experiment_id]
+
+    def clear(self) -> None:
+        """
+        Drop every cached posterior.
+        """
+        self._entries.clear()
+
+
+def get_posterior_version_key(experiment_id: int) -> str:
+    """
+    Get the Redis key holding the posterior version of the experiment.
+    """
+    return f"posterior-version:{experiment_id}"
+
+
+async def get_posterior_version(redis: aioredis.Redis, experiment_id: int) -> int:
+    """
+    Get the current posterior version of the experiment.
+    """
+    version = await redis.get(get_posterior_version_key(experiment_id))
+    return int(version) if version is not None else 0
+
+
+async def get_posterior_versions(
+    redis: aioredis.Redis, experiment_ids: list[int]
+) -> list[int]:
+    """
+    Get the current posterior versions of the experiments in one round-trip.
+    """
+    versions = await redis.mget(
+        [get_posterior_version_key(experiment_id) for experiment_id in experiment_ids]
+    )
+    return [int(version) if version is not None else 0 for version in versions]
+
+
+async def get_or_load_posterior(
+    cache: PosteriorCache,
+    redis: aioredis.Redis,
+    experiment_id: int,
+    user_id: int,
+    loader: Callable[[], Awaitable[BaseModel | None]],
+) -> CachedPosterior | None:
+    """
+    Get the posterior for the experiment from the cache, calling `loader` to
+    fetch it from the database on a miss.
+    """
+    cached = cache.get(experiment_id, user_id)
+    if cached is not None:
+        return cached
+
+    # Read the version before loading so that an update committed while we
+    # load is never hidden behind a stale entry.
+    version = await get_posterior_version(redis, experiment_id)
+    sample = await loader()
+    if sample is None:
+        return None
+
+    # Without a remembered version, only store the sample if no update was
+    # announced during the load
+    if cache.has_latest_version(experiment_id) or (
+        await get_posterior_version(redis, experiment_id) == version
+    ):
+        cache.put(experiment_id, user_id, version, sample)
+    return CachedPosterior(version, user_id, sample)
+
+
+async def get_or_load_posteriors(
+    cache: PosteriorCache,
+    redis: aioredis.Redis,
+    experiment_ids: list[int],
+    user_id: int,
+    loader: Callable[[list[int]], Awaitable[Mapping[int, BaseModel]]],
+) -> dict[int, CachedPosterior]:
+    """
+    Get the posteriors for several experiments, calling `loader` once with the
+    ids missing from the cache. Experiments the loader does not return are left
+    out of the result.
+    """
+    posteriors: dict[int, CachedPosterior] = {}
+    for experiment_id in experiment_ids:
+        cached = cache.get(experiment_id, user_id)
+        if cached is not None:
+            posteriors[experiment_id] = cached
+
+    missing_ids = [i for i in dict.fromkeys(experiment_ids) if i not in posteriors]
+    if not missing_ids:
+        return posteriors
+
+    versions = await get_posterior_versions(redis, missing_ids)
+    samples = await loader(missing_ids)
+
+    # Without a remembered version, only store the samples if no update was
+    # announced during the load
+    unknown_ids = [
+        i for i in missing_ids if i in samples and not cache.has_latest_version(i)
+    ]
+    current_versions = (
+        dict(zip(unknown_ids, await get_posterior_versions(redis, unknown_ids)))
+        if unknown_ids
+        else {}
+    )
+    for experiment_id, version in zip(missing_ids, versions):
+        sample = samples.get(experiment_id)
+        if sample is None:
+            continue
+        if current_versions.get(experiment_id, version) == version:
+            cache.put(experiment_id, user_id, version, sample)
+        posteriors[experiment_id] = CachedPosterior(version, user_id, sample)
+
+    return posteriors
+
+
+async def invalidate_posterior(
+    cache: PosteriorCache, redis: aioredis.Redis, experiment_id: int
+) -> int:
+    """
+    Bump the posterior version of the experiment and tell every worker to drop
+    its cached copy. Call this after the posterior change has been committed.
+    """
+    version = await redis.incr(get_posterior_version_key(experiment_id))
+    cache.invalidate(experiment_id, version)
+    await redis.publish(POSTERIOR_INVALIDATION_CHANNEL, f"{experiment_id}:{version}")
+    return version
+
+
+async def bump_posterior_version(redis: aioredis.Redis, experiment_id: int) -> int:
+    """
+    Bump the posterior version of the experiment without dropping cached
+    copies. Use this for posterior changes that are not read from the cache,
+    such as arm parameters held in Redis.
+    """
+    return await redis.incr(get_posterior_version_key(experiment_id))
+
+
+async def listen_for_invalidations(
+    redis: aioredis.Redis, cache: PosteriorCache
+) -> None:
+    """
+    Drop cached posteriors as other workers announce posterior changes. Runs
+    until cancelled. If the subscription is lost the whole cache is cleared,
+    since announcements may have been missed.
+    """
+    while True:
+        try:
+            async with redis.pubsub() as pubsub:
+                await pubsub.subscribe(POSTERIOR_INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        experiment_id, version = message["data"].decode().split(":")
+                        cache.invalidate(int(experiment_id), int(version))
+                    except ValueError:
+                        logger.warning(
+                            f"Ignoring invalid invalidation {message['data']!r}"
+                        )
+        except RedisConnectionError as e:
+            logger.warning(f"Lost posterior invalidation subscription: {e}")
+            cache.clear()
+            await asyncio.sleep(1)
@@ -0,0 +1,102 @@
+"""
+Redis locks and queue batches shared by the background workers.
+
+Locks hold a random token so that a worker whose lock expired cannot release
+the lock another worker has since acquired. Batches are claimed from a pending
+queue into a processing list under a batch id, and stay there until the worker
+has committed them, so that a batch is never lost and a replayed batch can be
+recognized by its id.
+"""
+
+from uuid import uuid4
+
+from redis import asyncio as aioredis
+
+# Delete the lock only if it still holds the token of the caller
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Return the batch id and the items in the processing list, left there by a
+# worker that did not finish the batch, or else move up to ARGV[1] items from
+# the head of the pending queue to the processing list under the new batch id
+# ARGV[2]. Returns an empty list if there is nothing to process.
+CLAIM_BATCH_SCRIPT = """
+local pending_key, processing_key, batch_id_key = KEYS[1], KEYS[2], KEYS[3]
+local items = redis.call('LRANGE', processing_key, 0, -1)
+if #items > 0 then
+    local batch_id = redis.call('GET', batch_id_key) or ARGV[2]
+    redis.call('SET', batch_id_key, batch_id)
+    table.insert(items, 1, batch_id)
+    return items
+end
+items = redis.call('LRANGE', pending_key, 0, tonumber(ARGV[1]) - 1)
+if #items == 0 then
+    return items
+end
+redis.call('LTRIM', pending_key, #items, -1)
+-- Push in slices to stay within the Lua stack limit of unpack
+for i = 1, #items, 1000 do
+    redis.call('RPUSH', processing_key, unpack(items, i, math.min(i + 999, #items)))
+end
+redis.call('SET', batch_id_key, ARGV[2])
+table.insert(items, 1, ARGV[2])
+return items
+"""
+
+
+def get_batch_id_key(processing_key: str) -> str:
+    """
+    Get the Redis key holding the id of the batch in the processing list.
+    """
+    return f"{processing_key}:batch-id"
+
+
+async def acquire_lock(redis: aioredis.Redis, key: str, timeout_ms: int) -> str | None:
+    """
+    Acquire the lock for `timeout_ms` milliseconds. Returns the token to
+    release the lock with, or None if the lock is held by another worker.
+    """
+    token = uuid4().hex
+    if await redis.set(key, token, nx=True, px=timeout_ms):
+        return token
+    return None
+
+
+async def release_lock(redis: aioredis.Redis, key: str, token: str) -> None:
+    """
+    Release the lock if it is still held with the given token.
+    """
+    release = redis.register_script(RELEASE_LOCK_SCRIPT)
+    await release(keys=[key], args=[token])
+
+
+async def claim_batch(
+    redis: aioredis.Redis, pending_key: str, processing_key: str, batch_size: int
+) -> tuple[str, list[bytes]] | None:
+    """
+    Claim the unfinished batch in the processing list, or else up to
+    `batch_size` items from the pending queue. Returns the batch id and the
+    items, or None if there is nothing to process.
+
+    The batch stays in the processing list until `finish_batch` is called.
+    """
+    claim = redis.register_script(CLAIM_BATCH_SCRIPT)
+    claimed = await claim(
+        keys=[pending_key, processing_key, get_batch_id_key(processing_key)],
+        args=[batch_size, uuid4().hex],
+    )
+    if not claimed:
+        return None
+    batch_id, *items = claimed
+    return batch_id.decode(), items
+
+
+async def finish_batch(redis: aioredis.Redis, processing_key: str) -> None:
+    """
+    Remove the batch in the processing list once it has been committed.
+    """
+    await redis.delete(processing_key, get_batch_id_key(processing_key))
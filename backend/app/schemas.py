@@ -96,6 +96,12 @@ class ArmPriors(StrEnum):
             return -0.5 * x @ inv_cov @ x
 
 
+# Standard deviation of the normal reward likelihood, shared by all experiments
+# with real-valued rewards.
+# TODO: add support for non-std sigma_llhood
+SIGMA_LLHOOD = 1.0
+
+
 class RewardLikelihood(StrEnum):
     """
     Enum for the likelihood distribution of the reward.
@@ -0,0 +1,101 @@
+"""Pre-generated standard normal variates for Thompson sampling."""
+
+# pylint: disable=global-statement
+import numpy as np
+
+from .config import VARIATE_POOL_SEED, VARIATE_POOL_SIZE
+
+# global so each worker process draws from its own stream, created on first
+# use so that forked workers do not share the parent's state
+_VARIATE_POOL: "NormalVariatePool | None" = None
+
+
+class NormalVariatePool:
+    """
+    Buffer of standard normal variates drawn from a PCG64 generator.
+
+    Normal samples are served as affine transforms of the buffered variates,
+    and the buffer is refilled in bulk once it runs out, so that a draw costs
+    a slice of an existing array instead of a call into the generator.
+    """
+
+    def __init__(self, size: int, seed: int | None = None) -> None:
+        self.size = size
+        self.seed(seed)
+
+    def seed(self, seed: int | None) -> None:
+        """
+        Reset the generator with the given seed and discard buffered variates.
+        """
+        self._rng = np.random.Generator(np.random.PCG64(seed))
+        self._buffer = np.empty(0)
+        self._position = 0
+
+    def standard_normal(self, shape: int | tuple[int, ...]) -> np.ndarray:
+        """
+        Take standard normal variates of the given shape from the buffer.
+        """
+        n = int(np.prod(shape))
+        if n > self.size:
+            return self._rng.standard_normal(shape)
+
+        if self._position + n > len(self._buffer):
+            self._buffer = self._rng.standard_normal(self.size)
+            self._position = 0
+
+        z = self._buffer[self._position : self._position + n]
+        self._position += n
+        return z.reshape(shape)
+
+    def normal(
+        self,
+        loc: np.ndarray,
+        scale: np.ndarray,
+        size: int | tuple[int, ...] | None = None,
+    ) -> np.ndarray:
+        """
+        Draw normal samples as `loc + scale * z`, broadcasting like
+        `numpy.random.normal`.
+        """
+        shape = np.broadcast_shapes(np.shape(loc), np.shape(scale))
+        return loc + scale * self.standard_normal(shape if size is None else size)
+
+    def multivariate_normal(
+        self, mean: np.ndarray, factor: np.ndarray, size: int | None = None
+    ) -> np.ndarray:
+        """
+        Draw multivariate normal samples as `mean + L @ z` for a batch of
+        distributions.
+
+        Parameters
+        ----------
+        mean : The means, of shape (k, d).
+        factor : The covariance factors `L` with `L @ L.T` equal to the
+            covariance, of shape (k, d, d).
+        size : The number of samples per distribution. If given, the samples
+            have shape (size, k, d), otherwise (k, d).
+        """
+        shape = mean.shape if size is None else (size, *mean.shape)
+        z = self.standard_normal(shape)
+        return mean + np.einsum("kij,...kj->...ki", factor, z)
+
+
+def get_variate_pool() -> NormalVariatePool:
+    """Return the variate pool of this worker."""
+    global _VARIATE_POOL
+    if _VARIATE_POOL is None:
+        _VARIATE_POOL = NormalVariatePool(VARIATE_POOL_SIZE, VARIATE_POOL_SEED)
+    return _VARIATE_POOL
+
+
+def covariance_factor(covariance: np.ndarray) -> np.ndarray:
+    """
+    Get a factor `L` with `L @ L.T` equal to each covariance matrix in the
+    stack. Uses the Cholesky decomposition, falling back to an eigen
+    decomposition for covariances that are only positive semi-definite.
+    """
+    try:
+        return np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        return eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))[..., None, :]
@@ -0,0 +1,71 @@
+"""flag observations waiting to be appended to the arm history
+
+Revision ID: 0c5e8b3f9a14
+Revises: f4a9c17e2d68
+Create Date: 2026-10-17 20:31:40.118273
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0c5e8b3f9a14"
+down_revision: Union[str, None] = "f4a9c17e2d68"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A constant default does not rewrite the table. Existing observations are
+    # already in the chunks, written by 8a4d1e6f0b27 or by the requests.
+    op.add_column(
+        "observations_base",
+        sa.Column(
+            "chunk_pending", sa.Boolean(), server_default=sa.false(), nullable=False
+        ),
+    )
+    op.create_index(
+        "ix_observations_base_chunk_pending",
+        "observations_base",
+        ["arm_id", "observed_datetime_utc"],
+        unique=False,
+        postgresql_where=sa.text("chunk_pending"),
+    )
+
+
+def downgrade() -> None:
+    # The previous revision appends observations in the request, so move the
+    # pending ones into the chunks first, one chunk per observation, as
+    # little-endian float64 like in 8a4d1e6f0b27
+    op.execute(
+        """
+        CREATE FUNCTION pg_temp.float8send_le(v float8) RETURNS bytea
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT string_agg(substr(float8send(v), 9 - k, 1), ''::bytea ORDER BY k)
+            FROM generate_series(1, 8) AS k
+        $$
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO contextual_observation_chunks
+            (arm_id, n_observations, n_contexts, rewards, contexts)
+        SELECT
+            arm_id,
+            1,
+            cardinality(context_val),
+            pg_temp.float8send_le(reward),
+            (
+                SELECT string_agg(pg_temp.float8send_le(v), ''::bytea ORDER BY i)
+                FROM unnest(context_val) WITH ORDINALITY AS u(v, i)
+            )
+        FROM observations_base
+        WHERE chunk_pending
+        ORDER BY arm_id, observed_datetime_utc, observation_id
+        """
+    )
+    op.drop_index("ix_observations_base_chunk_pending", table_name="observations_base")
+    op.drop_column("observations_base", "chunk_pending")
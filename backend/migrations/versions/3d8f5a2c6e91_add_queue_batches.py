@@ -0,0 +1,31 @@
+"""record the last committed batch of each queue
+
+Revision ID: 3d8f5a2c6e91
+Revises: e7b2c4f9a813
+Create Date: 2026-10-17 18:42:09.316274
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3d8f5a2c6e91"
+down_revision: Union[str, None] = "e7b2c4f9a813"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "queue_batches",
+        sa.Column("queue_key", sa.String(length=150), nullable=False),
+        sa.Column("batch_id", sa.String(length=32), nullable=False),
+        sa.PrimaryKeyConstraint("queue_key"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("queue_batches")
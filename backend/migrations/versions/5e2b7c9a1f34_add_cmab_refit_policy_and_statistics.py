@@ -0,0 +1,57 @@
+"""add cmab refit policy and arm statistics
+
+Revision ID: 5e2b7c9a1f34
+Revises: d95b5c0590c3
+Create Date: 2026-10-17 10:12:41.208331
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "5e2b7c9a1f34"
+down_revision: Union[str, None] = "d95b5c0590c3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "contextual_mabs",
+        sa.Column(
+            "refit_policy",
+            sa.String(length=50),
+            server_default="none",
+            nullable=False,
+        ),
+    )
+    op.add_column(
+        "contextual_mabs", sa.Column("refit_every", sa.Integer(), nullable=True)
+    )
+    op.create_table(
+        "contextual_arm_statistics",
+        sa.Column("arm_id", sa.Integer(), nullable=False),
+        sa.Column("base_mu", postgresql.ARRAY(sa.Float()), nullable=False),
+        sa.Column("base_covariance", postgresql.ARRAY(sa.Float()), nullable=False),
+        sa.Column("xtwx", postgresql.ARRAY(sa.Float()), nullable=False),
+        sa.Column("xtwz", postgresql.ARRAY(sa.Float()), nullable=False),
+        sa.Column("n_observations", sa.Integer(), nullable=False),
+        sa.Column("n_since_refit", sa.Integer(), nullable=False),
+        sa.Column(
+            "last_refit_datetime_utc", sa.DateTime(timezone=True), nullable=False
+        ),
+        sa.ForeignKeyConstraint(
+            ["arm_id"], ["contextual_arms.arm_id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("arm_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("contextual_arm_statistics")
+    op.drop_column("contextual_mabs", "refit_every")
+    op.drop_column("contextual_mabs", "refit_policy")
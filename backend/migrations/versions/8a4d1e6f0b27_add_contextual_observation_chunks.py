@@ -0,0 +1,101 @@
+"""add packed contextual observation chunks
+
+Revision ID: 8a4d1e6f0b27
+Revises: 5e2b7c9a1f34
+Create Date: 2026-10-17 11:40:05.913264
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from app.config import CONTEXTUAL_OBS_CHUNK_SIZE
+
+# revision identifiers, used by Alembic.
+revision: str = "8a4d1e6f0b27"
+down_revision: Union[str, None] = "5e2b7c9a1f34"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "contextual_observation_chunks",
+        sa.Column("chunk_id", sa.Integer(), nullable=False),
+        sa.Column("arm_id", sa.Integer(), nullable=False),
+        sa.Column("n_observations", sa.Integer(), nullable=False),
+        sa.Column("n_contexts", sa.Integer(), nullable=False),
+        sa.Column("rewards", sa.LargeBinary(), nullable=False),
+        sa.Column("contexts", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["arm_id"], ["contextual_arms.arm_id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("chunk_id"),
+    )
+    op.create_index(
+        op.f("ix_contextual_observation_chunks_arm_id"),
+        "contextual_observation_chunks",
+        ["arm_id"],
+        unique=False,
+    )
+
+    # Chunks hold little-endian float64, the byte order of
+    # OBSERVATION_CHUNK_DTYPE. float8send is big-endian, so its bytes are
+    # reversed.
+    op.execute(
+        """
+        CREATE FUNCTION pg_temp.float8send_le(v float8) RETURNS bytea
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT string_agg(substr(float8send(v), 9 - k, 1), ''::bytea ORDER BY k)
+            FROM generate_series(1, 8) AS k
+        $$
+        """
+    )
+
+    # Pack the existing history of each arm into chunks of at most
+    # CONTEXTUAL_OBS_CHUNK_SIZE observations, in the order they were observed
+    op.execute(
+        f"""
+        WITH numbered AS (
+            SELECT
+                b.arm_id,
+                c.reward,
+                c.context_val,
+                row_number() OVER (
+                    PARTITION BY b.arm_id
+                    ORDER BY b.observed_datetime_utc, b.observation_id
+                ) AS n
+            FROM contextual_observations c
+            JOIN observations_base b ON b.observation_id = c.observation_id
+            JOIN contextual_arms a ON a.arm_id = b.arm_id
+        )
+        INSERT INTO contextual_observation_chunks
+            (arm_id, n_observations, n_contexts, rewards, contexts)
+        SELECT
+            arm_id,
+            count(*),
+            max(cardinality(context_val)),
+            string_agg(pg_temp.float8send_le(reward), ''::bytea ORDER BY n),
+            string_agg(
+                (
+                    SELECT string_agg(pg_temp.float8send_le(v), ''::bytea ORDER BY i)
+                    FROM unnest(context_val) WITH ORDINALITY AS u(v, i)
+                ),
+                ''::bytea
+                ORDER BY n
+            )
+        FROM numbered
+        GROUP BY arm_id, (n - 1) / {CONTEXTUAL_OBS_CHUNK_SIZE}
+        ORDER BY arm_id, (n - 1) / {CONTEXTUAL_OBS_CHUNK_SIZE}
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_contextual_observation_chunks_arm_id"),
+        table_name="contextual_observation_chunks",
+    )
+    op.drop_table("contextual_observation_chunks")
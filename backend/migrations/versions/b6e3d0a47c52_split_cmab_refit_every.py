@@ -0,0 +1,53 @@
+"""split cmab refit_every into observations and seconds
+
+Revision ID: b6e3d0a47c52
+Revises: 3d8f5a2c6e91
+Create Date: 2026-10-17 19:05:51.842706
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b6e3d0a47c52"
+down_revision: Union[str, None] = "3d8f5a2c6e91"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "contextual_mabs",
+        sa.Column("refit_every_observations", sa.Integer(), nullable=True),
+    )
+    op.add_column(
+        "contextual_mabs",
+        sa.Column("refit_interval_seconds", sa.Integer(), nullable=True),
+    )
+    op.execute(
+        """
+        UPDATE contextual_mabs SET
+            refit_every_observations = CASE
+                WHEN refit_policy = 'observations' THEN refit_every END,
+            refit_interval_seconds = CASE
+                WHEN refit_policy = 'interval' THEN refit_every END
+        """
+    )
+    op.drop_column("contextual_mabs", "refit_every")
+
+
+def downgrade() -> None:
+    op.add_column(
+        "contextual_mabs", sa.Column("refit_every", sa.Integer(), nullable=True)
+    )
+    op.execute(
+        """
+        UPDATE contextual_mabs
+        SET refit_every = COALESCE(refit_every_observations, refit_interval_seconds)
+        """
+    )
+    op.drop_column("contextual_mabs", "refit_interval_seconds")
+    op.drop_column("contextual_mabs", "refit_every_observations")
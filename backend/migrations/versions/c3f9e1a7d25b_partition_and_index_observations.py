@@ -0,0 +1,247 @@
+"""partition observation tables by experiment and index them
+
+Revision ID: c3f9e1a7d25b
+Revises: 8a4d1e6f0b27
+Create Date: 2026-10-17 14:12:48.305217
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c3f9e1a7d25b"
+down_revision: Union[str, None] = "8a4d1e6f0b27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Number of hash partitions of each observation table. Changing it requires
+# repartitioning the tables.
+N_PARTITIONS = 16
+
+OBSERVATION_TABLES = [
+    "observations_base",
+    "mab_observations",
+    "contextual_observations",
+]
+
+
+def create_partitions(table: str) -> None:
+    """
+    Create the hash partitions of the table.
+    """
+    for remainder in range(N_PARTITIONS):
+        op.execute(
+            f"CREATE TABLE {table}_p{remainder} PARTITION OF {table} "
+            f"FOR VALUES WITH (MODULUS {N_PARTITIONS}, REMAINDER {remainder})"
+        )
+
+
+def rename_to_old(table: str) -> None:
+    """
+    Move the table and its primary key out of the way of the new table.
+    """
+    op.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    op.execute(
+        f"ALTER TABLE {table}_old RENAME CONSTRAINT {table}_pkey TO {table}_old_pkey"
+    )
+
+
+def upgrade() -> None:
+    for table in OBSERVATION_TABLES:
+        rename_to_old(table)
+
+    # Keep the observation ids issued so far
+    op.execute("ALTER SEQUENCE observations_base_observation_id_seq OWNED BY NONE")
+    op.execute(
+        "ALTER TABLE observations_base_old ALTER COLUMN observation_id DROP DEFAULT"
+    )
+
+    # The partition key has to be part of the primary key, and so of the
+    # foreign keys from the subclass tables, which get an experiment_id column
+    op.execute(
+        """
+        CREATE TABLE observations_base (
+            observation_id INTEGER NOT NULL
+                DEFAULT nextval('observations_base_observation_id_seq'),
+            arm_id INTEGER NOT NULL REFERENCES arms_base (arm_id),
+            experiment_id INTEGER NOT NULL
+                REFERENCES experiments_base (experiment_id),
+            user_id INTEGER NOT NULL REFERENCES users (user_id),
+            observed_datetime_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+            obs_type VARCHAR(50) NOT NULL,
+            CONSTRAINT observations_base_pkey
+                PRIMARY KEY (observation_id, experiment_id)
+        ) PARTITION BY HASH (experiment_id)
+        """
+    )
+    op.execute(
+        "ALTER SEQUENCE observations_base_observation_id_seq "
+        "OWNED BY observations_base.observation_id"
+    )
+    op.execute(
+        """
+        CREATE TABLE mab_observations (
+            observation_id INTEGER NOT NULL,
+            experiment_id INTEGER NOT NULL,
+            reward FLOAT NOT NULL,
+            CONSTRAINT mab_observations_pkey
+                PRIMARY KEY (observation_id, experiment_id),
+            CONSTRAINT mab_observations_observation_id_fkey
+                FOREIGN KEY (observation_id, experiment_id)
+                REFERENCES observations_base (observation_id, experiment_id)
+                ON DELETE CASCADE
+        ) PARTITION BY HASH (experiment_id)
+        """
+    )
+    op.execute(
+        """
+        CREATE TABLE contextual_observations (
+            observation_id INTEGER NOT NULL,
+            experiment_id INTEGER NOT NULL,
+            reward FLOAT NOT NULL,
+            context_val FLOAT[] NOT NULL,
+            CONSTRAINT contextual_observations_pkey
+                PRIMARY KEY (observation_id, experiment_id),
+            CONSTRAINT contextual_observations_observation_id_fkey
+                FOREIGN KEY (observation_id, experiment_id)
+                REFERENCES observations_base (observation_id, experiment_id)
+                ON DELETE CASCADE
+        ) PARTITION BY HASH (experiment_id)
+        """
+    )
+    for table in OBSERVATION_TABLES:
+        create_partitions(table)
+
+    op.execute(
+        """
+        INSERT INTO observations_base
+            (observation_id, arm_id, experiment_id, user_id,
+             observed_datetime_utc, obs_type)
+        SELECT observation_id, arm_id, experiment_id, user_id,
+            observed_datetime_utc, obs_type
+        FROM observations_base_old
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO mab_observations (observation_id, experiment_id, reward)
+        SELECT m.observation_id, b.experiment_id, m.reward
+        FROM mab_observations_old m
+        JOIN observations_base_old b ON b.observation_id = m.observation_id
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO contextual_observations
+            (observation_id, experiment_id, reward, context_val)
+        SELECT c.observation_id, b.experiment_id, c.reward, c.context_val
+        FROM contextual_observations_old c
+        JOIN observations_base_old b ON b.observation_id = c.observation_id
+        """
+    )
+
+    # Indexes on a partitioned table are created on each of its partitions
+    op.create_index(
+        "ix_observations_base_experiment_id_arm_id_observed",
+        "observations_base",
+        ["experiment_id", "arm_id", "observed_datetime_utc"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_observations_base_experiment_id_observed",
+        "observations_base",
+        ["experiment_id", "observed_datetime_utc"],
+        unique=False,
+    )
+
+    for table in reversed(OBSERVATION_TABLES):
+        op.execute(f"DROP TABLE {table}_old")
+
+    for table in OBSERVATION_TABLES:
+        op.execute(f"ANALYZE {table}")
+
+
+def downgrade() -> None:
+    for table in OBSERVATION_TABLES:
+        rename_to_old(table)
+
+    op.execute("ALTER SEQUENCE observations_base_observation_id_seq OWNED BY NONE")
+    op.execute(
+        "ALTER TABLE observations_base_old ALTER COLUMN observation_id DROP DEFAULT"
+    )
+
+    op.execute(
+        """
+        CREATE TABLE observations_base (
+            observation_id INTEGER NOT NULL
+                DEFAULT nextval('observations_base_observation_id_seq'),
+            arm_id INTEGER NOT NULL REFERENCES arms_base (arm_id),
+            experiment_id INTEGER NOT NULL
+                REFERENCES experiments_base (experiment_id),
+            user_id INTEGER NOT NULL REFERENCES users (user_id),
+            observed_datetime_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+            obs_type VARCHAR(50) NOT NULL,
+            CONSTRAINT observations_base_pkey PRIMARY KEY (observation_id)
+        )
+        """
+    )
+    op.execute(
+        "ALTER SEQUENCE observations_base_observation_id_seq "
+        "OWNED BY observations_base.observation_id"
+    )
+    op.execute(
+        """
+        CREATE TABLE mab_observations (
+            observation_id INTEGER NOT NULL,
+            reward FLOAT NOT NULL,
+            CONSTRAINT mab_observations_pkey PRIMARY KEY (observation_id),
+            CONSTRAINT mab_observations_observation_id_fkey
+                FOREIGN KEY (observation_id)
+                REFERENCES observations_base (observation_id)
+                ON DELETE CASCADE
+        )
+        """
+    )
+    op.execute(
+        """
+        CREATE TABLE contextual_observations (
+            observation_id INTEGER NOT NULL,
+            reward FLOAT NOT NULL,
+            context_val FLOAT[] NOT NULL,
+            CONSTRAINT contextual_observations_pkey PRIMARY KEY (observation_id),
+            CONSTRAINT contextual_observations_observation_id_fkey
+                FOREIGN KEY (observation_id)
+                REFERENCES observations_base (observation_id)
+                ON DELETE CASCADE
+        )
+        """
+    )
+
+    op.execute(
+        """
+        INSERT INTO observations_base
+            (observation_id, arm_id, experiment_id, user_id,
+             observed_datetime_utc, obs_type)
+        SELECT observation_id, arm_id, experiment_id, user_id,
+            observed_datetime_utc, obs_type
+        FROM observations_base_old
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO mab_observations (observation_id, reward)
+        SELECT observation_id, reward FROM mab_observations_old
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO contextual_observations (observation_id, reward, context_val)
+        SELECT observation_id, reward, context_val FROM contextual_observations_old
+        """
+    )
+
+    # Dropping the partitioned tables drops their partitions and indexes
+    for table in reversed(OBSERVATION_TABLES):
+        op.execute(f"DROP TABLE {table}_old")
@@ -0,0 +1,235 @@
+"""store observations in a single table
+
+Revision ID: e7b2c4f9a813
+Revises: c3f9e1a7d25b
+Create Date: 2026-10-17 16:03:27.518940
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e7b2c4f9a813"
+down_revision: Union[str, None] = "c3f9e1a7d25b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match the number of partitions created in c3f9e1a7d25b
+N_PARTITIONS = 16
+
+SUBCLASS_TABLES = ["mab_observations", "contextual_observations"]
+
+
+def create_partitions(table: str) -> None:
+    """
+    Create the hash partitions of the table.
+    """
+    for remainder in range(N_PARTITIONS):
+        op.execute(
+            f"CREATE TABLE {table}_p{remainder} PARTITION OF {table} "
+            f"FOR VALUES WITH (MODULUS {N_PARTITIONS}, REMAINDER {remainder})"
+        )
+
+
+def rename_to_old(table: str) -> None:
+    """
+    Move the table, its primary key and its partitions out of the way of the
+    new table.
+    """
+    op.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    op.execute(
+        f"ALTER TABLE {table}_old RENAME CONSTRAINT {table}_pkey TO {table}_old_pkey"
+    )
+    for remainder in range(N_PARTITIONS):
+        op.execute(
+            f"ALTER TABLE {table}_p{remainder} RENAME TO {table}_old_p{remainder}"
+        )
+
+
+def create_observations_base(columns: str, constraints: str) -> None:
+    """
+    Create the partitioned observations_base table with the given extra
+    columns and constraints, using the existing observation id sequence.
+    """
+    op.execute(
+        f"""
+        CREATE TABLE observations_base (
+            observation_id INTEGER NOT NULL
+                DEFAULT nextval('observations_base_observation_id_seq'),
+            arm_id INTEGER NOT NULL REFERENCES arms_base (arm_id),
+            experiment_id INTEGER NOT NULL
+                REFERENCES experiments_base (experiment_id),
+            user_id INTEGER NOT NULL REFERENCES users (user_id),
+            observed_datetime_utc TIMESTAMP WITH TIME ZONE NOT NULL,
+            obs_type VARCHAR(50) NOT NULL,
+            {columns}
+            CONSTRAINT observations_base_pkey
+                PRIMARY KEY (observation_id, experiment_id)
+            {constraints}
+        ) PARTITION BY HASH (experiment_id)
+        """
+    )
+    op.execute(
+        "ALTER SEQUENCE observations_base_observation_id_seq "
+        "OWNED BY observations_base.observation_id"
+    )
+    create_partitions("observations_base")
+
+
+def create_indexes() -> None:
+    """
+    Create the indexes of observations_base on each of its partitions.
+    """
+    op.create_index(
+        "ix_observations_base_experiment_id_arm_id_observed",
+        "observations_base",
+        ["experiment_id", "arm_id", "observed_datetime_utc"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_observations_base_experiment_id_observed",
+        "observations_base",
+        ["experiment_id", "observed_datetime_utc"],
+        unique=False,
+    )
+
+
+def detach_sequence() -> None:
+    """
+    Keep the observation ids issued so far when the old table is dropped.
+    """
+    op.execute("ALTER SEQUENCE observations_base_observation_id_seq OWNED BY NONE")
+    op.execute(
+        "ALTER TABLE observations_base_old ALTER COLUMN observation_id DROP DEFAULT"
+    )
+
+
+def upgrade() -> None:
+    op.drop_index(
+        "ix_observations_base_experiment_id_arm_id_observed",
+        table_name="observations_base",
+    )
+    op.drop_index(
+        "ix_observations_base_experiment_id_observed", table_name="observations_base"
+    )
+    rename_to_old("observations_base")
+    detach_sequence()
+
+    create_observations_base(
+        columns="reward FLOAT NOT NULL, context_val FLOAT[],",
+        constraints=(
+            ", CONSTRAINT ck_observations_base_context_val CHECK ("
+            "obs_type <> 'contextual_observations' OR context_val IS NOT NULL)"
+        ),
+    )
+
+    # Copy each observation with its reward, and its context for contextual
+    # observations. Base rows without a subclass row have no reward and are
+    # dropped.
+    op.execute(
+        """
+        INSERT INTO observations_base
+            (observation_id, arm_id, experiment_id, user_id,
+             observed_datetime_utc, obs_type, reward, context_val)
+        SELECT b.observation_id, b.arm_id, b.experiment_id, b.user_id,
+            b.observed_datetime_utc, b.obs_type, m.reward, NULL
+        FROM observations_base_old b
+        JOIN mab_observations m
+            ON m.observation_id = b.observation_id
+            AND m.experiment_id = b.experiment_id
+        UNION ALL
+        SELECT b.observation_id, b.arm_id, b.experiment_id, b.user_id,
+            b.observed_datetime_utc, b.obs_type, c.reward, c.context_val
+        FROM observations_base_old b
+        JOIN contextual_observations c
+            ON c.observation_id = b.observation_id
+            AND c.experiment_id = b.experiment_id
+        """
+    )
+    create_indexes()
+
+    # Dropping a partitioned table drops its partitions
+    for table in SUBCLASS_TABLES:
+        op.execute(f"DROP TABLE {table}")
+    op.execute("DROP TABLE observations_base_old")
+    op.execute("ANALYZE observations_base")
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_observations_base_experiment_id_arm_id_observed",
+        table_name="observations_base",
+    )
+    op.drop_index(
+        "ix_observations_base_experiment_id_observed", table_name="observations_base"
+    )
+    rename_to_old("observations_base")
+    detach_sequence()
+
+    create_observations_base(columns="", constraints="")
+    op.execute(
+        """
+        CREATE TABLE mab_observations (
+            observation_id INTEGER NOT NULL,
+            experiment_id INTEGER NOT NULL,
+            reward FLOAT NOT NULL,
+            CONSTRAINT mab_observations_pkey
+                PRIMARY KEY (observation_id, experiment_id),
+            CONSTRAINT mab_observations_observation_id_fkey
+                FOREIGN KEY (observation_id, experiment_id)
+                REFERENCES observations_base (observation_id, experiment_id)
+                ON DELETE CASCADE
+        ) PARTITION BY HASH (experiment_id)
+        """
+    )
+    op.execute(
+        """
+        CREATE TABLE contextual_observations (
+            observation_id INTEGER NOT NULL,
+            experiment_id INTEGER NOT NULL,
+            reward FLOAT NOT NULL,
+            context_val FLOAT[] NOT NULL,
+            CONSTRAINT contextual_observations_pkey
+                PRIMARY KEY (observation_id, experiment_id),
+            CONSTRAINT contextual_observations_observation_id_fkey
+                FOREIGN KEY (observation_id, experiment_id)
+                REFERENCES observations_base (observation_id, experiment_id)
+                ON DELETE CASCADE
+        ) PARTITION BY HASH (experiment_id)
+        """
+    )
+    for table in SUBCLASS_TABLES:
+        create_partitions(table)
+
+    op.execute(
+        """
+        INSERT INTO observations_base
+            (observation_id, arm_id, experiment_id, user_id,
+             observed_datetime_utc, obs_type)
+        SELECT observation_id, arm_id, experiment_id, user_id,
+            observed_datetime_utc, obs_type
+        FROM observations_base_old
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO mab_observations (observation_id, experiment_id, reward)
+        SELECT observation_id, experiment_id, reward
+        FROM observations_base_old
+        WHERE obs_type = 'mab_observations'
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO contextual_observations
+            (observation_id, experiment_id, reward, context_val)
+        SELECT observation_id, experiment_id, reward, context_val
+        FROM observations_base_old
+        WHERE obs_type = 'contextual_observations'
+        """
+    )
+    create_indexes()
+
+    op.execute("DROP TABLE observations_base_old")
@@ -0,0 +1,40 @@
+"""flag observations waiting for an asynchronous update
+
+Revision ID: f4a9c17e2d68
+Revises: b6e3d0a47c52
+Create Date: 2026-10-17 19:48:12.604519
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f4a9c17e2d68"
+down_revision: Union[str, None] = "b6e3d0a47c52"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A constant default does not rewrite the table
+    op.add_column(
+        "observations_base",
+        sa.Column(
+            "update_pending", sa.Boolean(), server_default=sa.false(), nullable=False
+        ),
+    )
+    op.create_index(
+        "ix_observations_base_update_pending",
+        "observations_base",
+        ["observed_datetime_utc"],
+        unique=False,
+        postgresql_where=sa.text("update_pending"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_observations_base_update_pending", table_name="observations_base")
+    op.drop_column("observations_base", "update_pending")
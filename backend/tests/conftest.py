@@ -4,7 +4,7 @@ from typing import AsyncGenerator, Generator
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import select
+from sqlalchemy import event, select
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import Session
 
@@ -12,6 +12,7 @@ from backend.app import create_app
 from backend.app.database import (
     get_connection_url,
     get_session_context_manager,
+    get_sqlalchemy_async_engine,
 )
 from backend.app.users.models import UserDB
 from backend.app.utils import get_key_hash, get_password_salted_hash
@@ -65,6 +66,51 @@ async def async_engine() -> AsyncGenerator[AsyncEngine, None]:
     await engine.dispose()
 
 
+@pytest.fixture(scope="function")
+def statement_log(async_engine: AsyncEngine) -> Generator[list[str], None, None]:
+    """Record the SQL statements sent to the database by the test async engine.
+
+    Parameters
+    ----------
+    async_engine
+        Async engine for testing.
+
+    Yields
+    ------
+    Generator[list[str], None, None]
+        The statements executed so far, in order.
+    """
+    statements: list[str] = []
+
+    def log_statement(*args: object) -> None:
+        statements.append(str(args[2]))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", log_statement)
+    yield statements
+    event.remove(async_engine.sync_engine, "before_cursor_execute", log_statement)
+
+
+@pytest.fixture(scope="function")
+def app_statement_log() -> Generator[list[tuple[str, int]], None, None]:
+    """Record the SQL statements sent to the database by the app async engine,
+    with the number of rows each returned or changed.
+
+    Yields
+    ------
+    Generator[list[tuple[str, int]], None, None]
+        The statements executed so far and their row counts, in order.
+    """
+    statements: list[tuple[str, int]] = []
+
+    def log_statement(*args: object) -> None:
+        statements.append((str(args[2]), getattr(args[1], "rowcount", -1)))
+
+    engine = get_sqlalchemy_async_engine().sync_engine
+    event.listen(engine, "after_cursor_execute", log_statement)
+    yield statements
+    event.remove(engine, "after_cursor_execute", log_statement)
+
+
 @pytest.fixture(scope="session")
 def db_session() -> Generator[Session, None, None]:
     """Create a test database session."""
@@ -117,6 +163,12 @@ def user2(client: TestClient, db_session: Session) -> Generator:
     yield user.user_id
 
 
+@pytest.fixture(scope="session")
+def admin_user_id(db_session: Session) -> int:
+    stmt = select(UserDB).where(UserDB.username == os.environ.get("ADMIN_USERNAME", ""))
+    return db_session.execute(stmt).scalar_one().user_id
+
+
 @pytest.fixture(scope="session")
 def admin_token(client: TestClient) -> str:
     response = client.post(
@@ -0,0 +1,118 @@
+from typing import AsyncGenerator
+
+import numpy as np
+from pytest import fixture
+from redis import asyncio as aioredis
+
+from backend.app.config import REDIS_HOST
+from backend.app.mab.assignment_queue import (
+    acquire_refill_lock,
+    delete_assignment_queue,
+    get_assignment_queue_key,
+    pop_assignment,
+    push_assignments,
+    release_refill_lock,
+)
+from backend.app.mab.schemas import ArmResponse, MultiArmedBanditSample
+from backend.app.posterior_cache import bump_posterior_version, get_posterior_version
+from backend.app.schemas import ArmPriors, RewardLikelihood
+
+EXPERIMENT_ID = -1
+USER_ID = -1
+
+
+@fixture
+async def redis() -> AsyncGenerator[aioredis.Redis, None]:
+    redis = await aioredis.from_url(REDIS_HOST)
+    await delete_assignment_queue(redis, EXPERIMENT_ID, USER_ID)
+    yield redis
+    await delete_assignment_queue(redis, EXPERIMENT_ID, USER_ID)
+    await redis.aclose()
+
+
+@fixture
+def experiment() -> MultiArmedBanditSample:
+    return MultiArmedBanditSample(
+        experiment_id=EXPERIMENT_ID,
+        name="Test",
+        description="Test description",
+        prior_type=ArmPriors.BETA,
+        reward_type=RewardLikelihood.BERNOULLI,
+        arms=[
+            ArmResponse(arm_id=1, name="arm 1", description="arm 1", alpha=1, beta=1),
+            ArmResponse(arm_id=2, name="arm 2", description="arm 2", alpha=1, beta=1),
+        ],
+    )
+
+
+class TestAssignmentQueue:
+    async def test_empty_queue_needs_refill(self, redis: aioredis.Redis) -> None:
+        arm, needs_refill = await pop_assignment(redis, EXPERIMENT_ID, USER_ID, 1, 10)
+
+        assert arm is None
+        assert needs_refill
+
+    async def test_pop_in_order_until_low(
+        self, redis: aioredis.Redis, experiment: MultiArmedBanditSample
+    ) -> None:
+        version = await get_posterior_version(redis, EXPERIMENT_ID)
+        await push_assignments(
+            redis, EXPERIMENT_ID, USER_ID, experiment, np.array([1, 0, 1]), version
+        )
+
+        popped = [
+            await pop_assignment(redis, EXPERIMENT_ID, USER_ID, 2, 10) for _ in range(3)
+        ]
+
+        assert [arm.arm_id for arm, _ in popped if arm is not None] == [2, 1, 2]
+        assert [needs_refill for _, needs_refill in popped] == [False, True, True]
+
+    async def test_other_user_cannot_pop(
+        self, redis: aioredis.Redis, experiment: MultiArmedBanditSample
+    ) -> None:
+        version = await get_posterior_version(redis, EXPERIMENT_ID)
+        await push_assignments(
+            redis, EXPERIMENT_ID, USER_ID, experiment, np.array([0]), version
+        )
+
+        arm, _ = await pop_assignment(redis, EXPERIMENT_ID, USER_ID - 1, 1, 10)
+        assert arm is None
+
+        arm, _ = await pop_assignment(redis, EXPERIMENT_ID, USER_ID, 1, 10)
+        assert arm is not None
+
+    async def test_stale_queue_is_not_served(
+        self, redis: aioredis.Redis, experiment: MultiArmedBanditSample
+    ) -> None:
+        version = await get_posterior_version(redis, EXPERIMENT_ID)
+        await push_assignments(
+            redis, EXPERIMENT_ID, USER_ID, experiment, np.zeros(10, dtype=int), version
+        )
+
+        await bump_posterior_version(redis, EXPERIMENT_ID)
+        arm, needs_refill = await pop_assignment(redis, EXPERIMENT_ID, USER_ID, 1, 1)
+        assert arm is not None
+        assert not needs_refill
+
+        await bump_posterior_version(redis, EXPERIMENT_ID)
+        arm, needs_refill = await pop_assignment(redis, EXPERIMENT_ID, USER_ID, 1, 1)
+        assert arm is None
+        assert needs_refill
+
+        # The stale queue is left for the refill to replace
+        queue_key = get_assignment_queue_key(EXPERIMENT_ID, USER_ID)
+        assert await redis.execute_command("LLEN", queue_key) == 9
+
+    async def test_refill_lock(self, redis: aioredis.Redis) -> None:
+        token = await acquire_refill_lock(redis, EXPERIMENT_ID, USER_ID, 1000)
+        assert token is not None
+        assert await acquire_refill_lock(redis, EXPERIMENT_ID, USER_ID, 1000) is None
+
+        # A worker whose lock expired cannot release the lock of another
+        await release_refill_lock(redis, EXPERIMENT_ID, USER_ID, "expired")
+        assert await acquire_refill_lock(redis, EXPERIMENT_ID, USER_ID, 1000) is None
+
+        await release_refill_lock(redis, EXPERIMENT_ID, USER_ID, token)
+        token = await acquire_refill_lock(redis, EXPERIMENT_ID, USER_ID, 1000)
+        assert token is not None
+        await release_refill_lock(redis, EXPERIMENT_ID, USER_ID, token)
@@ -1,17 +1,42 @@
 import copy
 import os
-from typing import Generator
+import time
+from typing import AsyncGenerator, Generator
 
+import numpy as np
 from fastapi.testclient import TestClient
-from pytest import FixtureRequest, fixture, mark
+from pytest import FixtureRequest, MonkeyPatch, approx, fixture, mark
+from redis import asyncio as aioredis
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from backend.app.config import REDIS_HOST
+from backend.app.contextual_mab import models as contextual_mab_models
+from backend.app.contextual_mab import routers as contextual_mab_routers
 from backend.app.contextual_mab.models import (
     ContextDB,
     ContextualArmDB,
     ContextualBanditDB,
+    ContextualObservationChunkDB,
+    append_contextual_obs_to_chunks,
+    get_contextual_arm_for_update,
+    get_contextual_arm_history,
+    get_contextual_mab_sample_by_id,
+    save_contextual_obs_to_db,
 )
+from backend.app.contextual_mab.sampling_utils import update_arm_params_batch
+from backend.app.contextual_mab.schemas import CMABObservation, ContextualArmResponse
+from backend.app.contextual_mab.update_queue import (
+    enqueue_update,
+    process_pending_updates,
+    requeue_pending_updates,
+    write_pending_chunks,
+)
+from backend.app.fit_executor import FitExecutor
 from backend.app.models import NotificationsDB
+from backend.app.posterior_cache import PosteriorCache
+from backend.app.schemas import ArmPriors, RewardLikelihood
 
 base_normal_payload = {
     "name": "Test",
@@ -196,6 +221,523 @@ class TestMab:
             ],
         )
         assert response.status_code == 200
+        assert isinstance(response.json()["posterior_version"], int)
+
+    def test_draw_arms_batch(self, client: TestClient, create_cmabs: list) -> None:
+        cmab = create_cmabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        response = client.post(
+            f"/contextual_mab/{cmab['experiment_id']}/draw/batch",
+            params={"n": 50},
+            headers={"Authorization": f"Bearer {api_key}"},
+            json=[
+                {"context_id": 1, "context_value": 0},
+                {"context_id": 2, "context_value": 0.5},
+            ],
+        )
+        assert response.status_code == 200
+        batch = response.json()
+        assert len(batch["arm_ids"]) == 50
+        assert set(batch["arm_counts"]) == {str(arm["arm_id"]) for arm in cmab["arms"]}
+        assert sum(batch["arm_counts"].values()) == 50
+
+    @mark.parametrize(
+        "binary_value, expected_response", [(1, 200), (0, 200), (0.5, 400)]
+    )
+    def test_draw_arms_for_contexts(
+        self,
+        client: TestClient,
+        create_cmabs: list,
+        binary_value: float,
+        expected_response: int,
+    ) -> None:
+        cmab = create_cmabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        response = client.post(
+            f"/contextual_mab/{cmab['experiment_id']}/draw/contexts",
+            headers={"Authorization": f"Bearer {api_key}"},
+            json=[
+                [
+                    {"context_id": 1, "context_value": binary_value},
+                    {"context_id": 2, "context_value": value},
+                ]
+                for value in [-1.0, 0.0, 2.5]
+            ],
+        )
+        assert response.status_code == expected_response
+        if expected_response == 200:
+            arm_ids = response.json()["arm_ids"]
+            assert len(arm_ids) == 3
+            assert set(arm_ids) <= {arm["arm_id"] for arm in cmab["arms"]}
+
+    def test_recalibrate_arm(
+        self, client: TestClient, admin_token: str, clean_cmabs: None
+    ) -> None:
+        response = client.post(
+            "/contextual_mab",
+            json=base_binary_normal_payload,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        cmab = response.json()
+        arm_id = cmab["arms"][0]["arm_id"]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        for reward, value in [(1, 0.5), (0, -1.0), (1, 2.0)]:
+            response = client.put(
+                f"/contextual_mab/{cmab['experiment_id']}/{arm_id}/{reward}",
+                params={"reward": reward},
+                headers={"Authorization": f"Bearer {api_key}"},
+                json=[
+                    {"context_id": 1, "context_value": 1},
+                    {"context_id": 2, "context_value": value},
+                ],
+            )
+            assert response.status_code == 200
+        online_arm = response.json()
+
+        response = client.post(
+            f"/contextual_mab/{cmab['experiment_id']}/{arm_id}/recalibrate",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        assert response.status_code == 200
+        refit_arm = response.json()
+        assert len(refit_arm["mu"]) == len(online_arm["mu"])
+        for online, refit in zip(online_arm["mu"], refit_arm["mu"]):
+            assert refit == approx(online, abs=0.2)
+
+
+class TestObservationChunks:
+    @fixture
+    def create_cmab(self, client: TestClient, admin_token: str) -> Generator:
+        response = client.post(
+            "/contextual_mab",
+            json=base_normal_payload,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        cmab = response.json()
+        yield cmab
+        client.delete(
+            f"/contextual_mab/{cmab['experiment_id']}",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+
+    async def test_history_round_trip(
+        self, create_cmab: dict, asession: AsyncSession, monkeypatch: MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(contextual_mab_models, "CONTEXTUAL_OBS_CHUNK_SIZE", 2)
+        monkeypatch.setattr(contextual_mab_models, "CONTEXTUAL_OBS_COMPACT_EVERY", 3)
+        arm_id = create_cmab["arms"][0]["arm_id"]
+        rewards = np.array([1.5, -0.25, 2.0, 0.0, 1e-3])
+        contexts = np.array([[1.0, 0.5], [0.0, -1.0], [1.0, 2.0], [0, 3], [1, 1e6]])
+
+        for reward, context in zip(rewards, contexts):
+            await append_contextual_obs_to_chunks(
+                arm_id, np.array([reward]), np.array([context]), asession
+            )
+        await asession.commit()
+
+        history_rewards, history_contexts = await get_contextual_arm_history(
+            arm_id, asession
+        )
+        np.testing.assert_array_equal(history_rewards, rewards)
+        np.testing.assert_array_equal(history_contexts, contexts)
+        assert history_rewards.dtype.isnative and history_contexts.dtype.isnative
+
+        # The single-observation chunks are compacted into full ones
+        chunk_sizes = (
+            (
+                await asession.execute(
+                    select(ContextualObservationChunkDB.n_observations)
+                    .where(ContextualObservationChunkDB.arm_id == arm_id)
+                    .order_by(ContextualObservationChunkDB.chunk_id)
+                )
+            )
+            .scalars()
+            .all()
+        )
+        assert chunk_sizes == [2, 2, 1]
+
+    async def test_saved_observations_are_appended_by_the_worker(
+        self, create_cmab: dict, admin_user_id: int, asession: AsyncSession
+    ) -> None:
+        arm_id = create_cmab["arms"][0]["arm_id"]
+        rewards = np.array([1.5, -0.25, 2.0])
+        contexts = np.array([[1.0, 0.5], [0.0, -1.0], [1.0, 2.0]])
+        for reward, context in zip(rewards, contexts):
+            await save_contextual_obs_to_db(
+                CMABObservation(
+                    arm_id=arm_id, reward=reward, context_val=context.tolist()
+                ),
+                create_cmab["experiment_id"],
+                admin_user_id,
+                asession,
+            )
+
+        # The pending observations are part of the history before and after
+        # the worker appends them
+        for n_chunks in [0, 1]:
+            if n_chunks:
+                assert await write_pending_chunks(asession, batch_size=100) >= 3
+            history_rewards, history_contexts = await get_contextual_arm_history(
+                arm_id, asession
+            )
+            await asession.rollback()
+            np.testing.assert_array_equal(history_rewards, rewards)
+            np.testing.assert_array_equal(history_contexts, contexts)
+            chunk_ids = (
+                (
+                    await asession.execute(
+                        select(ContextualObservationChunkDB.chunk_id).where(
+                            ContextualObservationChunkDB.arm_id == arm_id
+                        )
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            assert len(chunk_ids) == n_chunks
+
+    async def test_empty_history(
+        self, create_cmab: dict, asession: AsyncSession
+    ) -> None:
+        rewards, contexts = await get_contextual_arm_history(
+            create_cmab["arms"][0]["arm_id"], asession
+        )
+        assert len(rewards) == 0
+        assert len(contexts) == 0
+
+
+class TestDrawLoader:
+    @fixture
+    def create_cmab(self, client: TestClient, admin_token: str) -> Generator:
+        response = client.post(
+            "/contextual_mab",
+            json=base_normal_payload,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        cmab = response.json()
+        yield cmab
+        client.delete(
+            f"/contextual_mab/{cmab['experiment_id']}",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+
+    async def add_observations(
+        self, cmab: dict, user_id: int, n: int, asession: AsyncSession
+    ) -> None:
+        await asession.execute(
+            text(
+                """
+                INSERT INTO observations_base
+                    (arm_id, experiment_id, user_id, observed_datetime_utc,
+                     obs_type, reward, context_val)
+                SELECT :arm_id, :experiment_id, :user_id, now(),
+                    'contextual_observations', 1.0, ARRAY[1.0, 0.5]
+                FROM generate_series(1, :n)
+                """
+            ),
+            {
+                "arm_id": cmab["arms"][0]["arm_id"],
+                "experiment_id": cmab["experiment_id"],
+                "user_id": user_id,
+                "n": n,
+            },
+        )
+        await asession.commit()
+
+    async def test_loader_matches_experiment(
+        self,
+        create_cmab: dict,
+        admin_user_id: int,
+        asession: AsyncSession,
+        statement_log: list[str],
+    ) -> None:
+        await self.add_observations(create_cmab, admin_user_id, 10, asession)
+        statement_log.clear()
+
+        sample = await get_contextual_mab_sample_by_id(
+            create_cmab["experiment_id"], admin_user_id, asession
+        )
+
+        assert sample is not None
+        assert sample.arms == [
+            ContextualArmResponse.model_validate(arm) for arm in create_cmab["arms"]
+        ]
+        assert [context.context_id for context in sample.contexts] == [
+            context["context_id"] for context in create_cmab["contexts"]
+        ]
+        assert len(statement_log) == 2
+        assert not any("observations" in statement for statement in statement_log)
+
+    async def test_loader_not_found(
+        self, create_cmab: dict, admin_user_id: int, asession: AsyncSession
+    ) -> None:
+        sample = await get_contextual_mab_sample_by_id(
+            create_cmab["experiment_id"], admin_user_id + 1, asession
+        )
+        assert sample is None
+
+    @mark.slow
+    async def test_loader_latency_flat_in_observations(
+        self, create_cmab: dict, admin_user_id: int, asession: AsyncSession
+    ) -> None:
+        n_calls = 20
+        latencies = {}
+        n_observations = 0
+        for n_target in [0, 10_000, 100_000, 1_000_000]:
+            await self.add_observations(
+                create_cmab, admin_user_id, n_target - n_observations, asession
+            )
+            n_observations = n_target
+
+            elapsed = []
+            for _ in range(n_calls):
+                start = time.perf_counter()
+                await get_contextual_mab_sample_by_id(
+                    create_cmab["experiment_id"], admin_user_id, asession
+                )
+                elapsed.append(time.perf_counter() - start)
+            latencies[n_target] = float(np.median(elapsed))
+            print(
+                f"Draw loader with {n_target} observations: "
+                f"{latencies[n_target] * 1000:.2f}ms"
+            )
+
+        assert latencies[1_000_000] < 5 * latencies[0] + 0.005
+
+
+class TestAsyncUpdates:
+    @fixture
+    def create_cmab(
+        self, client: TestClient, admin_token: str, monkeypatch: MonkeyPatch
+    ) -> Generator:
+        monkeypatch.setattr(contextual_mab_routers, "CMAB_UPDATE_MODE", "async")
+        response = client.post(
+            "/contextual_mab",
+            json=base_normal_payload,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        cmab = response.json()
+        yield cmab
+        client.delete(
+            f"/contextual_mab/{cmab['experiment_id']}",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+
+    @fixture
+    async def redis(self) -> AsyncGenerator[aioredis.Redis, None]:
+        redis = await aioredis.from_url(REDIS_HOST)
+        yield redis
+        await redis.aclose()
+
+    def test_update_is_accepted(self, client: TestClient, create_cmab: dict) -> None:
+        arm = create_cmab["arms"][0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        response = client.put(
+            f"/contextual_mab/{create_cmab['experiment_id']}/{arm['arm_id']}/1",
+            params={"reward": 1.5},
+            headers={"Authorization": f"Bearer {api_key}"},
+            json=[
+                {"context_id": 1, "context_value": 1},
+                {"context_id": 2, "context_value": 0.5},
+            ],
+        )
+        assert response.status_code == 202
+        assert response.json()["reward"] == 1.5
+
+        response = client.get(
+            f"/contextual_mab/{create_cmab['experiment_id']}/outcomes",
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert len(response.json()) == 1
+
+    async def save_pending(
+        self,
+        experiment_id: int,
+        arm_id: int,
+        user_id: int,
+        rewards: list[float],
+        contexts: list[list[float]],
+        asession: AsyncSession,
+    ) -> list[int]:
+        observation_ids = []
+        for reward, context in zip(rewards, contexts):
+            observation_db = await save_contextual_obs_to_db(
+                CMABObservation(arm_id=arm_id, reward=reward, context_val=context),
+                experiment_id,
+                user_id,
+                asession,
+                update_pending=True,
+            )
+            observation_ids.append(observation_db.observation_id)
+        return observation_ids
+
+    async def process(self, redis: aioredis.Redis, asession: AsyncSession) -> int:
+        executor = FitExecutor(max_workers=1, max_pending=0, timeout_seconds=5)
+        n_applied = await process_pending_updates(
+            redis, asession, PosteriorCache(maxsize=1), executor, batch_size=100
+        )
+        executor.shutdown()
+        return n_applied
+
+    async def test_queued_updates_are_applied_in_one_batch(
+        self,
+        create_cmab: dict,
+        admin_user_id: int,
+        redis: aioredis.Redis,
+        asession: AsyncSession,
+    ) -> None:
+        experiment_id = create_cmab["experiment_id"]
+        arm = ContextualArmResponse.model_validate(create_cmab["arms"][0])
+        rewards, contexts = [1.5, -0.5, 2.0], [[1.0, 0.5], [0.0, -1.0], [1.0, 2.0]]
+        observation_ids = await self.save_pending(
+            experiment_id, arm.arm_id, admin_user_id, rewards, contexts, asession
+        )
+        for observation_id, reward, context in zip(observation_ids, rewards, contexts):
+            await enqueue_update(
+                redis, experiment_id, arm.arm_id, observation_id, reward, context
+            )
+        # An observation queued twice is applied once
+        await enqueue_update(
+            redis,
+            experiment_id,
+            arm.arm_id,
+            observation_ids[0],
+            rewards[0],
+            contexts[0],
+        )
+
+        assert await self.process(redis, asession) == 3
+
+        arm_for_update = await get_contextual_arm_for_update(arm.arm_id, asession)
+        assert arm_for_update is not None
+        updated_arm, _, _ = arm_for_update
+        await asession.rollback()
+        mu, covariance = update_arm_params_batch(
+            arm, ArmPriors.NORMAL, RewardLikelihood.NORMAL, rewards, contexts
+        )
+        assert updated_arm.mu == approx(mu.tolist())
+        assert updated_arm.covariance[0] == approx(covariance[0].tolist())
+
+    async def test_unqueued_observations_are_swept(
+        self,
+        create_cmab: dict,
+        admin_user_id: int,
+        redis: aioredis.Redis,
+        asession: AsyncSession,
+    ) -> None:
+        experiment_id = create_cmab["experiment_id"]
+        arm = ContextualArmResponse.model_validate(create_cmab["arms"][0])
+        await self.save_pending(
+            experiment_id, arm.arm_id, admin_user_id, [1.0], [[1.0, 0.5]], asession
+        )
+        assert await self.process(redis, asession) == 0
+
+        assert await requeue_pending_updates(redis, asession, 0, batch_size=100) == 1
+        assert await self.process(redis, asession) == 1
+        assert await requeue_pending_updates(redis, asession, 0, batch_size=100) == 0
+
+
+class TestRefitPolicy:
+    @fixture
+    def create_cmab(
+        self, client: TestClient, admin_token: str, request: FixtureRequest
+    ) -> Generator:
+        payload: dict = copy.deepcopy(base_normal_payload)
+        payload.update(request.param)
+        response = client.post(
+            "/contextual_mab",
+            json=payload,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        cmab = response.json()
+        yield cmab
+        client.delete(
+            f"/contextual_mab/{cmab['experiment_id']}",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+
+    def put_reward(self, client: TestClient, cmab: dict, reward: float) -> dict:
+        arm_id = cmab["arms"][0]["arm_id"]
+        response = client.put(
+            f"/contextual_mab/{cmab['experiment_id']}/{arm_id}/{reward}",
+            params={"reward": reward},
+            headers={"Authorization": f"Bearer {os.environ['ADMIN_API_KEY']}"},
+            json=[
+                {"context_id": 1, "context_value": 1},
+                {"context_id": 2, "context_value": 0.5},
+            ],
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    @mark.parametrize(
+        "refit_policy, refit_every_observations, refit_interval_seconds, "
+        "expected_response",
+        [
+            ("observations", None, None, 422),
+            ("observations", None, 60, 422),
+            ("observations", 10, None, 200),
+            ("interval", None, None, 422),
+            ("interval", 10, None, 422),
+            ("interval", None, 60, 200),
+            ("on_demand", None, None, 200),
+        ],
+    )
+    def test_create_with_refit_policy(
+        self,
+        client: TestClient,
+        admin_token: str,
+        clean_cmabs: None,
+        refit_policy: str,
+        refit_every_observations: int | None,
+        refit_interval_seconds: int | None,
+        expected_response: int,
+    ) -> None:
+        payload: dict = copy.deepcopy(base_normal_payload)
+        payload["refit_policy"] = refit_policy
+        payload["refit_every_observations"] = refit_every_observations
+        payload["refit_interval_seconds"] = refit_interval_seconds
+        response = client.post(
+            "/contextual_mab",
+            json=payload,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        assert response.status_code == expected_response
+
+    @mark.parametrize(
+        "create_cmab",
+        [{"refit_policy": "observations", "refit_every_observations": 2}],
+        indirect=True,
+    )
+    def test_refit_every_n_observations(
+        self, client: TestClient, create_cmab: dict
+    ) -> None:
+        initial_mu = create_cmab["arms"][0]["mu"]
+
+        assert self.put_reward(client, create_cmab, 2.0)["mu"] == initial_mu
+        refit_arm = self.put_reward(client, create_cmab, 1.0)
+
+        assert refit_arm["mu"] != initial_mu
+        assert (
+            refit_arm["covariance"][0][0] < create_cmab["arms"][0]["covariance"][0][0]
+        )
+
+    @mark.parametrize("create_cmab", [{"refit_policy": "on_demand"}], indirect=True)
+    def test_refit_on_demand(
+        self, client: TestClient, admin_token: str, create_cmab: dict
+    ) -> None:
+        initial_mu = create_cmab["arms"][0]["mu"]
+        for reward in [2.0, 1.0, 1.5]:
+            assert self.put_reward(client, create_cmab, reward)["mu"] == initial_mu
+
+        response = client.post(
+            f"/contextual_mab/{create_cmab['experiment_id']}/refit",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        assert response.status_code == 200
+        refit_arms = response.json()
+        assert refit_arms[0]["mu"] != initial_mu
+        assert refit_arms[1]["mu"] == create_cmab["arms"][1]["mu"]
 
 
 class TestNotifications:
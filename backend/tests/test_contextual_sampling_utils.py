@@ -0,0 +1,376 @@
+import time
+
+import numpy as np
+from pytest import fixture, mark
+from scipy.optimize import minimize
+
+from backend.app.contextual_mab.sampling_utils import (
+    choose_arm,
+    choose_arms_for_contexts,
+    fit_laplace_logistic,
+    get_contextual_posterior,
+    get_observation_statistics,
+    refit_arm_from_statistics,
+    refit_arm_params,
+    update_arm_laplace_online,
+    update_arm_normal,
+    update_arm_normal_batch,
+)
+from backend.app.contextual_mab.schemas import (
+    ContextResponse,
+    ContextualArmResponse,
+    ContextualBanditSample,
+)
+from backend.app.schemas import (
+    ArmPriors,
+    ContextLinkFunctions,
+    ContextType,
+    RewardLikelihood,
+)
+
+
+@fixture
+def logistic_data() -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    theta = np.array([1.0, -1.0, 0.5])
+    contexts = rng.normal(size=(500, 3))
+    probs = 1 / (1 + np.exp(-contexts @ theta))
+    rewards = (rng.random(500) < probs).astype(float)
+    return contexts, rewards
+
+
+def exact_laplace(
+    contexts: np.ndarray, rewards: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Laplace approximation under a standard normal prior by Newton's method."""
+    d = contexts.shape[1]
+    map_mu = np.zeros(d)
+    for _ in range(20):
+        probs = 1 / (1 + np.exp(-contexts @ map_mu))
+        precision = (
+            np.identity(d) + (contexts * (probs * (1 - probs))[:, None]).T @ contexts
+        )
+        gradient = contexts.T @ (rewards - probs) - map_mu
+        map_mu = map_mu + np.linalg.solve(precision, gradient)
+    probs = 1 / (1 + np.exp(-contexts @ map_mu))
+    precision = (
+        np.identity(d) + (contexts * (probs * (1 - probs))[:, None]).T @ contexts
+    )
+    return map_mu, np.linalg.inv(precision)
+
+
+def lbfgs_laplace(
+    prior_mu: np.ndarray,
+    prior_covariance: np.ndarray,
+    rewards: np.ndarray,
+    contexts: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Laplace approximation of a logistic arm found by L-BFGS-B, with the
+    covariance taken from its inverse Hessian estimate. This was the previous
+    fit, kept as the baseline of the Newton solver.
+    """
+
+    def objective(theta: np.ndarray) -> float:
+        log_prior = ArmPriors.NORMAL(theta, mu=prior_mu, covariance=prior_covariance)
+        log_likelihood = RewardLikelihood.BERNOULLI(
+            rewards, ContextLinkFunctions.LOGISTIC(contexts @ theta)
+        )
+        return -log_prior - log_likelihood
+
+    result = minimize(objective, prior_mu, method="L-BFGS-B")
+    covariance = result.hess_inv.todense()
+    return result.x, 0.5 * (covariance + covariance.T)
+
+
+class TestOnlineLaplace:
+    def test_matches_full_laplace(
+        self, logistic_data: tuple[np.ndarray, np.ndarray]
+    ) -> None:
+        contexts, rewards = logistic_data
+        d = contexts.shape[1]
+
+        mu, covariance = np.zeros(d), np.identity(d)
+        for context, reward in zip(contexts, rewards):
+            mu, covariance = update_arm_laplace_online(mu, covariance, reward, context)
+
+        map_mu, map_covariance = exact_laplace(contexts, rewards)
+
+        np.testing.assert_allclose(mu, map_mu, atol=0.1)
+        np.testing.assert_allclose(covariance, map_covariance, atol=0.01)
+        np.testing.assert_allclose(covariance, covariance.T)
+
+    def test_refit_without_observations_returns_prior(self) -> None:
+        arm = ContextualArmResponse(
+            arm_id=1,
+            name="arm",
+            description="arm",
+            mu_init=0.5,
+            sigma_init=2.0,
+            mu=[1.0, 1.0],
+            covariance=[[1.0, 0.0], [0.0, 1.0]],
+        )
+
+        mu, covariance = refit_arm_params(
+            arm,
+            ArmPriors.NORMAL,
+            RewardLikelihood.BERNOULLI,
+            np.empty(0),
+            np.empty((0, 2)),
+        )
+
+        np.testing.assert_array_equal(mu, [0.5, 0.5])
+        np.testing.assert_array_equal(covariance, [[2.0, 0.0], [0.0, 2.0]])
+
+
+class TestLaplaceFit:
+    def test_matches_exact_laplace(
+        self, logistic_data: tuple[np.ndarray, np.ndarray]
+    ) -> None:
+        contexts, rewards = logistic_data
+        d = contexts.shape[1]
+
+        fit = fit_laplace_logistic(np.zeros(d), np.identity(d), rewards, contexts)
+        map_mu, map_covariance = exact_laplace(contexts, rewards)
+
+        assert fit.converged
+        assert fit.n_iterations < 10
+        assert fit.gradient_norm < 1e-6
+        np.testing.assert_allclose(fit.mu, map_mu, atol=1e-6)
+        np.testing.assert_allclose(fit.covariance, map_covariance, atol=1e-8)
+
+    def test_separable_data_stays_finite(self) -> None:
+        contexts = np.array([[1.0, 10.0], [1.0, -10.0]] * 50)
+        rewards = np.array([1.0, 0.0] * 50)
+
+        fit = fit_laplace_logistic(np.zeros(2), np.identity(2), rewards, contexts)
+
+        assert fit.converged
+        assert np.isfinite(fit.mu).all()
+        assert np.all(np.linalg.eigvalsh(fit.covariance) > 0)
+
+    @mark.slow
+    def test_fit_cost_and_accuracy(
+        self, logistic_data: tuple[np.ndarray, np.ndarray]
+    ) -> None:
+        contexts, rewards = logistic_data
+        d = contexts.shape[1]
+        _, map_covariance = exact_laplace(contexts, rewards)
+
+        start = time.perf_counter()
+        _, lbfgs_covariance = lbfgs_laplace(
+            np.zeros(d), np.identity(d), rewards, contexts
+        )
+        lbfgs = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fit = fit_laplace_logistic(np.zeros(d), np.identity(d), rewards, contexts)
+        newton = time.perf_counter() - start
+
+        lbfgs_error = np.abs(lbfgs_covariance - map_covariance).max()
+        newton_error = np.abs(fit.covariance - map_covariance).max()
+        assert newton < lbfgs
+        assert newton_error < lbfgs_error
+        print(
+            f"L-BFGS-B {lbfgs * 1e3:.2f}ms (covariance error {lbfgs_error:.2e}), "
+            f"Newton {newton * 1e3:.2f}ms (covariance error {newton_error:.2e})"
+        )
+
+
+class TestStatisticsRefit:
+    def test_normal_refit_matches_batch_update(self) -> None:
+        rng = np.random.default_rng(0)
+        d, m = 3, 40
+        contexts, rewards = rng.normal(size=(m, d)), rng.normal(size=m)
+        mu, covariance = np.zeros(d), np.identity(d) * 2.0
+
+        xtwx, xtwz = np.zeros((d, d)), np.zeros(d)
+        for i in range(0, m, 7):
+            batch_xtwx, batch_xtwz = get_observation_statistics(
+                mu, RewardLikelihood.NORMAL, rewards[i : i + 7], contexts[i : i + 7]
+            )
+            xtwx, xtwz = xtwx + batch_xtwx, xtwz + batch_xtwz
+        refit_mu, refit_covariance = refit_arm_from_statistics(
+            mu, covariance, xtwx, xtwz
+        )
+
+        expected_mu, expected_covariance = update_arm_normal_batch(
+            mu, covariance, rewards, contexts, 1.0
+        )
+        np.testing.assert_allclose(refit_mu, expected_mu, atol=1e-8)
+        np.testing.assert_allclose(refit_covariance, expected_covariance, atol=1e-8)
+
+    def test_bernoulli_refit_at_mode_is_laplace(
+        self, logistic_data: tuple[np.ndarray, np.ndarray]
+    ) -> None:
+        contexts, rewards = logistic_data
+        d = contexts.shape[1]
+        map_mu, map_covariance = exact_laplace(contexts, rewards)
+
+        xtwx, xtwz = get_observation_statistics(
+            map_mu, RewardLikelihood.BERNOULLI, rewards, contexts
+        )
+        mu, covariance = refit_arm_from_statistics(
+            np.zeros(d), np.identity(d), xtwx, xtwz
+        )
+
+        np.testing.assert_allclose(mu, map_mu, atol=1e-6)
+        np.testing.assert_allclose(covariance, map_covariance, atol=1e-8)
+
+
+class TestNormalUpdate:
+    @staticmethod
+    def update_by_inversion(
+        mu: np.ndarray,
+        covariance: np.ndarray,
+        reward: float,
+        context: np.ndarray,
+        sigma_llhood: float,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        precision = np.linalg.inv(covariance)
+        new_covariance = np.linalg.inv(
+            precision + np.outer(context, context) / sigma_llhood**2
+        )
+        new_mu = new_covariance @ (precision @ mu + context * reward / sigma_llhood**2)
+        return new_mu, new_covariance
+
+    def test_matches_update_by_inversion(self) -> None:
+        rng = np.random.default_rng(0)
+        d = 4
+        mu, covariance = np.zeros(d), np.identity(d) * 2.0
+        expected_mu, expected_covariance = mu, covariance
+
+        for _ in range(50):
+            context, reward = rng.normal(size=d), rng.normal()
+            mu, covariance = update_arm_normal(mu, covariance, reward, context, 0.5)
+            expected_mu, expected_covariance = self.update_by_inversion(
+                expected_mu, expected_covariance, reward, context, 0.5
+            )
+
+        np.testing.assert_allclose(mu, expected_mu, atol=1e-8)
+        np.testing.assert_allclose(covariance, expected_covariance, atol=1e-8)
+
+    def test_batch_matches_sequential_updates(self) -> None:
+        rng = np.random.default_rng(0)
+        d, m = 4, 30
+        contexts, rewards = rng.normal(size=(m, d)), rng.normal(size=m)
+        mu, covariance = np.zeros(d), np.identity(d) * 2.0
+
+        batch_mu, batch_covariance = update_arm_normal_batch(
+            mu, covariance, rewards, contexts, 0.5
+        )
+        for context, reward in zip(contexts, rewards):
+            mu, covariance = update_arm_normal(mu, covariance, reward, context, 0.5)
+
+        np.testing.assert_allclose(batch_mu, mu, atol=1e-8)
+        np.testing.assert_allclose(batch_covariance, covariance, atol=1e-8)
+
+    @mark.slow
+    @mark.parametrize("d", [5, 50, 200, 500])
+    def test_update_cost(self, d: int) -> None:
+        rng = np.random.default_rng(0)
+        mu, covariance = np.zeros(d), np.identity(d)
+        contexts, rewards = rng.normal(size=(20, d)), rng.normal(size=20)
+
+        start = time.perf_counter()
+        for context, reward in zip(contexts, rewards):
+            self.update_by_inversion(mu, covariance, reward, context, 1.0)
+        inversion = (time.perf_counter() - start) / len(rewards)
+
+        start = time.perf_counter()
+        for context, reward in zip(contexts, rewards):
+            update_arm_normal(mu, covariance, reward, context, 1.0)
+        rank_one = (time.perf_counter() - start) / len(rewards)
+
+        print(
+            f"d={d}: inversion {inversion * 1e3:.3f}ms, "
+            f"rank-one {rank_one * 1e3:.3f}ms per update"
+        )
+
+
+class TestSampling:
+    @staticmethod
+    def make_experiment(n_arms: int, d: int) -> ContextualBanditSample:
+        rng = np.random.default_rng(0)
+        arms = []
+        for arm_id in range(n_arms):
+            a = rng.normal(size=(d, d))
+            arms.append(
+                ContextualArmResponse(
+                    arm_id=arm_id,
+                    name=f"arm {arm_id}",
+                    description="arm",
+                    mu=rng.normal(size=d).tolist(),
+                    covariance=(a @ a.T / d + np.identity(d)).tolist(),
+                )
+            )
+        return ContextualBanditSample(
+            experiment_id=1,
+            name="Test",
+            description="Test description",
+            prior_type=ArmPriors.NORMAL,
+            reward_type=RewardLikelihood.BERNOULLI,
+            arms=arms,
+            contexts=[
+                ContextResponse(
+                    context_id=i,
+                    name=f"context {i}",
+                    description="context",
+                    value_type=ContextType.REAL_VALUED,
+                )
+                for i in range(d)
+            ],
+        )
+
+    def test_posterior_factors_covariances(self) -> None:
+        experiment = self.make_experiment(n_arms=3, d=4)
+        posterior = get_contextual_posterior(experiment)
+
+        assert posterior.mus.shape == (3, 4)
+        np.testing.assert_allclose(
+            posterior.factors @ posterior.factors.transpose(0, 2, 1),
+            [arm.covariance for arm in experiment.arms],
+        )
+        assert 0 <= choose_arm(posterior, [1.0] * 4) < 3
+
+    @mark.slow
+    def test_draw_cost(self) -> None:
+        n_arms, d, n_draws = 50, 100, 100
+        experiment = self.make_experiment(n_arms, d)
+        context = np.ones(d)
+
+        start = time.perf_counter()
+        for _ in range(n_draws):
+            samples = np.array(
+                [
+                    np.random.multivariate_normal(
+                        mean=np.array(arm.mu), cov=np.array(arm.covariance)
+                    )
+                    for arm in experiment.arms
+                ]
+            )
+            (samples @ context).argmax()
+        per_arm = (time.perf_counter() - start) / n_draws
+
+        posterior = get_contextual_posterior(experiment)
+        start = time.perf_counter()
+        for _ in range(n_draws):
+            choose_arm(posterior, context.tolist())
+        cached = (time.perf_counter() - start) / n_draws
+
+        print(
+            f"{n_arms} arms, d={d}: per-arm multivariate_normal "
+            f"{per_arm * 1e3:.2f}ms, cached factors {cached * 1e3:.2f}ms per draw"
+        )
+
+    def test_choose_arms_for_contexts(self) -> None:
+        experiment = self.make_experiment(n_arms=3, d=4)
+        posterior = get_contextual_posterior(experiment)
+        posterior.mus[1] += 100 * np.array([1.0, 0.0, 0.0, 0.0])
+        posterior.mus[2] += 100 * np.array([0.0, 1.0, 0.0, 0.0])
+
+        chosen_arms = choose_arms_for_contexts(
+            posterior, np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]] * 5)
+        )
+
+        np.testing.assert_array_equal(chosen_arms, [1, 2] * 5)
@@ -0,0 +1,124 @@
+import os
+from typing import AsyncGenerator, Generator
+
+from fastapi.testclient import TestClient
+from pytest import MonkeyPatch, fixture
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from backend.app import database
+from backend.app.database import (
+    ReadOnlyRouter,
+    get_connection_url,
+    get_replica_lag,
+    get_sqlalchemy_async_engine,
+)
+
+from .test_mabs import base_beta_binom_payload
+
+# A second, independent Postgres stands in for the replica. It is not in
+# recovery, so it reports no lag.
+REPLICA_TEST_HOST = os.environ.get("POSTGRES_REPLICA_TEST_HOST", "localhost")
+REPLICA_TEST_PORT = os.environ.get("POSTGRES_REPLICA_TEST_PORT", "5434")
+
+
+def create_replica_engine(port: int | str = REPLICA_TEST_PORT) -> AsyncEngine:
+    """
+    Create an engine for the test replica. It does not pool connections, so
+    that it can be used from the event loop of the test client.
+    """
+    connection_string = get_connection_url(host=REPLICA_TEST_HOST, port=port)
+    return create_async_engine(connection_string, poolclass=NullPool)
+
+
+def set_replica_lag(monkeypatch: MonkeyPatch, lag: float) -> None:
+    async def get_lag(engine: AsyncEngine) -> float:
+        return lag
+
+    monkeypatch.setattr(database, "get_replica_lag", get_lag)
+
+
+@fixture
+async def replica_engine() -> AsyncGenerator[AsyncEngine, None]:
+    engine = create_replica_engine()
+    yield engine
+    await engine.dispose()
+
+
+@fixture
+def create_mab(client: TestClient, admin_token: str) -> Generator:
+    response = client.post(
+        "/mab",
+        json=base_beta_binom_payload,
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    yield response.json()
+    client.delete(
+        f"/mab/{response.json()['experiment_id']}",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+
+
+class TestReadOnlyRouter:
+    async def test_primary_has_no_lag(self, async_engine: AsyncEngine) -> None:
+        assert await get_replica_lag(async_engine) == 0
+
+    async def test_uses_replica(
+        self, async_engine: AsyncEngine, replica_engine: AsyncEngine
+    ) -> None:
+        router = ReadOnlyRouter(async_engine, replica_engine, 5, 0)
+        assert await router.get_engine() is replica_engine
+
+    async def test_falls_back_when_lagging(
+        self,
+        async_engine: AsyncEngine,
+        replica_engine: AsyncEngine,
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        set_replica_lag(monkeypatch, 10.0)
+        router = ReadOnlyRouter(async_engine, replica_engine, 5, 0)
+        assert await router.get_engine() is async_engine
+
+    async def test_falls_back_when_unreachable(self, async_engine: AsyncEngine) -> None:
+        unreachable = create_replica_engine(port=1)
+        router = ReadOnlyRouter(async_engine, unreachable, 5, 0)
+        assert await router.get_engine() is async_engine
+
+    async def test_reuses_lag_check(
+        self,
+        async_engine: AsyncEngine,
+        replica_engine: AsyncEngine,
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        router = ReadOnlyRouter(async_engine, replica_engine, 5, 60)
+        assert await router.get_engine() is replica_engine
+
+        set_replica_lag(monkeypatch, 10.0)
+        assert await router.get_engine() is replica_engine
+
+    def test_route_reads_from_replica(
+        self,
+        client: TestClient,
+        admin_token: str,
+        create_mab: dict,
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        router = ReadOnlyRouter(
+            get_sqlalchemy_async_engine(), create_replica_engine(), 5, 0
+        )
+        monkeypatch.setattr(database, "_READONLY_ROUTER", router)
+        headers = {"Authorization": f"Bearer {admin_token}"}
+
+        # The replica does not receive the primary's writes
+        response = client.get("/mab/", headers=headers)
+        assert response.status_code == 200
+        assert create_mab["experiment_id"] not in [
+            mab["experiment_id"] for mab in response.json()
+        ]
+
+        set_replica_lag(monkeypatch, 10.0)
+        response = client.get("/mab/", headers=headers)
+        assert response.status_code == 200
+        assert create_mab["experiment_id"] in [
+            mab["experiment_id"] for mab in response.json()
+        ]
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+from fastapi.exceptions import HTTPException
+from pytest import raises
+
+from backend.app.fit_executor import FitExecutor
+
+
+class TestFitExecutor:
+    async def test_returns_result(self) -> None:
+        executor = FitExecutor(max_workers=2, max_pending=0, timeout_seconds=5)
+
+        results = await asyncio.gather(
+            executor.run(pow, 2, 10), executor.run(sum, [1, 2, 3])
+        )
+
+        assert results == [1024, 6]
+        executor.shutdown()
+
+    async def test_rejects_when_saturated(self) -> None:
+        executor = FitExecutor(max_workers=1, max_pending=1, timeout_seconds=5)
+        release = threading.Event()
+
+        running = [asyncio.create_task(executor.run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with raises(HTTPException) as exc_info:
+            await executor.run(pow, 2, 10)
+        assert exc_info.value.status_code == 503
+
+        release.set()
+        assert await asyncio.gather(*running) == [True, True]
+        assert await executor.run(pow, 2, 10) == 1024
+        executor.shutdown()
+
+    async def test_timeout_keeps_slot_until_done(self) -> None:
+        executor = FitExecutor(max_workers=1, max_pending=0, timeout_seconds=0.05)
+        release = threading.Event()
+
+        with raises(HTTPException) as exc_info:
+            await executor.run(release.wait, 5)
+        assert exc_info.value.status_code == 504
+
+        with raises(HTTPException) as exc_info:
+            await executor.run(pow, 2, 10)
+        assert exc_info.value.status_code == 503
+
+        release.set()
+        await asyncio.sleep(0.05)
+        assert await executor.run(pow, 2, 10) == 1024
+        executor.shutdown()
@@ -0,0 +1,265 @@
+from typing import AsyncGenerator, Generator
+
+from fastapi.testclient import TestClient
+from pytest import MonkeyPatch, approx, fixture, raises
+from redis import asyncio as aioredis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.app.config import REDIS_HOST
+from backend.app.mab import arm_state
+from backend.app.mab.arm_state import (
+    PENDING_OBSERVATIONS_KEY,
+    PROCESSING_OBSERVATIONS_KEY,
+    delete_arm_states,
+    flush_arm_states,
+    get_arm_states,
+    update_arm_state,
+    update_arm_states,
+)
+from backend.app.mab.models import MABArmDB, MABObservationDB
+from backend.app.mab.sampling_utils import update_arm_normal
+from backend.app.mab.schemas import ArmResponse
+from backend.app.models import ExperimentBaseDB
+from backend.app.redis_queues import get_batch_id_key
+from backend.app.schemas import ArmPriors, RewardLikelihood
+
+from .test_mabs import base_beta_binom_payload
+
+
+@fixture
+async def redis() -> AsyncGenerator[aioredis.Redis, None]:
+    redis = await aioredis.from_url(REDIS_HOST)
+    keys = [
+        PENDING_OBSERVATIONS_KEY,
+        PROCESSING_OBSERVATIONS_KEY,
+        get_batch_id_key(PROCESSING_OBSERVATIONS_KEY),
+    ]
+    await redis.delete(*keys)
+    yield redis
+    await redis.delete(*keys)
+    await redis.aclose()
+
+
+@fixture
+def create_mab(client: TestClient, admin_token: str) -> Generator:
+    response = client.post(
+        "/mab",
+        json=base_beta_binom_payload,
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    yield response.json()
+    client.delete(
+        f"/mab/{response.json()['experiment_id']}",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+
+
+class TestArmState:
+    async def test_beta_binomial_increments(self, redis: aioredis.Redis) -> None:
+        arm = ArmResponse(arm_id=-1, name="arm", description="arm", alpha=5, beta=1)
+        await delete_arm_states(redis, [arm.arm_id])
+
+        for outcome in [1, 1, 0]:
+            updated = await update_arm_state(
+                redis, -1, arm, ArmPriors.BETA, RewardLikelihood.BERNOULLI, outcome, 1
+            )
+
+        assert (updated.alpha, updated.beta) == (7, 2)
+        assert (await get_arm_states(redis, [arm]))[0] == updated
+        assert await redis.execute_command("LLEN", PENDING_OBSERVATIONS_KEY) == 3
+        await delete_arm_states(redis, [arm.arm_id])
+
+    async def test_normal_update_matches_conjugate_update(
+        self, redis: aioredis.Redis
+    ) -> None:
+        arm = ArmResponse(arm_id=-2, name="arm", description="arm", mu=2, sigma=3)
+        await delete_arm_states(redis, [arm.arm_id])
+
+        mu, sigma = 2.0, 3.0
+        for reward in [1.5, -0.5, 4.0]:
+            updated = await update_arm_state(
+                redis, -2, arm, ArmPriors.NORMAL, RewardLikelihood.NORMAL, reward, 1
+            )
+            mu, sigma = update_arm_normal(mu, sigma, reward, 1.0)
+
+        assert updated.mu == approx(mu)
+        assert updated.sigma == approx(sigma)
+        await delete_arm_states(redis, [arm.arm_id])
+
+    async def test_bulk_update_matches_sequential_updates(
+        self, redis: aioredis.Redis
+    ) -> None:
+        arms = [
+            ArmResponse(arm_id=-3, name="arm", description="arm", mu=2, sigma=3),
+            ArmResponse(arm_id=-4, name="arm", description="arm", mu=0, sigma=1),
+        ]
+        rewards = {-3: [1.5, -0.5, 4.0], -4: [2.0]}
+        priors = {-3: (2.0, 3.0), -4: (0.0, 1.0)}
+        await delete_arm_states(redis, [arm.arm_id for arm in arms])
+
+        updated = await update_arm_states(
+            redis, -3, rewards, arms, ArmPriors.NORMAL, RewardLikelihood.NORMAL, 1
+        )
+
+        for arm, updated_arm in zip(arms, updated):
+            mu, sigma = priors[arm.arm_id]
+            for reward in rewards[arm.arm_id]:
+                mu, sigma = update_arm_normal(mu, sigma, reward, 1.0)
+            assert updated_arm.mu == approx(mu)
+            assert updated_arm.sigma == approx(sigma)
+        assert await get_arm_states(redis, arms) == updated
+        assert await redis.execute_command("LLEN", PENDING_OBSERVATIONS_KEY) == 4
+        await delete_arm_states(redis, [arm.arm_id for arm in arms])
+
+    async def test_flush_writes_observations_and_snapshots(
+        self,
+        create_mab: dict,
+        admin_user_id: int,
+        redis: aioredis.Redis,
+        asession: AsyncSession,
+    ) -> None:
+        experiment_id = create_mab["experiment_id"]
+        arm = ArmResponse.model_validate(create_mab["arms"][0])
+        for outcome in [1, 0, 1, 1]:
+            await update_arm_state(
+                redis,
+                experiment_id,
+                arm,
+                ArmPriors.BETA,
+                RewardLikelihood.BERNOULLI,
+                outcome,
+                admin_user_id,
+            )
+
+        n_flushed = await flush_arm_states(redis, asession, batch_size=100)
+        assert n_flushed == 4
+        assert await redis.execute_command("LLEN", PENDING_OBSERVATIONS_KEY) == 0
+
+        arm_db = (
+            (
+                await asession.execute(
+                    select(MABArmDB).where(MABArmDB.arm_id == arm.arm_id)
+                )
+            )
+            .unique()
+            .scalar_one()
+        )
+        await asession.refresh(arm_db)
+        assert (arm_db.alpha, arm_db.beta) == (8, 2)
+
+        observations = (
+            (
+                await asession.execute(
+                    select(MABObservationDB).where(
+                        MABObservationDB.experiment_id == experiment_id
+                    )
+                )
+            )
+            .unique()
+            .scalars()
+            .all()
+        )
+        assert len(observations) == 4
+
+        n_trials = (
+            await asession.execute(
+                select(ExperimentBaseDB.n_trials).where(
+                    ExperimentBaseDB.experiment_id == experiment_id
+                )
+            )
+        ).scalar_one()
+        assert n_trials == 4
+        await delete_arm_states(redis, [arm.arm_id])
+
+    async def test_failed_flush_is_retried(
+        self,
+        create_mab: dict,
+        admin_user_id: int,
+        redis: aioredis.Redis,
+        asession: AsyncSession,
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        experiment_id = create_mab["experiment_id"]
+        arm = ArmResponse.model_validate(create_mab["arms"][0])
+        for outcome in [1, 0, 1]:
+            await update_arm_state(
+                redis,
+                experiment_id,
+                arm,
+                ArmPriors.BETA,
+                RewardLikelihood.BERNOULLI,
+                outcome,
+                admin_user_id,
+            )
+
+        async def fail_copy(*args: object, **kwargs: object) -> list[int]:
+            raise RuntimeError("copy failed")
+
+        with monkeypatch.context() as m:
+            m.setattr(arm_state, "copy_observations", fail_copy)
+            with raises(RuntimeError):
+                await flush_arm_states(redis, asession, batch_size=2)
+
+        # The failed batch is kept aside and flushed before the rest of the
+        # queue
+        assert await redis.execute_command("LLEN", PROCESSING_OBSERVATIONS_KEY) == 2
+        assert await redis.execute_command("LLEN", PENDING_OBSERVATIONS_KEY) == 1
+        assert await flush_arm_states(redis, asession, batch_size=2) == 2
+        assert await redis.execute_command("LLEN", PROCESSING_OBSERVATIONS_KEY) == 0
+        assert await flush_arm_states(redis, asession, batch_size=2) == 1
+
+        n_trials = (
+            await asession.execute(
+                select(ExperimentBaseDB.n_trials).where(
+                    ExperimentBaseDB.experiment_id == experiment_id
+                )
+            )
+        ).scalar_one()
+        assert n_trials == 3
+        await delete_arm_states(redis, [arm.arm_id])
+
+    async def test_batch_replayed_after_commit_is_not_written_again(
+        self,
+        create_mab: dict,
+        admin_user_id: int,
+        redis: aioredis.Redis,
+        asession: AsyncSession,
+        monkeypatch: MonkeyPatch,
+    ) -> None:
+        experiment_id = create_mab["experiment_id"]
+        arm = ArmResponse.model_validate(create_mab["arms"][0])
+        for outcome in [1, 0]:
+            await update_arm_state(
+                redis,
+                experiment_id,
+                arm,
+                ArmPriors.BETA,
+                RewardLikelihood.BERNOULLI,
+                outcome,
+                admin_user_id,
+            )
+
+        async def fail_finish(*args: object, **kwargs: object) -> None:
+            raise RuntimeError("finish failed")
+
+        with monkeypatch.context() as m:
+            m.setattr(arm_state, "finish_batch", fail_finish)
+            with raises(RuntimeError):
+                await flush_arm_states(redis, asession, batch_size=100)
+
+        # The committed batch is still in the processing list, and its replay
+        # only removes it
+        assert await redis.execute_command("LLEN", PROCESSING_OBSERVATIONS_KEY) == 2
+        assert await flush_arm_states(redis, asession, batch_size=100) == 2
+        assert await redis.execute_command("LLEN", PROCESSING_OBSERVATIONS_KEY) == 0
+
+        n_trials = (
+            await asession.execute(
+                select(ExperimentBaseDB.n_trials).where(
+                    ExperimentBaseDB.experiment_id == experiment_id
+                )
+            )
+        ).scalar_one()
+        assert n_trials == 2
+        await delete_arm_states(redis, [arm.arm_id])
@@ -1,12 +1,27 @@
+import asyncio
 import copy
 import os
+import time
 from typing import Generator
 
 from fastapi.testclient import TestClient
-from pytest import FixtureRequest, fixture, mark
+from pytest import FixtureRequest, approx, fixture, mark
+from sqlalchemy import event, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.orm import Session
 
-from backend.app.mab.models import MABArmDB, MultiArmedBanditDB
+from backend.app.database import get_sqlalchemy_async_engine
+from backend.app.mab.models import (
+    MABArmDB,
+    MABObservationDB,
+    MultiArmedBanditDB,
+    get_mab_sample_by_id,
+    get_mab_samples_by_ids,
+    increment_mab_n_trials,
+    update_mab_arm_by_rewards,
+)
+from backend.app.mab.sampling_utils import update_arm_normal
 from backend.app.models import NotificationsDB
 
 base_beta_binom_payload = {
@@ -60,6 +75,16 @@ def admin_token(client: TestClient) -> str:
     return token
 
 
+def get_plan_relations(plan: dict) -> list[str]:
+    """
+    Get the names of the relations scanned by a JSON query plan.
+    """
+    relations = [plan["Relation Name"]] if "Relation Name" in plan else []
+    for subplan in plan.get("Plans", []):
+        relations.extend(get_plan_relations(subplan))
+    return relations
+
+
 @fixture
 def clean_mabs(db_session: Session) -> Generator:
     yield
@@ -211,6 +236,366 @@ class TestMab:
         )
         assert response.status_code == 200
 
+    @mark.parametrize("n, expected_response", [(50, 200), (0, 422)])
+    def test_draw_arms_batch(
+        self,
+        client: TestClient,
+        create_mabs: list,
+        n: int,
+        expected_response: int,
+    ) -> None:
+        mab = create_mabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        response = client.get(
+            f"/mab/{mab['experiment_id']}/draw/batch",
+            params={"n": n},
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == expected_response
+        if expected_response == 200:
+            batch = response.json()
+            arm_ids = {str(arm["arm_id"]) for arm in mab["arms"]}
+            assert len(batch["arm_ids"]) == n
+            assert set(batch["arm_counts"]) == arm_ids
+            assert sum(batch["arm_counts"].values()) == n
+
+    async def test_draw_sample_ignores_observations(
+        self,
+        client: TestClient,
+        create_mabs: list,
+        admin_user_id: int,
+        asession: AsyncSession,
+        statement_log: list[str],
+    ) -> None:
+        mab = create_mabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        for outcome in [1, 0, 1, 1, 0]:
+            response = client.put(
+                f"/mab/{mab['experiment_id']}/{mab['arms'][0]['arm_id']}/{outcome}",
+                headers={"Authorization": f"Bearer {api_key}"},
+            )
+            assert response.status_code == 200
+
+        sample = await get_mab_sample_by_id(
+            mab["experiment_id"], admin_user_id, asession
+        )
+
+        assert sample is not None
+        assert len(statement_log) == 1
+        assert "observations" not in statement_log[0]
+        assert [arm.arm_id for arm in sample.arms] == sorted(
+            arm["arm_id"] for arm in mab["arms"]
+        )
+
+    @mark.parametrize("create_mabs", [3], indirect=True)
+    async def test_draw_arm_per_experiment(
+        self,
+        client: TestClient,
+        create_mabs: list,
+        admin_user_id: int,
+        asession: AsyncSession,
+        statement_log: list[str],
+    ) -> None:
+        experiment_ids = [mab["experiment_id"] for mab in create_mabs]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        response = client.post(
+            "/mab/draw",
+            json=experiment_ids[::-1],
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == 200
+        draws = response.json()
+        assert [d["experiment_id"] for d in draws] == experiment_ids[::-1]
+        for draw, mab in zip(draws, create_mabs[::-1]):
+            assert draw["arm"]["arm_id"] in [arm["arm_id"] for arm in mab["arms"]]
+
+        statement_log.clear()
+        samples = await get_mab_samples_by_ids(experiment_ids, admin_user_id, asession)
+        assert sorted(samples) == sorted(experiment_ids)
+        assert len(statement_log) == 1
+
+    def test_draw_arm_per_experiment_missing(
+        self, client: TestClient, create_mabs: list
+    ) -> None:
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        response = client.post(
+            "/mab/draw",
+            json=[create_mabs[0]["experiment_id"], 999],
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == 404
+        assert "999" in response.json()["detail"]
+
+    async def test_concurrent_updates_are_not_lost(
+        self,
+        create_mabs: list,
+        admin_user_id: int,
+        async_engine: AsyncEngine,
+        asession: AsyncSession,
+    ) -> None:
+        mab = create_mabs[0]
+        arm = mab["arms"][0]
+
+        async def apply_reward(reward: float) -> None:
+            async with AsyncSession(async_engine) as session:
+                experiment = await increment_mab_n_trials(
+                    mab["experiment_id"], admin_user_id, 1, session
+                )
+                assert experiment is not None
+                await update_mab_arm_by_rewards(
+                    mab["experiment_id"],
+                    arm["arm_id"],
+                    experiment.prior_type,
+                    experiment.reward_type,
+                    n_rewards=1,
+                    reward_sum=reward,
+                    asession=session,
+                )
+                await session.commit()
+
+        await asyncio.gather(*[apply_reward(i % 2) for i in range(20)])
+
+        sample = await get_mab_sample_by_id(
+            mab["experiment_id"], admin_user_id, asession
+        )
+        assert sample is not None
+        updated = [a for a in sample.arms if a.arm_id == arm["arm_id"]][0]
+        assert (updated.alpha, updated.beta) == (arm["alpha"] + 10, arm["beta"] + 10)
+        n_trials = (
+            await asession.execute(
+                select(MultiArmedBanditDB.n_trials).where(
+                    MultiArmedBanditDB.experiment_id == mab["experiment_id"]
+                )
+            )
+        ).scalar_one()
+        assert n_trials == 20
+
+    def test_normal_update_matches_conjugate_update(
+        self, client: TestClient, admin_token: str
+    ) -> None:
+        response = client.post(
+            "/mab",
+            json=base_normal_payload,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        mab = response.json()
+        arm = mab["arms"][0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+
+        mu, sigma = arm["mu"], arm["sigma"]
+        for reward in [1.5, -0.5, 4.0]:
+            response = client.put(
+                f"/mab/{mab['experiment_id']}/{arm['arm_id']}/{reward}",
+                headers={"Authorization": f"Bearer {api_key}"},
+            )
+            mu, sigma = update_arm_normal(mu, sigma, reward, 1.0)
+        client.delete(
+            f"/mab/{mab['experiment_id']}",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+
+        assert response.status_code == 200
+        assert response.json()["mu"] == approx(mu)
+        assert response.json()["sigma"] == approx(sigma)
+
+    def test_update_arm_single_unit_of_work(
+        self, client: TestClient, create_mabs: list
+    ) -> None:
+        mab = create_mabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        engine = get_sqlalchemy_async_engine().sync_engine
+        statements: list[str] = []
+        commits: list[object] = []
+
+        def log_statement(*args: object) -> None:
+            statements.append(str(args[2]))
+
+        def log_commit(conn: object) -> None:
+            commits.append(conn)
+
+        event.listen(engine, "before_cursor_execute", log_statement)
+        event.listen(engine, "commit", log_commit)
+        try:
+            response = client.put(
+                f"/mab/{mab['experiment_id']}/{mab['arms'][0]['arm_id']}/1",
+                headers={"Authorization": f"Bearer {api_key}"},
+            )
+        finally:
+            event.remove(engine, "before_cursor_execute", log_statement)
+            event.remove(engine, "commit", log_commit)
+
+        assert response.status_code == 200
+        # API key lookup, n_trials and arm updates, observation insert
+        assert len(statements) == 4
+        assert len(commits) == 1
+
+        response = client.get(
+            f"/mab/{mab['experiment_id']}/outcomes",
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert len(response.json()) == 1
+
+    async def test_update_arm_invalid_outcome(
+        self, client: TestClient, create_mabs: list, asession: AsyncSession
+    ) -> None:
+        mab = create_mabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+
+        response = client.put(
+            f"/mab/{mab['experiment_id']}/{mab['arms'][0]['arm_id']}/2",
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+
+        assert response.status_code == 400
+        n_trials = (
+            await asession.execute(
+                select(MultiArmedBanditDB.n_trials).where(
+                    MultiArmedBanditDB.experiment_id == mab["experiment_id"]
+                )
+            )
+        ).scalar_one()
+        assert n_trials == 0
+
+    def test_bulk_outcomes(self, client: TestClient, create_mabs: list) -> None:
+        mab = create_mabs[0]
+        arm_1, arm_2 = mab["arms"]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        outcomes = [
+            {"arm_id": arm_1["arm_id"], "reward": reward} for reward in [1, 1, 0, 1]
+        ] + [{"arm_id": arm_2["arm_id"], "reward": 0}]
+
+        response = client.post(
+            f"/mab/{mab['experiment_id']}/outcomes/bulk",
+            json=outcomes,
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == 200
+        updated = {arm["arm_id"]: arm for arm in response.json()}
+        assert updated[arm_1["arm_id"]]["alpha"] == arm_1["alpha"] + 3
+        assert updated[arm_1["arm_id"]]["beta"] == arm_1["beta"] + 1
+        assert updated[arm_2["arm_id"]]["alpha"] == arm_2["alpha"]
+        assert updated[arm_2["arm_id"]]["beta"] == arm_2["beta"] + 1
+
+        response = client.get(
+            f"/mab/{mab['experiment_id']}/outcomes",
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert len(response.json()) == len(outcomes)
+
+    @mark.parametrize("by_arm", [False, True])
+    async def test_observation_queries_prune_partitions(
+        self,
+        create_mabs: list,
+        admin_user_id: int,
+        asession: AsyncSession,
+        by_arm: bool,
+    ) -> None:
+        mab = create_mabs[0]
+        statement = (
+            select(MABObservationDB)
+            .where(MABObservationDB.user_id == admin_user_id)
+            .where(MABObservationDB.experiment_id == mab["experiment_id"])
+            .order_by(MABObservationDB.observed_datetime_utc)
+        )
+        if by_arm:
+            statement = statement.where(
+                MABObservationDB.arm_id == mab["arms"][0]["arm_id"]
+            )
+        sql = statement.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+
+        plan = (
+            await asession.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+        ).scalar_one()
+
+        relations = get_plan_relations(plan[0]["Plan"])
+        assert len(relations) == 1
+        assert relations[0].startswith("observations_base_p")
+
+    @mark.parametrize(
+        "outcome, expected_response",
+        [({"reward": 2}, 400), ({"arm_id": 999, "reward": 1}, 404)],
+    )
+    def test_bulk_outcomes_invalid(
+        self,
+        client: TestClient,
+        create_mabs: list,
+        outcome: dict,
+        expected_response: int,
+    ) -> None:
+        mab = create_mabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        outcomes = [
+            {"arm_id": mab["arms"][0]["arm_id"], "reward": 1},
+            {"arm_id": mab["arms"][0]["arm_id"], **outcome},
+        ]
+
+        response = client.post(
+            f"/mab/{mab['experiment_id']}/outcomes/bulk",
+            json=outcomes,
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == expected_response
+
+        response = client.get(
+            f"/mab/{mab['experiment_id']}/outcomes",
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert len(response.json()) == 0
+
+    @mark.slow
+    def test_bulk_outcomes_throughput(
+        self, client: TestClient, create_mabs: list
+    ) -> None:
+        mab = create_mabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        n_outcomes = 10000
+        outcomes = [
+            {"arm_id": mab["arms"][i % 2]["arm_id"], "reward": i % 3 % 2}
+            for i in range(n_outcomes)
+        ]
+
+        start = time.perf_counter()
+        response = client.post(
+            f"/mab/{mab['experiment_id']}/outcomes/bulk",
+            json=outcomes,
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        elapsed = time.perf_counter() - start
+
+        assert response.status_code == 200
+        print(f"Bulk outcomes: {n_outcomes / elapsed:.0f} rows/sec")
+
+    @mark.slow
+    def test_outcomes_scan_throughput(
+        self, client: TestClient, create_mabs: list
+    ) -> None:
+        mab = create_mabs[0]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        n_outcomes = 10000
+        outcomes = [
+            {"arm_id": mab["arms"][i % 2]["arm_id"], "reward": i % 3 % 2}
+            for i in range(n_outcomes)
+        ]
+        response = client.post(
+            f"/mab/{mab['experiment_id']}/outcomes/bulk",
+            json=outcomes,
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.status_code == 200
+
+        start = time.perf_counter()
+        response = client.get(
+            f"/mab/{mab['experiment_id']}/outcomes",
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        elapsed = time.perf_counter() - start
+
+        assert response.status_code == 200
+        assert len(response.json()) == n_outcomes
+        print(f"Outcomes scan: {n_outcomes / elapsed:.0f} rows/sec")
+
 
 class TestNotifications:
     @fixture()
@@ -0,0 +1,165 @@
+import os
+from typing import Generator
+
+import numpy as np
+from fastapi.testclient import TestClient
+from pytest import fixture
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.app.contextual_mab.models import (
+    ContextualObservationDB,
+    get_contextual_arm_history,
+)
+from backend.app.mab.models import MABObservationDB
+from backend.app.observation_writer import (
+    ObservationRecord,
+    copy_observation_batches,
+    copy_observations,
+)
+
+from .test_cmabs import base_normal_payload
+from .test_mabs import base_beta_binom_payload
+
+
+@fixture
+def create_mab(client: TestClient, admin_token: str) -> Generator:
+    response = client.post(
+        "/mab",
+        json=base_beta_binom_payload,
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    yield response.json()
+    client.delete(
+        f"/mab/{response.json()['experiment_id']}",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+
+
+@fixture
+def create_cmab(client: TestClient, admin_token: str) -> Generator:
+    response = client.post(
+        "/contextual_mab",
+        json=base_normal_payload,
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+    yield response.json()
+    client.delete(
+        f"/contextual_mab/{response.json()['experiment_id']}",
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+
+
+def get_mab_records(mab: dict, user_id: int, n: int) -> list[ObservationRecord]:
+    return [
+        ObservationRecord(
+            arm_id=mab["arms"][i % 2]["arm_id"],
+            experiment_id=mab["experiment_id"],
+            user_id=user_id,
+            reward=i % 2,
+        )
+        for i in range(n)
+    ]
+
+
+class TestObservationWriter:
+    async def test_copy_returns_ids(
+        self, create_mab: dict, admin_user_id: int, asession: AsyncSession
+    ) -> None:
+        records = get_mab_records(create_mab, admin_user_id, 5)
+
+        observation_ids = await copy_observations(records, asession)
+        await asession.commit()
+
+        observations = (
+            (
+                await asession.execute(
+                    select(MABObservationDB).where(
+                        MABObservationDB.experiment_id == create_mab["experiment_id"]
+                    )
+                )
+            )
+            .scalars()
+            .all()
+        )
+        by_id = {obs.observation_id: obs for obs in observations}
+        assert len(observation_ids) == len(set(observation_ids)) == 5
+        assert set(by_id) == set(observation_ids)
+        for observation_id, record in zip(observation_ids, records):
+            assert by_id[observation_id].arm_id == record.arm_id
+            assert by_id[observation_id].reward == record.reward
+
+    async def test_copy_contextual(
+        self, create_cmab: dict, admin_user_id: int, asession: AsyncSession
+    ) -> None:
+        arm_id = create_cmab["arms"][0]["arm_id"]
+        records = [
+            ObservationRecord(
+                arm_id=arm_id,
+                experiment_id=create_cmab["experiment_id"],
+                user_id=admin_user_id,
+                reward=float(i),
+                context_val=[1.0, float(i)],
+            )
+            for i in range(3)
+        ]
+
+        observation_ids = await copy_observations(records, asession)
+        await asession.commit()
+
+        observations = (
+            (
+                await asession.execute(
+                    select(ContextualObservationDB)
+                    .where(ContextualObservationDB.observation_id.in_(observation_ids))
+                    .order_by(ContextualObservationDB.observation_id)
+                )
+            )
+            .scalars()
+            .all()
+        )
+        expected_contexts = [[1.0, 0.0], [1.0, 1.0], [1.0, 2.0]]
+        assert [obs.context_val for obs in observations] == expected_contexts
+        rewards, contexts = await get_contextual_arm_history(arm_id, asession)
+        assert np.allclose(rewards, [0.0, 1.0, 2.0])
+        assert np.allclose(contexts, expected_contexts)
+
+    async def test_copy_joins_session_transaction(
+        self,
+        client: TestClient,
+        create_mab: dict,
+        admin_user_id: int,
+        asession: AsyncSession,
+    ) -> None:
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        await copy_observations(get_mab_records(create_mab, admin_user_id, 3), asession)
+        await asession.rollback()
+
+        response = client.get(
+            f"/mab/{create_mab['experiment_id']}/outcomes",
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert response.json() == []
+
+    async def test_copy_batches(
+        self,
+        client: TestClient,
+        create_mab: dict,
+        admin_user_id: int,
+        asession: AsyncSession,
+    ) -> None:
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        records = (r for r in get_mab_records(create_mab, admin_user_id, 7))
+
+        observation_ids = await copy_observation_batches(
+            records, asession, batch_size=3
+        )
+
+        assert len(set(observation_ids)) == 7
+        response = client.get(
+            f"/mab/{create_mab['experiment_id']}/outcomes",
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+        assert sorted(obs["observation_id"] for obs in response.json()) == sorted(
+            observation_ids
+        )
@@ -0,0 +1,131 @@
+import os
+from typing import Generator
+
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from pytest import fixture
+from redis import asyncio as aioredis
+
+from backend.app.config import REDIS_HOST
+from backend.app.posterior_cache import (
+    PosteriorCache,
+    get_or_load_posterior,
+    get_posterior_version_key,
+)
+
+from .test_mabs import base_beta_binom_payload
+
+
+class FakeSample(BaseModel):
+    experiment_id: int
+
+
+class TestPosteriorCache:
+    def test_hit_and_miss(self) -> None:
+        cache = PosteriorCache(maxsize=2)
+        cache.put(1, 10, 0, FakeSample(experiment_id=1))
+
+        assert cache.get(1, 10) is not None
+        assert cache.get(2, 10) is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_other_user_misses(self) -> None:
+        cache = PosteriorCache(maxsize=2)
+        cache.put(1, 10, 0, FakeSample(experiment_id=1))
+
+        assert cache.get(1, 11) is None
+
+    def test_lru_eviction(self) -> None:
+        cache = PosteriorCache(maxsize=2)
+        cache.put(1, 10, 0, FakeSample(experiment_id=1))
+        cache.put(2, 10, 0, FakeSample(experiment_id=2))
+        cache.get(1, 10)
+        cache.put(3, 10, 0, FakeSample(experiment_id=3))
+
+        assert cache.get(2, 10) is None
+        assert cache.get(1, 10) is not None
+        assert cache.evictions == 1
+        assert len(cache) == 2
+
+    def test_invalidate_drops_older_versions(self) -> None:
+        cache = PosteriorCache(maxsize=2)
+        cache.put(1, 10, 3, FakeSample(experiment_id=1))
+
+        cache.invalidate(1, 3)
+        assert cache.get(1, 10) is not None
+
+        cache.invalidate(1, 4)
+        assert cache.get(1, 10) is None
+
+    def test_stale_load_is_not_cached(self) -> None:
+        cache = PosteriorCache(maxsize=2)
+        cache.invalidate(1, 5)
+        cache.put(1, 10, 4, FakeSample(experiment_id=1))
+
+        assert cache.get(1, 10) is None
+
+    async def test_load_without_remembered_version_is_rechecked(self) -> None:
+        redis = await aioredis.from_url(REDIS_HOST)
+        version_key = get_posterior_version_key(-1)
+        await redis.set(version_key, 4)
+        cache = PosteriorCache(maxsize=1)
+        # The version announced for experiment -1 is pushed out of the record
+        cache.invalidate(-1, 4)
+        cache.invalidate(-2, 1)
+
+        async def load_during_update() -> FakeSample:
+            await redis.incr(version_key)
+            return FakeSample(experiment_id=-1)
+
+        try:
+            posterior = await get_or_load_posterior(
+                cache, redis, -1, 10, load_during_update
+            )
+            assert posterior is not None
+            assert cache.get(-1, 10) is None
+        finally:
+            await redis.delete(version_key)
+            await redis.aclose()
+
+    def test_disabled_cache(self) -> None:
+        cache = PosteriorCache(maxsize=0)
+        cache.put(1, 10, 0, FakeSample(experiment_id=1))
+
+        assert cache.get(1, 10) is None
+
+
+class TestCachedDraws:
+    @fixture
+    def create_mab(self, client: TestClient, admin_token: str) -> Generator:
+        response = client.post(
+            "/mab",
+            json=base_beta_binom_payload,
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+        yield response.json()
+        client.delete(
+            f"/mab/{response.json()['experiment_id']}",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+
+    def test_update_invalidates_cached_posterior(
+        self, client: TestClient, create_mab: dict, admin_user_id: int
+    ) -> None:
+        cache = client.app.state.posterior_cache  # type: ignore[attr-defined]
+        api_key = os.environ.get("ADMIN_API_KEY", "")
+        headers = {"Authorization": f"Bearer {api_key}"}
+        experiment_id = create_mab["experiment_id"]
+        arm_id = create_mab["arms"][0]["arm_id"]
+
+        client.get(f"/mab/{experiment_id}/draw", headers=headers)
+        hits = cache.hits
+        client.get(f"/mab/{experiment_id}/draw", headers=headers)
+        assert cache.hits == hits + 1
+
+        client.put(f"/mab/{experiment_id}/{arm_id}/1", headers=headers)
+        client.get(f"/mab/{experiment_id}/draw", headers=headers)
+        assert cache.hits == hits + 1
+
+        cached = cache.get(experiment_id, admin_user_id)
+        arm = [a for a in cached.sample.arms if a.arm_id == arm_id][0]
+        assert arm.alpha == create_mab["arms"][0]["alpha"] + 1
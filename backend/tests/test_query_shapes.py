@@ -0,0 +1,325 @@
+"""
+Query shapes of the experiment endpoints.
+
+Each endpoint is called before and after the history of an experiment grows,
+and must send the same statements and read the same number of rows both
+times, reading at most the observation it saves. Eager loading of
+observations shows up here as a statement whose row count grows with the
+history, instead of as latency in production.
+"""
+
+import copy
+import os
+from typing import Any, Callable, Generator
+
+from fastapi.testclient import TestClient
+from pytest import FixtureRequest, fixture, mark
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .test_cmabs import base_normal_payload as base_cmab_payload
+from .test_mabs import base_beta_binom_payload as base_mab_payload
+
+Shape = list[tuple[str, int]]
+Endpoint = Callable[[dict], tuple[str, str, dict[str, Any]]]
+
+
+def reads_observations(statement: str) -> bool:
+    """
+    Whether the statement selects from the observations table.
+    """
+    return (
+        statement.lstrip().upper().startswith("SELECT")
+        and "observations_base" in statement
+    )
+
+
+def add_observations(
+    db_session: Session, experiment: dict, obs_type: str, n: int
+) -> None:
+    """
+    Insert `n` observations for the first arm of the experiment.
+    """
+    context_val = "ARRAY[1.0, 0.5]" if obs_type == "contextual_observations" else "NULL"
+    db_session.execute(
+        text(
+            f"""
+            INSERT INTO observations_base
+                (arm_id, experiment_id, user_id, observed_datetime_utc,
+                 obs_type, reward, context_val)
+            SELECT :arm_id, :experiment_id, e.user_id, now(), :obs_type, 1.0,
+                {context_val}
+            FROM generate_series(1, :n), experiments_base e
+            WHERE e.experiment_id = :experiment_id
+            """
+        ),
+        {
+            "arm_id": experiment["arms"][0]["arm_id"],
+            "experiment_id": experiment["experiment_id"],
+            "obs_type": obs_type,
+            "n": n,
+        },
+    )
+    db_session.commit()
+
+
+def get_headers(auth: str, admin_token: str) -> dict:
+    """
+    Get the headers for an endpoint authenticated with the API key or a token.
+    """
+    token = os.environ.get("ADMIN_API_KEY", "") if auth == "key" else admin_token
+    return {"Authorization": f"Bearer {token}"}
+
+
+def get_shape(
+    client: TestClient,
+    app_statement_log: Shape,
+    method: str,
+    url: str,
+    **kwargs: Any,
+) -> Shape:
+    """
+    Call the endpoint with a cold posterior cache and return the statements it
+    sent to the database with their row counts.
+    """
+    client.app.state.posterior_cache.clear()  # type: ignore[attr-defined]
+    app_statement_log.clear()
+    response = client.request(method, url, **kwargs)
+    assert response.status_code == 200, response.text
+    return list(app_statement_log)
+
+
+def create_experiment(
+    client: TestClient, admin_token: str, prefix: str, payload: dict
+) -> dict:
+    """
+    Create an experiment without notifications, so that updates do not
+    trigger them.
+    """
+    payload = copy.deepcopy(payload)
+    payload["notifications"]["onTrialCompletion"] = False
+    response = client.post(
+        prefix, json=payload, headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def get_context(cmab: dict) -> list[dict]:
+    """
+    Get a valid context for the contextual experiment.
+    """
+    return [
+        {"context_id": context["context_id"], "context_value": 1}
+        for context in cmab["contexts"]
+    ]
+
+
+mab_endpoints: dict[str, tuple[str, Endpoint]] = {
+    "list": ("token", lambda mab: ("GET", "/mab/", {})),
+    "get": ("token", lambda mab: ("GET", f"/mab/{mab['experiment_id']}", {})),
+    "draw": ("key", lambda mab: ("GET", f"/mab/{mab['experiment_id']}/draw", {})),
+    "draw_batch": (
+        "key",
+        lambda mab: (
+            "GET",
+            f"/mab/{mab['experiment_id']}/draw/batch",
+            {"params": {"n": 10}},
+        ),
+    ),
+    "draw_per_experiment": (
+        "key",
+        lambda mab: ("POST", "/mab/draw", {"json": [mab["experiment_id"]]}),
+    ),
+    "update": (
+        "key",
+        lambda mab: (
+            "PUT",
+            f"/mab/{mab['experiment_id']}/{mab['arms'][0]['arm_id']}/1",
+            {},
+        ),
+    ),
+    "update_bulk": (
+        "key",
+        lambda mab: (
+            "POST",
+            f"/mab/{mab['experiment_id']}/outcomes/bulk",
+            {"json": [{"arm_id": mab["arms"][1]["arm_id"], "reward": 1}]},
+        ),
+    ),
+}
+
+cmab_endpoints: dict[str, tuple[str, Endpoint]] = {
+    "list": ("token", lambda cmab: ("GET", "/contextual_mab/", {})),
+    "get": (
+        "token",
+        lambda cmab: ("GET", f"/contextual_mab/{cmab['experiment_id']}", {}),
+    ),
+    "draw": (
+        "key",
+        lambda cmab: (
+            "POST",
+            f"/contextual_mab/{cmab['experiment_id']}/draw",
+            {"json": get_context(cmab)},
+        ),
+    ),
+    "draw_batch": (
+        "key",
+        lambda cmab: (
+            "POST",
+            f"/contextual_mab/{cmab['experiment_id']}/draw/batch",
+            {"params": {"n": 10}, "json": get_context(cmab)},
+        ),
+    ),
+    "draw_contexts": (
+        "key",
+        lambda cmab: (
+            "POST",
+            f"/contextual_mab/{cmab['experiment_id']}/draw/contexts",
+            {"json": [get_context(cmab), get_context(cmab)]},
+        ),
+    ),
+    "update": (
+        "key",
+        lambda cmab: (
+            "PUT",
+            f"/contextual_mab/{cmab['experiment_id']}/{cmab['arms'][0]['arm_id']}/1",
+            {"params": {"reward": 1}, "json": get_context(cmab)},
+        ),
+    ),
+    "recalibrate": (
+        "token",
+        lambda cmab: (
+            "POST",
+            f"/contextual_mab/{cmab['experiment_id']}/"
+            f"{cmab['arms'][0]['arm_id']}/recalibrate",
+            {},
+        ),
+    ),
+    "refit": (
+        "token",
+        lambda cmab: ("POST", f"/contextual_mab/{cmab['experiment_id']}/refit", {}),
+    ),
+}
+
+experiment_types = {
+    "mab": ("/mab", base_mab_payload, "mab_observations", mab_endpoints),
+    "cmab": (
+        "/contextual_mab",
+        base_cmab_payload,
+        "contextual_observations",
+        cmab_endpoints,
+    ),
+}
+
+
+class TestQueryShapes:
+    @fixture
+    def experiment(
+        self, client: TestClient, admin_token: str, request: FixtureRequest
+    ) -> Generator[tuple[dict, str], None, None]:
+        prefix, payload, _, _ = experiment_types[request.param]
+        experiment = create_experiment(client, admin_token, prefix, payload)
+        yield experiment, request.param
+        client.delete(
+            f"{prefix}/{experiment['experiment_id']}",
+            headers={"Authorization": f"Bearer {admin_token}"},
+        )
+
+    @mark.parametrize(
+        "experiment, endpoint",
+        [("mab", name) for name in mab_endpoints]
+        + [("cmab", name) for name in cmab_endpoints],
+        indirect=["experiment"],
+    )
+    def test_shape_independent_of_history(
+        self,
+        client: TestClient,
+        admin_token: str,
+        db_session: Session,
+        app_statement_log: Shape,
+        experiment: tuple[dict, str],
+        endpoint: str,
+    ) -> None:
+        experiment_data, experiment_type = experiment
+        _, _, obs_type, endpoints = experiment_types[experiment_type]
+        auth, get_request = endpoints[endpoint]
+        method, url, kwargs = get_request(experiment_data)
+        headers = get_headers(auth, admin_token)
+
+        add_observations(db_session, experiment_data, obs_type, 2)
+        small_history = get_shape(
+            client, app_statement_log, method, url, headers=headers, **kwargs
+        )
+        add_observations(db_session, experiment_data, obs_type, 500)
+        large_history = get_shape(
+            client, app_statement_log, method, url, headers=headers, **kwargs
+        )
+
+        assert large_history == small_history
+        assert all(
+            rowcount <= 1
+            for statement, rowcount in large_history
+            if reads_observations(statement)
+        )
+
+    @mark.parametrize("experiment", ["mab", "cmab"], indirect=True)
+    def test_outcomes_read_each_observation_once(
+        self,
+        client: TestClient,
+        admin_token: str,
+        db_session: Session,
+        app_statement_log: Shape,
+        experiment: tuple[dict, str],
+    ) -> None:
+        experiment_data, experiment_type = experiment
+        prefix, _, obs_type, _ = experiment_types[experiment_type]
+        url = f"{prefix}/{experiment_data['experiment_id']}/outcomes"
+        headers = get_headers("key", admin_token)
+
+        shapes = []
+        for n in [2, 500]:
+            add_observations(db_session, experiment_data, obs_type, n)
+            shapes.append(
+                get_shape(client, app_statement_log, "GET", url, headers=headers)
+            )
+
+        small_history, large_history = shapes
+        assert [s for s, _ in large_history] == [s for s, _ in small_history]
+        observation_reads = [
+            rowcount
+            for statement, rowcount in large_history
+            if reads_observations(statement)
+        ]
+        assert observation_reads == [502]
+
+    @mark.parametrize("experiment_type", ["mab", "cmab"])
+    def test_delete_does_not_read_history(
+        self,
+        client: TestClient,
+        admin_token: str,
+        db_session: Session,
+        app_statement_log: Shape,
+        experiment_type: str,
+    ) -> None:
+        prefix, payload, obs_type, _ = experiment_types[experiment_type]
+        headers = get_headers("token", admin_token)
+
+        shapes = []
+        for n in [0, 500]:
+            experiment = create_experiment(client, admin_token, prefix, payload)
+            if n:
+                add_observations(db_session, experiment, obs_type, n)
+            shapes.append(
+                get_shape(
+                    client,
+                    app_statement_log,
+                    "DELETE",
+                    f"{prefix}/{experiment['experiment_id']}",
+                    headers=headers,
+                )
+            )
+
+        no_history, large_history = shapes
+        assert [s for s, _ in large_history] == [s for s, _ in no_history]
+        assert not any(reads_observations(statement) for statement, _ in large_history)
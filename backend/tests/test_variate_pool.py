@@ -0,0 +1,78 @@
+import time
+
+import numpy as np
+from pytest import approx, mark
+
+from backend.app.variate_pool import NormalVariatePool, covariance_factor
+
+
+class TestNormalVariatePool:
+    def test_seeded_pools_are_reproducible(self) -> None:
+        pool_1 = NormalVariatePool(size=100, seed=42)
+        pool_2 = NormalVariatePool(size=100, seed=42)
+
+        for _ in range(10):
+            np.testing.assert_array_equal(
+                pool_1.standard_normal((3, 7)), pool_2.standard_normal((3, 7))
+            )
+
+    def test_reseed_restarts_stream(self) -> None:
+        pool = NormalVariatePool(size=100, seed=1)
+        first = pool.standard_normal(5).copy()
+        pool.standard_normal(50)
+
+        pool.seed(1)
+        np.testing.assert_array_equal(pool.standard_normal(5), first)
+
+    def test_refill_and_oversized_requests(self) -> None:
+        pool = NormalVariatePool(size=10, seed=0)
+
+        assert pool.standard_normal((4, 2)).shape == (4, 2)
+        assert pool.standard_normal((4, 2)).shape == (4, 2)
+        assert pool.standard_normal((5, 5)).shape == (5, 5)
+
+    def test_normal_moments(self) -> None:
+        pool = NormalVariatePool(size=2**16, seed=0)
+        samples = pool.normal(
+            loc=np.array([1.0, -2.0]), scale=np.array([0.5, 3.0]), size=(200000, 2)
+        )
+
+        assert samples.mean(axis=0) == approx([1.0, -2.0], abs=0.05)
+        assert samples.std(axis=0) == approx([0.5, 3.0], rel=0.02)
+
+    def test_multivariate_normal_covariance(self) -> None:
+        pool = NormalVariatePool(size=2**16, seed=0)
+        mean = np.array([[1.0, 2.0], [0.0, -1.0]])
+        covariance = np.array([[[2.0, 0.5], [0.5, 1.0]], [[1.0, 0.0], [0.0, 0.0]]])
+
+        samples = pool.multivariate_normal(
+            mean, covariance_factor(covariance), size=200000
+        )
+
+        assert samples.shape == (200000, 2, 2)
+        for k in range(2):
+            assert samples[:, k].mean(axis=0) == approx(mean[k], abs=0.05)
+            np.testing.assert_allclose(
+                np.cov(samples[:, k].T), covariance[k], atol=0.05
+            )
+
+    @mark.slow
+    def test_per_draw_cost(self) -> None:
+        n_draws, n_arms = 100000, 5
+        mus, sigmas = np.zeros(n_arms), np.ones(n_arms)
+        pool = NormalVariatePool(size=2**16, seed=0)
+
+        start = time.perf_counter()
+        for _ in range(n_draws):
+            np.random.normal(loc=mus, scale=sigmas)
+        legacy = (time.perf_counter() - start) / n_draws
+
+        start = time.perf_counter()
+        for _ in range(n_draws):
+            pool.normal(loc=mus, scale=sigmas)
+        pooled = (time.perf_counter() - start) / n_draws
+
+        print(
+            f"Per-draw cost for {n_arms} arms: numpy.random {legacy * 1e6:.2f}us, "
+            f"variate pool {pooled * 1e6:.2f}us"
+        )